@@ -0,0 +1,139 @@
+from qdrant_client.http.models import OptimizersConfigDiff, PointStruct
+import logging
+import time
+
+# Qdrant's default indexing threshold, used when the collection does not report one
+DEFAULT_INDEXING_THRESHOLD = 20000
+
+
+def build_points(documents, vectors, ids):
+    """
+    Builds Qdrant points with the same payload layout used by the Qdrant vector store.
+
+    Args:
+        documents (list): A list of documents.
+        vectors (list): The embedding of each document.
+        ids (list): The point id of each document.
+
+    Returns:
+        list: A list of points.
+    """
+    return [
+        PointStruct(id=point_id, vector=vector, payload={"page_content": doc.page_content, "metadata": doc.metadata})
+        for point_id, vector, doc in zip(ids, vectors, documents)
+    ]
+
+
+class BulkLoader:
+    """
+    Uploads points to a Qdrant collection with the client's upload_points, in batches and in parallel.
+
+    The batching, the parallel workers and the retries are those of the client. Used as a context
+    manager, it can also pause the HNSW indexing of the collection during the load
+    (indexing_threshold=0) and restore the previous threshold afterwards, so the index is built
+    once at the end instead of being updated for every batch.
+
+    Args:
+        client (QdrantClient): The Qdrant client.
+        collection_name (str): The name of the collection.
+        embeddings (Embeddings): The embeddings client used by add_documents().
+        batch_size (int): The number of points sent per request.
+        parallel (int): The number of batches upserted at the same time.
+        pause_indexing (bool): Whether to pause the indexing during the load.
+        max_retries (int): The number of retries of a failed batch.
+
+    Attributes:
+        points (int): The number of points uploaded.
+        seconds (float): The time spent inside the context.
+    """
+
+    def __init__(self, client, collection_name, embeddings=None, batch_size=128, parallel=1, pause_indexing=False, max_retries=3):
+        self.client = client
+        self.collection_name = collection_name
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+        self.parallel = parallel
+        self.pause_indexing = pause_indexing
+        self.max_retries = max_retries
+        self.points = 0
+        self.seconds = 0.0
+        self._indexing_threshold = None
+        self._start = None
+
+    def __enter__(self):
+        if self.pause_indexing:
+            config = self.client.get_collection(self.collection_name).config.optimizer_config
+            self._indexing_threshold = DEFAULT_INDEXING_THRESHOLD if config.indexing_threshold is None else config.indexing_threshold
+            self.client.update_collection(
+                collection_name=self.collection_name,
+                optimizers_config=OptimizersConfigDiff(indexing_threshold=0),
+            )
+            logging.info("Indexing paused for the bulk load")
+        self.points = 0
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.seconds = time.perf_counter() - self._start
+        if self.pause_indexing:
+            self.client.update_collection(
+                collection_name=self.collection_name,
+                optimizers_config=OptimizersConfigDiff(indexing_threshold=self._indexing_threshold),
+            )
+            logging.info(f"Indexing restored (indexing_threshold={self._indexing_threshold})")
+        logging.info(f"Bulk load finished: {self.stats()}")
+        return False
+
+    def upload(self, points):
+        """
+        Uploads a list of points in batches of batch_size, up to parallel batches at a time,
+        and waits until all of them are stored.
+
+        Args:
+            points (list): A list of points.
+
+        Returns:
+            list: The uploaded points.
+        """
+        if not points:
+            return points
+        self.client.upload_points(
+            collection_name=self.collection_name,
+            points=points,
+            batch_size=self.batch_size,
+            parallel=self.parallel,
+            max_retries=self.max_retries,
+            wait=True,
+        )
+        self.points += len(points)
+        return points
+
+    def add_documents(self, documents, ids):
+        """
+        Embeds a list of documents and uploads them.
+
+        Args:
+            documents (list): A list of documents.
+            ids (list): The point id of each document.
+
+        Returns:
+            list: The uploaded points.
+        """
+        if not documents:
+            return []
+        vectors = self.embeddings.embed_documents([doc.page_content for doc in documents])
+        return self.upload(build_points(documents, vectors, ids))
+
+    def stats(self):
+        """
+        Returns the throughput of the load.
+
+        Returns:
+            dict: The number of points, the elapsed seconds and the points per second.
+        """
+        seconds = self.seconds or (time.perf_counter() - self._start if self._start else 0.0)
+        return {
+            "points": self.points,
+            "seconds": round(seconds, 3),
+            "points_per_second": round(self.points / seconds, 1) if seconds else 0.0,
+        }
@@ -0,0 +1,116 @@
+"""
+Micro-benchmark of FastTextSplitter against RecursiveCharacterTextSplitter.
+
+Measures the throughput (MB/s) of both splitters and how close their chunk counts are, on the
+pages of the fetch cache (FETCH_CACHE_DIR) or, when the cache is empty, on a synthetic corpus with
+as many pages as ga4_documents.json.
+
+Usage:
+    python chunking_benchmark.py [--documents ../../src/streamlit_app_local/ga4_documents.json] [--runs 5]
+"""
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from chunking import FastTextSplitter
+from bs4 import BeautifulSoup
+import argparse
+import glob
+import json
+import os
+import random
+import statistics
+import time
+
+WORDS = ("analytics event session_start page_location engagement_time_msec user property report conversion "
+         "the a of to in and is for with on data stream tag configuration dimension metric audience").split()
+
+
+def load_corpus(documents_path, cache_dir, page_kb):
+    """
+    Loads the cached pages as text, or builds a synthetic corpus of the same number of pages as the documents file.
+
+    Args:
+        documents_path (str): The path of ga4_documents.json.
+        cache_dir (str): The directory of the fetch cache.
+        page_kb (int): The size of each synthetic page, in KB.
+
+    Returns:
+        list: The texts of the corpus.
+    """
+    pages = sorted(glob.glob(os.path.join(cache_dir, "*.html")))
+    if pages:
+        texts = []
+        for path in pages:
+            with open(path, encoding="utf-8") as f:
+                texts.append(BeautifulSoup(f.read(), "html.parser").get_text())
+        return texts
+    with open(documents_path) as f:
+        count = len(json.load(f))
+    generator = random.Random(42)
+    texts = []
+    for _ in range(count):
+        paragraphs, size = [], 0
+        while size < page_kb * 1024:
+            lines = ["%s." % " ".join(generator.choice(WORDS) for _ in range(generator.randint(4, 40))) for _ in range(generator.randint(1, 6))]
+            paragraph = "\n".join(lines)
+            paragraphs.append(paragraph)
+            size += len(paragraph) + 2
+        texts.append("\n\n".join(paragraphs))
+    return texts
+
+
+def measure(splitter, texts, runs):
+    """
+    Splits the corpus several times with a splitter.
+
+    Args:
+        splitter: A splitter with a split_text method.
+        texts (list): The texts of the corpus.
+        runs (int): The number of runs.
+
+    Returns:
+        tuple: The median throughput in MB/s and the chunk count of each text.
+    """
+    megabytes = sum(len(text.encode("utf-8")) for text in texts) / 1024 / 1024
+    timings, counts = [], []
+    for _ in range(runs):
+        start = time.perf_counter()
+        counts = [len(splitter.split_text(text)) for text in texts]
+        timings.append(time.perf_counter() - start)
+    return megabytes / statistics.median(timings), counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", default=os.path.join(os.path.dirname(__file__), "..", "..", "src", "streamlit_app_local", "ga4_documents.json"))
+    parser.add_argument("--cache-dir", default=os.getenv("FETCH_CACHE_DIR", ".cache/pages"))
+    parser.add_argument("--page-kb", type=int, default=40)
+    parser.add_argument("--chunk-size", type=int, default=int(os.getenv("CHUNK_SIZE", "3072")))
+    parser.add_argument("--chunk-overlap", type=int, default=int(os.getenv("CHUNK_OVERLAP", "500")))
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    texts = load_corpus(args.documents, args.cache_dir, args.page_kb)
+    baseline = RecursiveCharacterTextSplitter(
+        separators=["\n\n", "\n", " ", ""],
+        chunk_size=args.chunk_size,
+        chunk_overlap=args.chunk_overlap,
+        length_function=len
+    )
+    fast = FastTextSplitter(chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap)
+    baseline_speed, baseline_counts = measure(baseline, texts, args.runs)
+    fast_speed, fast_counts = measure(fast, texts, args.runs)
+    differences = [abs(a - b) / a for a, b in zip(baseline_counts, fast_counts) if a]
+    print(json.dumps({
+        "pages": len(texts),
+        "megabytes": round(sum(len(text.encode("utf-8")) for text in texts) / 1024 / 1024, 2),
+        "recursive_mb_per_second": round(baseline_speed, 2),
+        "fast_mb_per_second": round(fast_speed, 2),
+        "speedup": round(fast_speed / baseline_speed, 2),
+        "recursive_chunks": sum(baseline_counts),
+        "fast_chunks": sum(fast_counts),
+        "mean_chunk_count_difference": round(statistics.mean(differences), 4) if differences else 0.0,
+        "pages_with_same_chunk_count": sum(a == b for a, b in zip(baseline_counts, fast_counts)),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
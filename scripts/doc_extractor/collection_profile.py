@@ -0,0 +1,236 @@
+"""
+Provisioning of the Qdrant collection: vector size, storage profile and matching search params.
+
+Profiles:
+    float: full-precision vectors in RAM (the previous layout, and the default).
+    scalar: int8 scalar quantization in RAM, float originals on disk, rescored with 2x oversampling.
+    binary: binary quantization in RAM, float originals on disk, rescored with 3x oversampling.
+
+The metadata fields the app filters on (tool, subject, type, category and the ingestion date) get
+payload indexes, so filtered searches only visit the matching slice of the collection.
+
+Usage (recall of a profile against the exact float search of the same collection):
+    python collection_profile.py [--queries 100] [--k 10]
+"""
+from qdrant_client.http.models import (
+    BinaryQuantization, BinaryQuantizationConfig, Distance, HnswConfigDiff, PayloadSchemaType, QuantizationSearchParams,
+    ScalarQuantization, ScalarQuantizationConfig, ScalarType, SearchParams, VectorParams,
+)
+import argparse
+import logging
+import os
+import random
+import time
+
+# Output dimension of the OpenAI embedding models
+EMBEDDING_DIMENSIONS = {
+    "text-embedding-3-large": 3072,
+    "text-embedding-3-small": 1536,
+    "text-embedding-ada-002": 1536,
+}
+PROFILES = {
+    "float": {"quantization": None, "on_disk": False, "oversampling": None},
+    "scalar": {"quantization": "int8", "on_disk": True, "oversampling": 2.0},
+    "binary": {"quantization": "binary", "on_disk": True, "oversampling": 3.0},
+}
+HNSW_M = 16
+HNSW_EF_CONSTRUCT = 200
+HNSW_EF = 128
+# Payload indexes of the chunk metadata filtered by the app (the date is an ISO "YYYY-MM-DD" string)
+PAYLOAD_INDEXES = {
+    "metadata.tool": PayloadSchemaType.KEYWORD,
+    "metadata.subject": PayloadSchemaType.KEYWORD,
+    "metadata.type": PayloadSchemaType.KEYWORD,
+    "metadata.category": PayloadSchemaType.KEYWORD,
+    "metadata.date": PayloadSchemaType.DATETIME,
+}
+
+
+def embedding_dimension(model, embeddings=None):
+    """
+    Returns the dimension of the vectors of an embedding model.
+
+    Args:
+        model (str): The embedding model name.
+        embeddings (Embeddings): An embeddings client used to probe the dimension of models not in EMBEDDING_DIMENSIONS.
+
+    Returns:
+        int: The dimension.
+
+    Raises:
+        ValueError: If the model is unknown and no embeddings client was given.
+    """
+    if model in EMBEDDING_DIMENSIONS:
+        return EMBEDDING_DIMENSIONS[model]
+    if embeddings is None:
+        raise ValueError(f"Unknown dimension for the embedding model {model}")
+    return len(embeddings.embed_query("dimension"))
+
+
+def _profile(profile):
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown collection profile: {profile} (expected one of {', '.join(PROFILES)})")
+    return PROFILES[profile]
+
+
+def provision_collection(client, collection_name, model, profile="float", embeddings=None):
+    """
+    Creates a cosine collection sized for the embedding model, with the storage layout of a profile.
+
+    Args:
+        client (QdrantClient): The Qdrant client.
+        collection_name (str): The name of the collection.
+        model (str): The embedding model name.
+        profile (str): "float", "scalar" or "binary".
+        embeddings (Embeddings): An embeddings client used to probe the dimension of unknown models.
+
+    Returns:
+        bool: True once the collection is created.
+    """
+    settings = _profile(profile)
+    quantization = None
+    if settings["quantization"] == "int8":
+        quantization = ScalarQuantization(scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True))
+    elif settings["quantization"] == "binary":
+        quantization = BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=True))
+    dimension = embedding_dimension(model, embeddings)
+    logging.info(f"Creating collection {collection_name}: {dimension} dimensions, {profile} profile")
+    client.create_collection(
+        collection_name=collection_name,
+        vectors_config=VectorParams(size=dimension, distance=Distance.COSINE, on_disk=settings["on_disk"]),
+        hnsw_config=HnswConfigDiff(m=HNSW_M, ef_construct=HNSW_EF_CONSTRUCT),
+        quantization_config=quantization,
+    )
+    create_payload_indexes(client, collection_name)
+    return True
+
+
+def create_payload_indexes(client, collection_name):
+    """
+    Creates the payload indexes of PAYLOAD_INDEXES that the collection does not have yet.
+
+    Args:
+        client (QdrantClient): The Qdrant client.
+        collection_name (str): The name of the collection.
+
+    Returns:
+        list: The fields indexed by this call.
+    """
+    existing = client.get_collection(collection_name).payload_schema or {}
+    created = []
+    for field, schema in PAYLOAD_INDEXES.items():
+        if field in existing:
+            continue
+        client.create_payload_index(collection_name=collection_name, field_name=field, field_schema=schema)
+        created.append(field)
+    if created:
+        logging.info(f"Created payload indexes on {collection_name}: {', '.join(created)}")
+    return created
+
+
+def collection_profile(client, collection_name):
+    """
+    Returns the profile of an existing collection, read from its quantization config.
+
+    Args:
+        client (QdrantClient): The Qdrant client.
+        collection_name (str): The name of the collection.
+
+    Returns:
+        str: "float", "scalar" or "binary". "float" if the collection cannot be read.
+    """
+    try:
+        quantization = client.get_collection(collection_name).config.quantization_config
+    except Exception as e:
+        logging.warning(f"Could not read the config of {collection_name}, assuming the float profile: {e}")
+        return "float"
+    if isinstance(quantization, ScalarQuantization):
+        return "scalar"
+    if isinstance(quantization, BinaryQuantization):
+        return "binary"
+    return "float"
+
+
+def search_params(profile):
+    """
+    Returns the search params that match a profile: the HNSW ef and, for the quantized profiles, rescoring with oversampling.
+
+    Args:
+        profile (str): "float", "scalar" or "binary".
+
+    Returns:
+        SearchParams: The search params.
+    """
+    settings = _profile(profile)
+    if settings["quantization"] is None:
+        return SearchParams(hnsw_ef=HNSW_EF)
+    return SearchParams(
+        hnsw_ef=HNSW_EF,
+        quantization=QuantizationSearchParams(ignore=False, rescore=True, oversampling=settings["oversampling"]),
+    )
+
+
+def recall_check(client, collection_name, profile, queries=100, k=10, seed=0):
+    """
+    Measures the recall@k of the profile's search against the exact float search, using stored vectors as queries.
+
+    Args:
+        client (QdrantClient): The Qdrant client.
+        collection_name (str): The name of the collection.
+        profile (str): The profile whose search params are checked.
+        queries (int): The number of query vectors sampled from the collection.
+        k (int): The number of results compared per query.
+        seed (int): The seed of the sample.
+
+    Returns:
+        dict: The recall@k and the mean latency of both searches in milliseconds.
+    """
+    ids, offset = [], None
+    while True:
+        batch, offset = client.scroll(collection_name=collection_name, limit=10000, offset=offset, with_payload=False, with_vectors=False)
+        ids.extend(point.id for point in batch)
+        if offset is None:
+            break
+    sample_ids = random.Random(seed).sample(ids, min(queries, len(ids)))
+    sample = client.retrieve(collection_name=collection_name, ids=sample_ids, with_vectors=True) if sample_ids else []
+    exact = SearchParams(exact=True, quantization=QuantizationSearchParams(ignore=True))
+    params = search_params(profile)
+    found, expected, exact_seconds, profile_seconds = 0, 0, 0.0, 0.0
+    for point in sample:
+        start = time.perf_counter()
+        baseline = client.search(collection_name=collection_name, query_vector=point.vector, limit=k, search_params=exact)
+        exact_seconds += time.perf_counter() - start
+        start = time.perf_counter()
+        results = client.search(collection_name=collection_name, query_vector=point.vector, limit=k, search_params=params)
+        profile_seconds += time.perf_counter() - start
+        expected += len(baseline)
+        found += len({hit.id for hit in baseline} & {hit.id for hit in results})
+    return {
+        "profile": profile,
+        "queries": len(sample),
+        f"recall@{k}": round(found / expected, 4) if expected else 0.0,
+        "exact_ms": round(1000 * exact_seconds / len(sample), 2) if sample else 0.0,
+        "profile_ms": round(1000 * profile_seconds / len(sample), 2) if sample else 0.0,
+    }
+
+
+def main():
+    from qdrant_client import QdrantClient
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--collection", default=os.getenv("COLLECTION_NAME"))
+    parser.add_argument("--profile", default=None, help="Defaults to the profile of the collection")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    client = QdrantClient(url=os.getenv("QDRANT_URL"), port=int(os.getenv("QDRANT_PORT", "6333")), api_key=os.getenv("QDRANT_API_KEY"))
+    profile = args.profile or collection_profile(client, args.collection)
+    print(recall_check(client, args.collection, profile, queries=args.queries, k=args.k))
+
+
+if __name__ == "__main__":
+    main()
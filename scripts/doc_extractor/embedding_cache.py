@@ -0,0 +1,135 @@
+from langchain_core.embeddings import Embeddings
+from langchain_openai import OpenAIEmbeddings
+from array import array
+from functools import lru_cache
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+
+# SQLite limits the number of variables of a single statement
+_LOOKUP_BATCH_SIZE = 500
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    An embeddings client that keeps every document embedding in a local SQLite file.
+
+    The vectors are keyed by the embedding model and the sha256 of the text, so a text that was
+    already embedded by any ingestion entry point is never sent to the API again.
+
+    Args:
+        embeddings (Embeddings): The embeddings client used for the cache misses.
+        model (str): The embedding model name, part of the cache key.
+        path (str): The path of the SQLite file.
+
+    Attributes:
+        hits (int): The number of texts served from the cache.
+        misses (int): The number of texts sent to the embeddings client.
+    """
+
+    def __init__(self, embeddings, model, path):
+        self.embeddings = embeddings
+        self.model = model
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (model TEXT, hash TEXT, vector BLOB, PRIMARY KEY (model, hash))"
+        )
+        self._connection.commit()
+
+    @staticmethod
+    def _hash(text):
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _lookup(self, hashes):
+        found = {}
+        with self._lock:
+            for start in range(0, len(hashes), _LOOKUP_BATCH_SIZE):
+                batch = hashes[start:start + _LOOKUP_BATCH_SIZE]
+                rows = self._connection.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({','.join('?' * len(batch))})",
+                    [self.model, *batch],
+                )
+                for text_hash, vector in rows:
+                    found[text_hash] = array("f", vector).tolist()
+        return found
+
+    def _store(self, hashes, vectors):
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, hash, vector) VALUES (?, ?, ?)",
+                [(self.model, text_hash, array("f", vector).tobytes()) for text_hash, vector in zip(hashes, vectors)],
+            )
+            self._connection.commit()
+
+    def embed_documents(self, texts):
+        """
+        Embeds a list of texts, sending only the cache misses to the embeddings client in a single call.
+
+        Args:
+            texts (list): The texts to be embedded.
+
+        Returns:
+            list: The embedding of each text, in the same order.
+        """
+        hashes = [self._hash(text) for text in texts]
+        found = self._lookup(list(set(hashes)))
+        missing = {}
+        for text_hash, text in zip(hashes, texts):
+            if text_hash not in found:
+                missing.setdefault(text_hash, text)
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            self._store(list(missing), vectors)
+            found.update(zip(missing, vectors))
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        logging.info(f"Embedding cache: {len(texts) - len(missing)} hits, {len(missing)} misses ({self.stats()})")
+        return [found[text_hash] for text_hash in hashes]
+
+    def embed_query(self, text):
+        """
+        Embeds a query. Queries are not cached.
+
+        Args:
+            text (str): The query.
+
+        Returns:
+            list: The embedding of the query.
+        """
+        return self.embeddings.embed_query(text)
+
+    def stats(self):
+        """
+        Returns the hit/miss counters of the cache.
+
+        Returns:
+            dict: The number of hits and misses and the hit rate.
+        """
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+
+@lru_cache(maxsize=None)
+def cached_embeddings(model, api_key=None, path=None):
+    """
+    Returns the process-wide cached embeddings client of a model, creating it on first use.
+
+    Args:
+        model (str): The OpenAI embedding model.
+        api_key (str): The OpenAI API key.
+        path (str): The path of the SQLite file. Defaults to the EMBEDDING_CACHE_PATH environment variable.
+
+    Returns:
+        CachedEmbeddings: The cached embeddings client.
+    """
+    path = path or os.getenv("EMBEDDING_CACHE_PATH", ".cache/embeddings.sqlite3")
+    return CachedEmbeddings(OpenAIEmbeddings(model=model, api_key=api_key), model, path)
@@ -0,0 +1,266 @@
+import aiohttp
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+from dataclasses import dataclass
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (compatible; martechito-doc-extractor)",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "en-US,en;q=0.5",
+}
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+_DONE = object()
+
+
+@dataclass
+class FetchResult:
+    """
+    The result of fetching a single URL.
+
+    Attributes:
+        url (str): The requested URL.
+        text (str): The response body.
+        status (int): The HTTP status returned by the server (304 when served from the cache).
+        from_cache (bool): Whether the body came from the disk cache.
+    """
+    url: str
+    text: str
+    status: int
+    from_cache: bool = False
+
+
+class ResponseCache:
+    """
+    An on-disk cache of HTTP responses that keeps the validators needed for conditional requests.
+
+    Each URL is stored as two files named after the sha256 of the URL: a JSON file with the
+    ETag/Last-Modified headers and a file with the body.
+
+    Args:
+        directory (str): The directory where the responses are stored.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{key}.json"), os.path.join(self.directory, f"{key}.html")
+
+    def get(self, url):
+        """
+        Returns the cached entry of a URL.
+
+        Args:
+            url (str): The URL.
+
+        Returns:
+            dict: The cached validators and body, or None if the URL is not cached.
+        """
+        meta_path, body_path = self._paths(url)
+        if not (os.path.exists(meta_path) and os.path.exists(body_path)):
+            return None
+        with open(meta_path) as f:
+            entry = json.load(f)
+        with open(body_path, encoding="utf-8") as f:
+            entry["body"] = f.read()
+        return entry
+
+    def conditional_headers(self, entry):
+        """
+        Builds the conditional request headers for a cached entry.
+
+        Args:
+            entry (dict): The cached entry, or None.
+
+        Returns:
+            dict: The If-None-Match/If-Modified-Since headers.
+        """
+        headers = {}
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def put(self, url, headers, body):
+        """
+        Stores a response if the server sent a validator for it.
+
+        Args:
+            url (str): The URL.
+            headers (Mapping): The response headers.
+            body (str): The response body.
+        """
+        etag, last_modified = headers.get("ETag"), headers.get("Last-Modified")
+        if not (etag or last_modified):
+            return
+        meta_path, body_path = self._paths(url)
+        with open(body_path, "w", encoding="utf-8") as f:
+            f.write(body)
+        with open(meta_path, "w") as f:
+            json.dump({"url": url, "etag": etag, "last_modified": last_modified}, f)
+
+
+class AsyncPageFetcher:
+    """
+    Fetches many URLs concurrently over a pooled aiohttp session.
+
+    Args:
+        cache_dir (str): The directory of the conditional-GET response cache. None disables the cache.
+        concurrency (int): The maximum number of requests in flight.
+        per_host (int): The maximum number of requests in flight to the same host.
+        timeout (int): The total timeout of each request, in seconds.
+        retries (int): The number of retries on connection errors and 429/5xx responses.
+        backoff (float): The wait before the first retry, in seconds, doubled on each further retry.
+        headers (dict): The headers sent with every request.
+
+    Attributes:
+        stats (dict): The number of downloaded, not modified and failed URLs of the last run.
+    """
+
+    def __init__(self, cache_dir=None, concurrency=16, per_host=4, timeout=30, retries=2, backoff=1.0, headers=None):
+        self.cache = ResponseCache(cache_dir) if cache_dir else None
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.headers = headers or DEFAULT_HEADERS
+        self.stats = {}
+
+    def _session(self):
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host)
+        return aiohttp.ClientSession(
+            connector=connector,
+            headers=self.headers,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+
+    async def _fetch(self, session, url):
+        entry = self.cache.get(url) if self.cache else None
+        headers = self.cache.conditional_headers(entry) if self.cache else {}
+        for attempt in range(self.retries + 1):
+            try:
+                async with session.get(url, headers=headers) as response:
+                    if response.status == 304 and entry:
+                        self.stats["not_modified"] += 1
+                        return FetchResult(url, entry["body"], 304, from_cache=True)
+                    if response.status in RETRY_STATUSES and attempt < self.retries:
+                        await asyncio.sleep(self.backoff * 2 ** attempt)
+                        continue
+                    # Other client errors (404, 410...) are final and are not retried
+                    if response.status >= 400:
+                        logging.error(f"Failed to fetch {url}: HTTP {response.status}")
+                        break
+                    body = await response.text()
+                    if self.cache:
+                        self.cache.put(url, response.headers, body)
+                    self.stats["downloaded"] += 1
+                    return FetchResult(url, body, response.status)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt < self.retries:
+                    await asyncio.sleep(self.backoff * 2 ** attempt)
+                    continue
+                logging.error(f"Failed to fetch {url}: {e}")
+        self.stats["failed"] += 1
+        return None
+
+    def fetch_all(self, urls):
+        """
+        Fetches all the URLs concurrently.
+
+        Args:
+            urls (list): The URLs to be fetched.
+
+        Returns:
+            list: A FetchResult for each URL, in the same order, or None for the URLs that failed.
+        """
+        results = [None] * len(urls)
+        for index, result in self.iter_fetch(urls):
+            results[index] = result
+        return results
+
+    def iter_fetch(self, urls, buffer_size=32):
+        """
+        Fetches all the URLs concurrently and yields each result as soon as it is ready.
+
+        The event loop runs in a background thread and hands the results over through a bounded
+        queue, so at most buffer_size fetched pages wait for the consumer.
+
+        The URLs may come from any iterable, which is consumed lazily: each URL starts being fetched
+        as soon as the iterable produces it, and at most buffer_size + concurrency URLs are taken
+        ahead of the consumer, so the memory does not grow with the length of the iterable.
+
+        Args:
+            urls (iterable): The URLs to be fetched.
+            buffer_size (int): The maximum number of fetched pages waiting to be consumed.
+
+        Yields:
+            tuple: The index of the URL in urls and its FetchResult (None if it failed).
+        """
+        self.stats = {"downloaded": 0, "not_modified": 0, "failed": 0}
+        results = queue.Queue(maxsize=buffer_size)
+        closed = threading.Event()
+
+        def put(item):
+            while not closed.is_set():
+                try:
+                    results.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        async def fetch(session, slots, index, url):
+            try:
+                result = await self._fetch(session, url)
+                await asyncio.get_running_loop().run_in_executor(None, put, (index, result))
+            finally:
+                slots.release()
+
+        async def fetch_all():
+            loop = asyncio.get_running_loop()
+            iterator = iter(urls)
+            slots = asyncio.Semaphore(buffer_size + self.concurrency)
+            tasks = set()
+            index = 0
+            async with self._session() as session:
+                while True:
+                    await slots.acquire()
+                    if closed.is_set():
+                        break
+                    url = await loop.run_in_executor(None, next, iterator, _DONE)
+                    if url is _DONE:
+                        break
+                    task = asyncio.create_task(fetch(session, slots, index, url))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                    index += 1
+                await asyncio.gather(*tasks)
+
+        def produce():
+            try:
+                asyncio.run(fetch_all())
+            except Exception as e:
+                put(e)
+            finally:
+                put(_DONE)
+
+        threading.Thread(target=produce, daemon=True).start()
+        try:
+            while True:
+                item = results.get()
+                if item is _DONE:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            closed.set()
+        logging.info(f"Fetched URLs: {self.stats}")
@@ -0,0 +1,292 @@
+from qdrant_client.http.models import FieldCondition, Filter, MatchValue, PointIdsList
+import hashlib
+import logging
+import re
+import uuid
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    """
+    Normalizes a text before hashing, so whitespace-only changes do not count as content changes.
+
+    Args:
+        text (str): The text to be normalized.
+
+    Returns:
+        str: The text with collapsed whitespace and no leading or trailing blanks.
+    """
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def content_hash(text):
+    """
+    Computes the sha256 hash of the normalized text.
+
+    Args:
+        text (str): The text to be hashed.
+
+    Returns:
+        str: The hexadecimal sha256 digest.
+    """
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+def point_id(source, chunk_hash):
+    """
+    Builds a deterministic Qdrant point id from the chunk source and its hash.
+
+    Args:
+        source (str): The URL (or object name) the chunk was extracted from.
+        chunk_hash (str): The content hash of the chunk.
+
+    Returns:
+        str: A UUID5 string, stable across runs for the same source and content.
+    """
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{source}#{chunk_hash}"))
+
+
+def stored_ids(client, collection_name, source, batch_size=1000):
+    """
+    Returns the ids of the points stored for a source.
+
+    Args:
+        client (QdrantClient): The Qdrant client.
+        collection_name (str): The name of the collection.
+        source (str): The URL (or object name) of the chunks.
+        batch_size (int): The number of points fetched per scroll request.
+
+    Returns:
+        set: The point ids, as strings.
+    """
+    ids, offset = set(), None
+    while True:
+        points, offset = client.scroll(
+            collection_name=collection_name,
+            scroll_filter=Filter(must=[FieldCondition(key="metadata.source", match=MatchValue(value=source))]),
+            limit=batch_size,
+            offset=offset,
+            with_payload=False,
+            with_vectors=False,
+        )
+        ids.update(str(point.id) for point in points)
+        if offset is None:
+            return ids
+
+
+class IngestionState:
+    """
+    Keeps the page and chunk hashes already stored in a Qdrant collection.
+
+    The hashes live in the point payloads (metadata.page_hash and metadata.chunk_hash), so the
+    state survives across Cloud Run instances without any extra storage. The pages whose chunks
+    were collapsed into another page's chunk (see NearDuplicateIndex) are recorded on that chunk,
+    the representative, in metadata.sources and metadata.merged_page_hashes: a page whose chunks
+    were all collapsed still counts as stored, and when a representative is deleted the pages
+    merged into it are listed in reprocess and marked as changed, so their content is re-ingested.
+
+    Args:
+        client (QdrantClient): The Qdrant client.
+        collection_name (str): The name of the collection.
+        version (str): Mixed into the page hashes, so changing it (e.g. the chunking parameters) makes every page count as changed.
+
+    Attributes:
+        page_hashes (dict): The page hash stored for each source.
+        point_ids (dict): The set of point ids stored for each source.
+        current_ids (dict): The point ids of the chunks seen in this run, for each source.
+        merged_sources (dict): The source and the merged {source: page hash} of each representative point.
+        reprocess (set): The sources that lost merged content in the last commit() and must be ingested again.
+    """
+
+    def __init__(self, client, collection_name, version=""):
+        self.client = client
+        self.collection_name = collection_name
+        self.version = version
+        self.page_hashes = {}
+        self.point_ids = {}
+        self.current_ids = {}
+        self.current_page_hashes = {}
+        self.merged_sources = {}
+        self.current_merges = {}
+        self.reprocess = set()
+
+    def load(self, batch_size=1000):
+        """
+        Scrolls the collection and loads the stored hashes and point ids for each source.
+
+        Args:
+            batch_size (int): The number of points fetched per scroll request.
+
+        Returns:
+            IngestionState: The loaded state.
+        """
+        self.page_hashes.clear()
+        self.point_ids.clear()
+        self.merged_sources.clear()
+        if not self.client.collection_exists(self.collection_name):
+            return self
+        offset = None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=self.collection_name,
+                limit=batch_size,
+                offset=offset,
+                with_payload=["metadata.source", "metadata.page_hash", "metadata.merged_page_hashes"],
+                with_vectors=False,
+            )
+            for point in points:
+                metadata = (point.payload or {}).get("metadata", {})
+                source = metadata.get("source")
+                if source is None:
+                    continue
+                self.point_ids.setdefault(source, set()).add(str(point.id))
+                if metadata.get("page_hash"):
+                    self.page_hashes[source] = metadata["page_hash"]
+                if metadata.get("merged_page_hashes"):
+                    self.merged_sources[str(point.id)] = (source, dict(metadata["merged_page_hashes"]))
+            if offset is None:
+                break
+        # A page whose chunks were all collapsed into other pages has no point of its own
+        for _, merged in self.merged_sources.values():
+            for merged_source, page_hash in merged.items():
+                if merged_source not in self.point_ids:
+                    self.page_hashes[merged_source] = page_hash
+        logging.info(f"Loaded ingestion state for {len(self.point_ids)} sources")
+        return self
+
+    def changed_documents(self, documents):
+        """
+        Stamps each document with its page hash and keeps only the new or changed ones.
+
+        Args:
+            documents (list): A list of documents.
+
+        Returns:
+            list: The documents whose normalized text differs from the stored one.
+        """
+        changed = []
+        for doc in documents:
+            page_hash = content_hash(f"{self.version}\n{doc.page_content}")
+            doc.metadata["page_hash"] = page_hash
+            if self.page_hashes.get(doc.metadata["source"]) != page_hash:
+                changed.append(doc)
+        logging.info(f"{len(changed)} of {len(documents)} documents are new or changed")
+        return changed
+
+    def new_chunks(self, chunks):
+        """
+        Assigns deterministic ids to the chunks and keeps only the ones not stored yet.
+        Can be called once per batch; the ids of every chunk seen are kept for commit().
+
+        Args:
+            chunks (list): A list of chunks (documents).
+
+        Returns:
+            tuple: The chunks to be embedded and their point ids.
+        """
+        new_chunks, ids, seen = [], [], set()
+        for chunk in chunks:
+            source = chunk.metadata["source"]
+            chunk_hash = content_hash(chunk.page_content)
+            chunk.metadata["chunk_hash"] = chunk_hash
+            chunk_id = point_id(source, chunk_hash)
+            self.current_ids.setdefault(source, set()).add(chunk_id)
+            self.current_page_hashes[source] = chunk.metadata["page_hash"]
+            if chunk_id in seen or chunk_id in self.point_ids.get(source, ()):
+                continue
+            seen.add(chunk_id)
+            new_chunks.append(chunk)
+            ids.append(chunk_id)
+        return new_chunks, ids
+
+    def merge(self, chunk, representative):
+        """
+        Records a chunk dropped as a near-duplicate of another chunk, the representative.
+        Pass it as the on_merge callback of NearDuplicateIndex.deduplicate().
+
+        Args:
+            chunk (Document): The dropped chunk, stamped by changed_documents().
+            representative (Document): The chunk kept in its place.
+        """
+        source = chunk.metadata["source"]
+        self.current_ids.setdefault(source, set())
+        self.current_page_hashes[source] = chunk.metadata["page_hash"]
+        representative_source = representative.metadata["source"]
+        if representative_source == source:
+            return
+        representative_id = point_id(representative_source, content_hash(representative.page_content))
+        merged = self.current_merges.setdefault(representative_id, (representative_source, {}))[1]
+        merged[source] = chunk.metadata["page_hash"]
+
+    def _commit_merges(self, stale, orphaned):
+        # The merges of the pages processed in this run (or orphaned) are replaced by the ones seen in this run
+        replaced = set(self.current_page_hashes) | orphaned
+        merged_sources = {}
+        for representative_id, (source, merged) in self.merged_sources.items():
+            if representative_id not in stale:
+                merged_sources[representative_id] = (source, {key: value for key, value in merged.items() if key not in replaced})
+        for representative_id, (source, merged) in self.current_merges.items():
+            merged_sources.setdefault(representative_id, (source, {}))[1].update(merged)
+        for representative_id, (source, merged) in merged_sources.items():
+            if merged != self.merged_sources.get(representative_id, (source, {}))[1]:
+                self.client.set_payload(
+                    collection_name=self.collection_name,
+                    payload={"sources": [source, *sorted(merged)], "merged_page_hashes": merged},
+                    points=[representative_id],
+                    key="metadata",
+                )
+        self.merged_sources = {key: value for key, value in merged_sources.items() if value[1]}
+
+    def _forget(self, sources):
+        # Clears the page hash of the sources, so this run or the next one ingests them again
+        for source in sources:
+            self.page_hashes.pop(source, None)
+            own = list(self.point_ids.get(source, ()))
+            if own:
+                self.client.set_payload(collection_name=self.collection_name, payload={"page_hash": ""}, points=own, key="metadata")
+
+    def commit(self):
+        """
+        Deletes the points that no longer match any chunk seen in this run for their source,
+        refreshes the page hash of the points kept from a previous run and stores the merged
+        sources of the representatives.
+
+        The pages merged into a deleted representative and not processed in this run lose part of
+        their content: they are marked as changed and listed in reprocess.
+
+        Returns:
+            int: The number of deleted points.
+        """
+        stale = []
+        for source, ids in self.current_ids.items():
+            previous = self.point_ids.get(source, set())
+            stale.extend(previous - ids)
+            kept = list(previous & ids)
+            if kept:
+                self.client.set_payload(
+                    collection_name=self.collection_name,
+                    payload={"page_hash": self.current_page_hashes[source]},
+                    points=kept,
+                    key="metadata",
+                )
+            self.point_ids[source] = ids
+            self.page_hashes[source] = self.current_page_hashes[source]
+        stale_ids = set(stale)
+        orphaned = {
+            merged_source
+            for representative_id, (_, merged) in self.merged_sources.items() if representative_id in stale_ids
+            for merged_source in merged
+        } - set(self.current_page_hashes)
+        self._commit_merges(stale_ids, orphaned)
+        self._forget(orphaned)
+        if stale:
+            self.client.delete(collection_name=self.collection_name, points_selector=PointIdsList(points=stale))
+        self.current_ids.clear()
+        self.current_page_hashes.clear()
+        self.current_merges.clear()
+        self.reprocess = orphaned
+        logging.info(f"Deleted {len(stale)} stale points")
+        if orphaned:
+            logging.info(f"{len(orphaned)} sources lost merged content and will be ingested again")
+        return len(stale)
@@ -1,18 +1,29 @@
 from qdrant_client import QdrantClient
-from qdrant_client.http.models import Distance, VectorParams
-from langchain_qdrant import Qdrant
-from langchain_openai import OpenAIEmbeddings
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.document_loaders import WebBaseLoader
+from langchain_community.document_loaders.web_base import _build_metadata
+from langchain_core.documents import Document
+from bs4 import BeautifulSoup
 from google.cloud import bigquery
+from google.cloud import storage
 from dotenv import load_dotenv
 from flask import Blueprint, request, jsonify
 from error_wrapper import error_wrapper
+from incremental import IngestionState
+from embedding_cache import cached_embeddings
+from fetcher import AsyncPageFetcher
+from content_extractor import extract_main_content
+from pipeline import Pipeline
+from chunking import FastTextSplitter
+from bulk_upsert import BulkLoader, build_points
+from dedup import NearDuplicateIndex
+from collection_profile import create_payload_indexes, provision_collection
+from watermark import ExtractionRun, read_watermark, write_watermark
 import nest_asyncio
 import logging
 import datetime
 import os
 from google.auth import default
+from google.cloud import bigquery_storage
 
 
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets.readonly',
@@ -28,13 +39,36 @@ PROJECT_NAME = os.getenv("PROJECT_NAME")
 QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
 QDRANT_URL = os.getenv("QDRANT_URL")
 QDRANT_PORT = os.getenv("QDRANT_PORT")
+QDRANT_GRPC_PORT = int(os.getenv("QDRANT_GRPC_PORT", "6334"))
+QDRANT_PREFER_GRPC = os.getenv("QDRANT_PREFER_GRPC", "false").lower() == "true"
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 DATASET = os.getenv("DATASET")
 TABLE = os.getenv("TABLE")
 COLLECTION_NAME = os.getenv("COLLECTION_NAME")
 CHUNK_SIZE = os.getenv("CHUNK_SIZE")
 CHUNK_OVERLAP = os.getenv("CHUNK_OVERLAP")
+CHUNK_LENGTH_UNIT = os.getenv("CHUNK_LENGTH_UNIT", "chars")
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL")
+COLLECTION_PROFILE = os.getenv("COLLECTION_PROFILE", "float")
+INCREMENTAL_INGESTION = os.getenv("INCREMENTAL_INGESTION", "true").lower() == "true"
+FETCH_CACHE_DIR = os.getenv("FETCH_CACHE_DIR", ".cache/pages")
+FETCH_CONCURRENCY = int(os.getenv("FETCH_CONCURRENCY", "16"))
+FETCH_CONCURRENCY_PER_HOST = int(os.getenv("FETCH_CONCURRENCY_PER_HOST", "4"))
+CONTENT_EXTRACTION = os.getenv("CONTENT_EXTRACTION", "true").lower() == "true"
+PIPELINE_BUFFER_SIZE = int(os.getenv("PIPELINE_BUFFER_SIZE", "4"))
+DOCUMENT_BATCH_SIZE = int(os.getenv("DOCUMENT_BATCH_SIZE", "8"))
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+UPSERT_BATCH_SIZE = int(os.getenv("UPSERT_BATCH_SIZE", "128"))
+UPSERT_PARALLEL = int(os.getenv("UPSERT_PARALLEL", "1"))
+BQ_PAGE_SIZE = int(os.getenv("BQ_PAGE_SIZE", "500"))
+BQ_USE_STORAGE_API = os.getenv("BQ_USE_STORAGE_API", "false").lower() == "true"
+BQ_WATERMARK_COLUMN = os.getenv("BQ_WATERMARK_COLUMN")
+BQ_WATERMARK_TYPE = os.getenv("BQ_WATERMARK_TYPE", "TIMESTAMP")
+BQ_WATERMARK_PATH = os.getenv("BQ_WATERMARK_PATH", ".cache/bq_watermark.json")
+URL_COLUMNS = ["url", "subject", "tool", "type", "category"]
+BULK_PAUSE_INDEXING = os.getenv("BULK_PAUSE_INDEXING", "false").lower() == "true"
+DEDUP_CHUNKS = os.getenv("DEDUP_CHUNKS", "true").lower() == "true"
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.85"))
 
 
 
@@ -43,30 +77,74 @@ if not all([PROJECT_NAME, QDRANT_API_KEY, QDRANT_URL, OPENAI_API_KEY,DATASET,TAB
     raise EnvironmentError("One or more environment variables are missing.")
 
 
-embedding_client = OpenAIEmbeddings(model=EMBEDDING_MODEL, api_key=OPENAI_API_KEY)
-qdrant_client = QdrantClient(url=QDRANT_URL, port=QDRANT_PORT, api_key=QDRANT_API_KEY)
-vector_store = Qdrant(client=qdrant_client, collection_name=COLLECTION_NAME, embeddings=embedding_client)
+embedding_client = cached_embeddings(EMBEDDING_MODEL, OPENAI_API_KEY)
+qdrant_client = QdrantClient(url=QDRANT_URL, port=QDRANT_PORT, grpc_port=QDRANT_GRPC_PORT, prefer_grpc=QDRANT_PREFER_GRPC, api_key=QDRANT_API_KEY)
 bigquery_client = bigquery.Client(credentials=credentials, project=project)
+storage_client = storage.Client(credentials=credentials, project=project)
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 @error_wrapper
-def extract_urls(project_name,dataset, table):
+def extract_urls(project_name,dataset, table, since=None, urls=None):
     """
-    Extracts URLs from a BigQuery dataset and table.
+    Extracts URLs from a BigQuery dataset and table, streaming the result page by page.
+
+    Only the needed columns are selected. When BQ_WATERMARK_COLUMN is set, only the rows whose
+    watermark is greater than since are returned, and each row carries its watermark value.
+    The rows are read through the BigQuery Storage Read API when BQ_USE_STORAGE_API is enabled.
+    The query runs before the function returns, so its errors are reported as extract_urls errors.
 
     Args:
+        project_name (str): The name of the BigQuery project.
         dataset (str): The name of the BigQuery dataset.
         table (str): The name of the BigQuery table.
+        since (str): The watermark of the last successful run, or None to read every row.
+        urls (list): Only return the rows of these URLs, or None to return every row.
 
     Returns:
-        list: A list of dictionaries containing the extracted URLs, along with their corresponding subject and tool.
+        iterable: The extracted URLs, along with their corresponding subject, tool, type, category and watermark.
     """
     
     logging.info("Extracting Bigquery URL's...")
-    query = f"SELECT * FROM `{project_name}.{dataset}.{table}`"
-    query_job = bigquery_client.query(query)
-    return [{"url": row.url, "subject": row.subject, "tool": row.tool, "type": row.type, "category": row.category} for row in query_job]
+    columns = list(URL_COLUMNS)
+    if BQ_WATERMARK_COLUMN:
+        columns.append(BQ_WATERMARK_COLUMN)
+    query = f"SELECT {', '.join(columns)} FROM `{project_name}.{dataset}.{table}`"
+    job_config = bigquery.QueryJobConfig()
+    conditions, parameters = [], []
+    if BQ_WATERMARK_COLUMN and since is not None:
+        conditions.append(f"{BQ_WATERMARK_COLUMN} > @since")
+        parameters.append(bigquery.ScalarQueryParameter("since", BQ_WATERMARK_TYPE, since))
+    if urls is not None:
+        conditions.append("url IN UNNEST(@urls)")
+        parameters.append(bigquery.ArrayQueryParameter("urls", "STRING", list(urls)))
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+        job_config.query_parameters = parameters
+    rows = bigquery_client.query(query, job_config=job_config).result(page_size=BQ_PAGE_SIZE)
+    return iter_url_rows(rows)
+
+
+def iter_url_rows(rows):
+    """
+    Streams the rows of the URL query page by page.
+
+    Args:
+        rows (RowIterator): The result of the query.
+
+    Yields:
+        dict: The URL, subject, tool, type, category and, with BQ_WATERMARK_COLUMN, the watermark of each row.
+    """
+    if BQ_USE_STORAGE_API:
+        pages = (frame.to_dict("records") for frame in rows.to_dataframe_iterable(bqstorage_client=bigquery_storage.BigQueryReadClient(credentials=credentials)))
+    else:
+        pages = ([dict(row.items()) for row in page] for page in rows.pages)
+    for page in pages:
+        for row in page:
+            item = {column: row[column] for column in URL_COLUMNS}
+            if BQ_WATERMARK_COLUMN:
+                item["watermark"] = row[BQ_WATERMARK_COLUMN]
+            yield item
     
         
 
@@ -75,37 +153,72 @@ class CustomWebBaseLoader(WebBaseLoader):
     A custom web base loader that extends the functionality of the WebBaseLoader class.
 
     Args:
-        urls_with_metadata (list): A list of dictionaries containing URLs and corresponding metadata.
+        urls_with_metadata (iterable): An iterable of dictionaries containing URLs and corresponding metadata.
 
     Attributes:
-        urls_with_metadata (list): A list of dictionaries containing URLs and corresponding metadata.
+        urls_with_metadata (iterable): An iterable of dictionaries containing URLs and corresponding metadata.
+        fetcher (AsyncPageFetcher): The concurrent fetcher with the conditional-GET disk cache.
+        failed (list): The URLs whose page could not be fetched.
 
     Methods:
-        load(): Loads the documents using the parent class's load method and adds additional metadata to each document.
+        lazy_load(): Fetches the pages concurrently and yields each document, reduced to its article body and with additional metadata, as soon as it is ready.
+        load(): Loads all the documents at once.
 
     """
 
     def __init__(self, urls_with_metadata):
-        super().__init__([item['url'] for item in urls_with_metadata])
+        super().__init__()
         self.urls_with_metadata = urls_with_metadata
+        self.failed = []
+        self.fetcher = AsyncPageFetcher(
+            cache_dir=FETCH_CACHE_DIR,
+            concurrency=FETCH_CONCURRENCY,
+            per_host=FETCH_CONCURRENCY_PER_HOST,
+            headers=dict(self.session.headers),
+        )
 
-    def load(self):
+    def lazy_load(self):
         """
-        Loads the documents using the parent class's load method and adds additional metadata to each document.
+        Fetches the pages concurrently and yields each document, parsed like the parent class and with
+        the additional metadata, as soon as its page arrives. Pages that could not be fetched are skipped.
+        The URLs are consumed lazily, so fetching starts before the whole URL list is available.
 
-        Returns:
-            list: A list of documents with added metadata.
+        Yields:
+            Document: A document with added metadata.
 
         """
-        documents = super().load()
-        for doc, metadata in zip(documents, self.urls_with_metadata):
+        consumed = []
+
+        def urls():
+            for item in self.urls_with_metadata:
+                consumed.append(item)
+                yield item['url']
+
+        for index, page in self.fetcher.iter_fetch(urls()):
+            if page is None:
+                self.failed.append(consumed[index]["url"])
+                continue
+            metadata = consumed[index]
+            soup = BeautifulSoup(page.text, self.default_parser)
+            page_metadata = _build_metadata(soup, page.url)
+            text = extract_main_content(soup, page.url) if CONTENT_EXTRACTION else soup.get_text(**self.bs_get_text_kwargs)
+            doc = Document(page_content=text, metadata=page_metadata)
             doc.metadata['subject'] = metadata['subject']
             doc.metadata['tool'] = metadata['tool']
             doc.metadata["date"] = datetime.date.today().isoformat()
             doc.metadata["type"] = metadata["type"]
             doc.metadata["category"] = metadata["category"]
-            
-        return documents
+            yield doc
+
+    def load(self):
+        """
+        Loads all the documents at once.
+
+        Returns:
+            list: A list of documents with added metadata.
+
+        """
+        return list(self.lazy_load())
 
 @error_wrapper
 def extract_documents(url_list_with_metadata):
@@ -138,11 +251,12 @@ def get_chunks(file):
         list: A list of chunks obtained from the file.
     """
     logging.info("Splitting documents into chunks...")
-    text_splitter = RecursiveCharacterTextSplitter(
-            separators=["\n\n", "\n", " ", ""],
+    text_splitter = FastTextSplitter(
             chunk_size=int(CHUNK_SIZE),
             chunk_overlap=int(CHUNK_OVERLAP),
-            length_function=len
+            length_unit=CHUNK_LENGTH_UNIT,
+            model=EMBEDDING_MODEL,
+            add_start_index=True,
     )
     chunks = text_splitter.split_documents(file)
     return chunks
@@ -162,27 +276,93 @@ def create_collection():
         None
     """
     logging.info("Creating collection...")
-    qdrant_client.create_collection(
-            collection_name=COLLECTION_NAME,
-            vectors_config=VectorParams(size=int(CHUNK_SIZE), distance=Distance.COSINE),
-    )
-    return True    
+    return provision_collection(qdrant_client, COLLECTION_NAME, EMBEDDING_MODEL, profile=COLLECTION_PROFILE, embeddings=embedding_client)
         
 
 
        
+def embed_chunks(chunks, state):
+    """
+    Embeds the chunks that are not stored yet and builds their Qdrant points.
+
+    Args:
+        chunks (list): A list of chunks.
+        state (IngestionState): The ingestion state used to skip the chunks already stored.
+
+    Returns:
+        list: A list of points with deterministic ids and the same payload layout used by the Qdrant vector store.
+    """
+    new_chunks, ids = state.new_chunks(chunks)
+    if not new_chunks:
+        return []
+    vectors = embedding_client.embed_documents([chunk.page_content for chunk in new_chunks])
+    return build_points(new_chunks, vectors, ids)
+
+
+def ingest(items, state, deduplicator, bulk_loader):
+    """
+    Runs the pages through the fetch, chunk, dedup, embed and upsert stages and commits the ingestion state.
+
+    Args:
+        items (iterable): The URLs with metadata.
+        state (IngestionState): The ingestion state used to skip the unchanged pages and chunks.
+        deduplicator (NearDuplicateIndex): The near-duplicate index, shared by every call of a run.
+        bulk_loader (BulkLoader): The loader used to upload the points.
+
+    Returns:
+        tuple: The stats of the pipeline and the URLs whose page could not be fetched.
+    """
+    loader = CustomWebBaseLoader(items)
+    pipeline = Pipeline(loader.lazy_load(), buffer_size=PIPELINE_BUFFER_SIZE)
+    pipeline.stage("chunk", lambda documents: get_chunks(state.changed_documents(documents)), batch_size=DOCUMENT_BATCH_SIZE)
+    if DEDUP_CHUNKS:
+        pipeline.stage("dedup", lambda chunks: deduplicator.deduplicate(chunks, on_merge=state.merge), batch_size=EMBED_BATCH_SIZE)
+    pipeline.stage("embed", lambda chunks: embed_chunks(chunks, state), batch_size=EMBED_BATCH_SIZE)
+    pipeline.stage("upsert", bulk_loader.upload, batch_size=UPSERT_BATCH_SIZE * UPSERT_PARALLEL)
+    stats = pipeline.run()
+    state.commit()
+    return stats, loader.failed
+
+
 @url_extractor_bp.route('/url_extractor',methods=["GET"])
 @error_wrapper 
 def main(request=request):
-    url_list_with_metadata = extract_urls(PROJECT_NAME,DATASET, TABLE)   
-    documents = extract_documents(url_list_with_metadata)
-    chunks = get_chunks(documents)
+    since = read_watermark(BQ_WATERMARK_PATH, storage_client) if BQ_WATERMARK_COLUMN else None
+    run = ExtractionRun()
+    state = IngestionState(qdrant_client, COLLECTION_NAME, version=f"{CHUNK_SIZE}:{CHUNK_OVERLAP}:{CHUNK_LENGTH_UNIT}")
+    if INCREMENTAL_INGESTION:
+        state.load()
     collection_exists = qdrant_client.collection_exists(COLLECTION_NAME)
     if not collection_exists:
         create_collection()
-    vector_store.add_documents(chunks)
-    logging.info("Documents added to vector store")
-    return jsonify({"message": "Documents added to vector store"}), 200
+    else:
+        create_payload_indexes(qdrant_client, COLLECTION_NAME)
+    bulk_loader = BulkLoader(
+        qdrant_client,
+        COLLECTION_NAME,
+        batch_size=UPSERT_BATCH_SIZE,
+        parallel=UPSERT_PARALLEL,
+        pause_indexing=BULK_PAUSE_INDEXING,
+    )
+    deduplicator = NearDuplicateIndex(threshold=DEDUP_THRESHOLD)
+    with bulk_loader:
+        stats, failed = ingest(run.track(extract_urls(PROJECT_NAME,DATASET, TABLE, since=since)), state, deduplicator, bulk_loader)
+        run.failed.update(failed)
+        documents, chunks = stats["source"]["out"], stats["upsert"]["in"]
+        # The pages merged into a deleted representative are ingested again, even if they are older than the watermark
+        while state.reprocess:
+            items = run.reprocess_items(state.reprocess, lambda urls: extract_urls(PROJECT_NAME, DATASET, TABLE, urls=urls))
+            logging.info(f"Reprocessing {len(items)} pages that lost merged content")
+            stats, reprocess_failed = ingest(items, state, deduplicator, bulk_loader)
+            run.failed.update(reprocess_failed)
+            documents += stats["source"]["out"]
+            chunks += stats["upsert"]["in"]
+    dedup_stats = deduplicator.stats()
+    latest = run.next_watermark()
+    if latest is not None:
+        write_watermark(BQ_WATERMARK_PATH, latest, storage_client)
+    logging.info(f"{chunks} chunks added to vector store")
+    return jsonify({"message": "Documents added to vector store", "documents": documents, "chunks": chunks, "duplicates_removed": dedup_stats["removed"], "upload": bulk_loader.stats()}), 200
     
 if __name__ == '__main__':
     logging.info("Starting URL Extractor...")
@@ -1,14 +1,19 @@
 from qdrant_client import QdrantClient
-from qdrant_client.http.models import Distance, VectorParams
-from langchain_qdrant import Qdrant
-from langchain_openai import OpenAIEmbeddings
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from qdrant_client.http.models import Filter, FieldCondition, MatchValue, HasIdCondition, FilterSelector
 from langchain_google_community import GCSFileLoader
+from google.cloud import storage
+import codecs
 import os
 import logging
 from flask import Blueprint,request,jsonify
 from dotenv import load_dotenv
 from error_wrapper import error_wrapper
+from embedding_cache import cached_embeddings
+from bulk_upsert import BulkLoader
+from incremental import content_hash, point_id, stored_ids
+from pipeline import Pipeline
+from chunking import FastTextSplitter
+from collection_profile import create_payload_indexes, provision_collection
 
 load_dotenv()
 vectorizer_bp = Blueprint('vectorizer_bp', __name__)
@@ -18,50 +23,166 @@ PROJECT_NAME = os.getenv("PROJECT_NAME")
 QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
 QDRANT_URL = os.getenv("QDRANT_URL")
 QDRANT_PORT = os.getenv("QDRANT_PORT")
+QDRANT_GRPC_PORT = int(os.getenv("QDRANT_GRPC_PORT", "6334"))
+QDRANT_PREFER_GRPC = os.getenv("QDRANT_PREFER_GRPC", "false").lower() == "true"
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 COLLECTION_NAME = os.getenv("COLLECTION_NAME")
 CHUNK_SIZE = os.getenv("CHUNK_SIZE")
 CHUNK_OVERLAP = os.getenv("CHUNK_OVERLAP")
+CHUNK_LENGTH_UNIT = os.getenv("CHUNK_LENGTH_UNIT", "chars")
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL")
+COLLECTION_PROFILE = os.getenv("COLLECTION_PROFILE", "float")
+UPSERT_BATCH_SIZE = int(os.getenv("UPSERT_BATCH_SIZE", "128"))
+UPSERT_PARALLEL = int(os.getenv("UPSERT_PARALLEL", "1"))
+BULK_PAUSE_INDEXING = os.getenv("BULK_PAUSE_INDEXING", "false").lower() == "true"
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+STREAM_SEGMENT_SIZE = int(os.getenv("STREAM_SEGMENT_SIZE", str(4 * 1024 * 1024)))
+STREAMABLE_EXTENSIONS = (".md", ".markdown", ".txt", ".csv", ".json")
 
-embbeding_client = OpenAIEmbeddings(model=EMBEDDING_MODEL)
-qdrant_client = QdrantClient(url=QDRANT_URL, port=QDRANT_PORT, api_key=QDRANT_API_KEY)
-vector_store = Qdrant(client=qdrant_client, collection_name=COLLECTION_NAME, embeddings=embbeding_client)
+embbeding_client = cached_embeddings(EMBEDDING_MODEL, OPENAI_API_KEY)
+qdrant_client = QdrantClient(url=QDRANT_URL, port=QDRANT_PORT, grpc_port=QDRANT_GRPC_PORT, prefer_grpc=QDRANT_PREFER_GRPC, api_key=QDRANT_API_KEY)
+storage_client = storage.Client(project=PROJECT_NAME)
 
 @error_wrapper
 def get_chunks(file):
-    text_splitter = RecursiveCharacterTextSplitter(
-        separators=["\n\n", "\n", " ", ""],
+    text_splitter = FastTextSplitter(
         chunk_size=int(CHUNK_SIZE),
         chunk_overlap=int(CHUNK_OVERLAP),
-        length_function=len
+        length_unit=CHUNK_LENGTH_UNIT,
+        model=EMBEDDING_MODEL,
+        add_start_index=True,
     )
     chunks = text_splitter.split_documents(file)
-    return [chunk.page_content for chunk in chunks]
+    return chunks
 
 @error_wrapper
 def create_collection():
-    qdrant_client.create_collection(
+    return provision_collection(qdrant_client, COLLECTION_NAME, EMBEDDING_MODEL, profile=COLLECTION_PROFILE, embeddings=embbeding_client)
+    
+def iter_blob_text(bucket_name, file_name, segment_size=STREAM_SEGMENT_SIZE):
+    """
+    Reads a text blob in ranged segments, without keeping the whole object in memory.
+
+    Args:
+        bucket_name (str): The name of the bucket.
+        file_name (str): The name of the blob.
+        segment_size (int): The number of bytes requested per range read.
+
+    Yields:
+        str: The decoded text of each segment.
+    """
+    blob = storage_client.bucket(bucket_name).get_blob(file_name)
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    for start in range(0, blob.size, segment_size):
+        end = min(start + segment_size, blob.size)
+        yield decoder.decode(blob.download_as_bytes(start=start, end=end - 1), final=end == blob.size)
+
+
+def stream_chunks(segments, metadata):
+    """
+    Splits a stream of text segments into chunks, emitting each chunk as soon as it is complete.
+
+    Args:
+        segments (iterable): The text segments, in order.
+        metadata (dict): The metadata of every chunk.
+
+    Returns:
+        iterable: The chunks, with their start_index in the whole text.
+    """
+    text_splitter = FastTextSplitter(
+        chunk_size=int(CHUNK_SIZE),
+        chunk_overlap=int(CHUNK_OVERLAP),
+        length_unit=CHUNK_LENGTH_UNIT,
+        model=EMBEDDING_MODEL,
+        add_start_index=True,
+    )
+    return text_splitter.split_stream(segments, metadata)
+
+
+def load_chunks(bucket_name, file_name):
+    """
+    Loads the chunks of a blob, streaming it when it is a text file and loading it with GCSFileLoader otherwise.
+
+    Args:
+        bucket_name (str): The name of the bucket.
+        file_name (str): The name of the blob.
+
+    Returns:
+        iterable: The chunks of the blob.
+    """
+    source = f"gs://{bucket_name}/{file_name}"
+    if file_name.lower().endswith(STREAMABLE_EXTENSIONS):
+        return stream_chunks(iter_blob_text(bucket_name, file_name), {"source": source})
+    loader = GCSFileLoader(project_name=PROJECT_NAME, bucket=bucket_name,blob=file_name)
+    chunks = get_chunks(loader.load())
+    for chunk in chunks:
+        chunk.metadata["source"] = source
+    return chunks
+
+
+def vectorize_object(bucket_name, file_name, bulk_loader):
+    """
+    Chunks, embeds and upserts a blob batch by batch, then deletes the points left from a previous version of it.
+
+    The chunks whose point is already stored (the unchanged chunks of a new version, or chunks
+    repeated in the blob) are not embedded or upserted again.
+
+    Args:
+        bucket_name (str): The name of the bucket.
+        file_name (str): The name of the blob.
+        bulk_loader (BulkLoader): The loader used to embed and upload the chunks.
+
+    Returns:
+        int: The number of chunks of the blob.
+    """
+    source = f"gs://{bucket_name}/{file_name}"
+    stored = stored_ids(qdrant_client, COLLECTION_NAME, source)
+    already_stored = len(stored)
+    ids = []
+
+    def upload(chunks):
+        batch_ids = [point_id(source, content_hash(chunk.page_content)) for chunk in chunks]
+        ids.extend(batch_ids)
+        new_chunks = {}
+        for chunk_id, chunk in zip(batch_ids, chunks):
+            if chunk_id not in stored:
+                new_chunks.setdefault(chunk_id, chunk)
+        stored.update(new_chunks)
+        return bulk_loader.add_documents(list(new_chunks.values()), list(new_chunks))
+
+    Pipeline(load_chunks(bucket_name, file_name)).stage("upsert", upload, batch_size=EMBED_BATCH_SIZE).run()
+    qdrant_client.delete(
         collection_name=COLLECTION_NAME,
-        vectors_config=VectorParams(size=int(CHUNK_SIZE), distance=Distance.COSINE),
+        points_selector=FilterSelector(filter=Filter(
+            must=[FieldCondition(key="metadata.source", match=MatchValue(value=source))],
+            must_not=[HasIdCondition(has_id=ids)],
+        )),
     )
-    return True
-    
+    logging.info(f"{len(ids)} chunks of {source} in vector store, {len(stored) - already_stored} new")
+    return len(ids)
+
+
 @vectorizer_bp.route('/vectorizer', methods=['POST'])
 @error_wrapper
 def main(cloud_event=request):
         
     cloud_event = cloud_event.get_json()
-    bucket_name = cloud_event["bucket"]
-    file_name = cloud_event["name"]
-    loader = GCSFileLoader(project_name=PROJECT_NAME, bucket=bucket_name,blob=file_name)
-    document = loader.load()
+    objects = cloud_event.get("objects") or [cloud_event]
     collection_exists = qdrant_client.collection_exists(COLLECTION_NAME)
     if not collection_exists:
         create_collection()
-    text = get_chunks(document)
-    vector_store.add_texts(text)
+    else:
+        create_payload_indexes(qdrant_client, COLLECTION_NAME)
+    bulk_loader = BulkLoader(
+        qdrant_client,
+        COLLECTION_NAME,
+        embeddings=embbeding_client,
+        batch_size=UPSERT_BATCH_SIZE,
+        parallel=UPSERT_PARALLEL,
+        pause_indexing=BULK_PAUSE_INDEXING,
+    )
+    with bulk_loader:
+        chunks = {f"gs://{item['bucket']}/{item['name']}": vectorize_object(item["bucket"], item["name"], bulk_loader) for item in objects}
     logging.info("Text chunks added to vector store")
-    return jsonify({"message": "Sucesso!"}), 200
+    return jsonify({"message": "Sucesso!", "chunks": chunks, "upload": bulk_loader.stats()}), 200
     
-
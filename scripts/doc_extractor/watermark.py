@@ -0,0 +1,129 @@
+import json
+import os
+
+
+def read_watermark(path, storage_client=None):
+    """
+    Reads the watermark of the last successful run.
+
+    Args:
+        path (str): A local path or a gs://bucket/blob URI.
+        storage_client (storage.Client): The Cloud Storage client used for gs:// URIs.
+
+    Returns:
+        str: The watermark, or None if there was no successful run yet.
+    """
+    if path.startswith("gs://"):
+        bucket_name, blob_name = path[len("gs://"):].split("/", 1)
+        blob = storage_client.bucket(bucket_name).blob(blob_name)
+        return json.loads(blob.download_as_text())["watermark"] if blob.exists() else None
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)["watermark"]
+
+
+def write_watermark(path, watermark, storage_client=None):
+    """
+    Stores the watermark of a successful run.
+
+    Args:
+        path (str): A local path or a gs://bucket/blob URI.
+        watermark (object): The watermark. Dates and timestamps are stored in ISO format.
+        storage_client (storage.Client): The Cloud Storage client used for gs:// URIs.
+    """
+    content = json.dumps({"watermark": watermark.isoformat() if hasattr(watermark, "isoformat") else watermark})
+    if path.startswith("gs://"):
+        bucket_name, blob_name = path[len("gs://"):].split("/", 1)
+        storage_client.bucket(bucket_name).blob(blob_name).upload_from_string(content)
+        return
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+def next_watermark(watermarks, failed):
+    """
+    Returns the watermark to be stored after a run, so the rows that were not ingested are read again.
+
+    Args:
+        watermarks (list): The (URL, watermark) pair of each row read. NULL watermarks are None.
+        failed (set): The URLs whose page could not be fetched.
+
+    Returns:
+        object: The highest watermark below the watermark of every failed row, or None if the stored one must be kept.
+    """
+    values = [watermark for _, watermark in watermarks if watermark is not None]
+    blocked = [watermark for url, watermark in watermarks if url in failed and watermark is not None]
+    if blocked:
+        values = [watermark for watermark in values if watermark < min(blocked)]
+    return max(values) if values else None
+
+
+class ExtractionRun:
+    """
+    Keeps track of the rows read by a run of the URL extraction, to reprocess pages and advance the watermark.
+
+    Attributes:
+        watermarks (list): The (URL, watermark) pair of each row read.
+        consumed (dict): The rows read, by URL, without their watermark.
+        failed (set): The URLs whose page could not be fetched, in any ingestion of the run.
+
+    Methods:
+        track(items): Records the rows as they are read.
+        reprocess_items(urls, lookup): Returns the rows of the URLs to ingest again.
+        next_watermark(): Returns the watermark to be stored after the run.
+    """
+
+    def __init__(self):
+        self.watermarks = []
+        self.consumed = {}
+        self.failed = set()
+
+    def track(self, items):
+        """
+        Records the rows as they are read.
+
+        Args:
+            items (iterable): The rows of the extraction, with or without a watermark.
+
+        Yields:
+            dict: Each row, without its watermark.
+        """
+        for item in items:
+            if "watermark" in item:
+                self.watermarks.append((item["url"], item.pop("watermark")))
+            self.consumed[item["url"]] = item
+            yield item
+
+    def reprocess_items(self, urls, lookup):
+        """
+        Returns the rows of the URLs to ingest again. The rows read in this run are reused, and the
+        rows of older pages, which the watermark filtered out, are read with lookup. Their watermark
+        is dropped, as they are older than the stored one.
+
+        Args:
+            urls (iterable): The URLs to ingest again.
+            lookup (callable): Returns the rows of a list of URLs that were not read in this run.
+
+        Returns:
+            list: The rows of the URLs.
+        """
+        items = [self.consumed[url] for url in urls if url in self.consumed]
+        missing = [url for url in urls if url not in self.consumed]
+        if missing:
+            for item in lookup(missing):
+                item.pop("watermark", None)
+                self.consumed[item["url"]] = item
+                items.append(item)
+        return items
+
+    def next_watermark(self):
+        """
+        Returns the watermark to be stored after the run.
+
+        Returns:
+            object: The watermark, or None if the stored one must be kept.
+        """
+        return next_watermark(self.watermarks, self.failed)
@@ -1,14 +1,181 @@
 import functions_framework
 from google.cloud import firestore
+from collections import deque
 import json
+import logging
+import os
+import threading
+import time
 from datetime import datetime,timezone
 
-# Inicializar o cliente do Firestore
+# "batch" (batched writes, até 500 por commit) ou "bulk" (BulkWriter, paralelo e com retentativas)
+FIRESTORE_WRITER = os.getenv("FIRESTORE_WRITER", "batch")
+MAX_INTERACTIONS_PER_REQUEST = int(os.getenv("MAX_INTERACTIONS_PER_REQUEST", "500"))
+BATCH_SIZE = 500  # Limite de operações de um batched write
+
+# Inicializar o cliente do Firestore (usa o emulador quando FIRESTORE_EMULATOR_HOST está definido)
 db = firestore.Client()
 
+
+class WriteStats:
+    """
+    Keeps the throughput and latency of a Firestore write path over its recent commits.
+
+    The stats are per function instance, since each instance keeps its own counters.
+
+    Args:
+        window (int): The number of recent commits used for the statistics.
+
+    Methods:
+        record(writes, seconds): Records a commit.
+        stats(): Returns the statistics.
+    """
+
+    def __init__(self, window=1000):
+        self.writes = 0
+        self.commits = 0
+        self._recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, writes, seconds):
+        """
+        Records a commit.
+
+        Args:
+            writes (int): The number of documents written.
+            seconds (float): The duration of the commit.
+        """
+        with self._lock:
+            self.writes += writes
+            self.commits += 1
+            self._recent.append((writes, seconds))
+
+    def stats(self):
+        """
+        Returns the statistics of the recent commits.
+
+        Returns:
+            dict: The total writes and commits, the writes per second of commit time and the p95 commit latency in milliseconds.
+        """
+        with self._lock:
+            recent = list(self._recent)
+        stats = {"writes": self.writes, "commits": self.commits}
+        if recent:
+            latencies = sorted(seconds for _, seconds in recent)
+            total_seconds = sum(latencies)
+            stats["writes_per_second"] = round(sum(writes for writes, _ in recent) / total_seconds, 1) if total_seconds else 0.0
+            stats["p95_ms"] = round(1000 * latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))], 2)
+        return stats
+
+
+write_stats = {"batch": WriteStats(), "bulk": WriteStats()}
+
+
+def _interaction(item, received_at):
+    # Valida uma interação e devolve o caminho e o conteúdo do documento
+    if not isinstance(item, dict):
+        raise ValueError('Interação inválida')
+    prompt_data = item.get('prompt_data')
+    user_info = item.get('user_info')
+    if not isinstance(prompt_data, dict) or not isinstance(user_info, dict):
+        raise ValueError('Dados inválidos')
+    user_email = user_info.get('email')
+    if not user_email:
+        raise ValueError('Email do usuário não fornecido')
+    # O buffer do cliente envia o horário de cada turno; sem ele, vale o horário de recebimento
+    timestamp = prompt_data.get('timestamp') or received_at
+    try:
+        timestamp = datetime.fromisoformat(str(timestamp).replace('Z', '+00:00')).astimezone(timezone.utc).isoformat()
+    except ValueError:
+        timestamp = received_at
+    prompt_data = {**prompt_data, 'timestamp': timestamp, 'received_at': received_at}
+    return f'users/{user_email}/interactions/{timestamp}', {'prompt_data': prompt_data, 'user_info': user_info}
+
+
+def parse_interactions(request_json):
+    """
+    Reads the interactions of a request: a single {prompt_data, user_info} object, or a list of them under "interactions".
+
+    Args:
+        request_json (dict): The JSON body of the request.
+
+    Returns:
+        list: The (document path, document) pairs. Interactions of the same user and timestamp get a numbered path.
+
+    Raises:
+        ValueError: If the body or an interaction is invalid.
+    """
+    items = request_json.get('interactions') if 'interactions' in request_json else [request_json]
+    if not isinstance(items, list) or not items:
+        raise ValueError('Nenhuma interação fornecida')
+    if len(items) > MAX_INTERACTIONS_PER_REQUEST:
+        raise ValueError(f'Máximo de {MAX_INTERACTIONS_PER_REQUEST} interações por requisição')
+    received_at = datetime.now(timezone.utc).isoformat()
+    documents, seen = [], {}
+    for item in items:
+        doc_path, document = _interaction(item, received_at)
+        seen[doc_path] = seen.get(doc_path, 0) + 1
+        if seen[doc_path] > 1:
+            doc_path = f'{doc_path}-{seen[doc_path] - 1}'
+        documents.append((doc_path, document))
+    return documents
+
+
+def write_batched(client, documents):
+    """
+    Writes the documents with batched writes of up to BATCH_SIZE documents.
+
+    Args:
+        client (firestore.Client): The Firestore client.
+        documents (list): The (document path, document) pairs.
+
+    Returns:
+        int: The number of documents written.
+    """
+    for start in range(0, len(documents), BATCH_SIZE):
+        chunk = documents[start:start + BATCH_SIZE]
+        begin = time.perf_counter()
+        batch = client.batch()
+        for doc_path, document in chunk:
+            batch.set(client.document(doc_path), document)
+        batch.commit()
+        write_stats["batch"].record(len(chunk), time.perf_counter() - begin)
+    return len(documents)
+
+
+def write_bulk(client, documents):
+    """
+    Writes the documents with the BulkWriter, which sends them in parallel and retries failed writes.
+
+    Args:
+        client (firestore.Client): The Firestore client.
+        documents (list): The (document path, document) pairs.
+
+    Returns:
+        int: The number of documents written.
+    """
+    begin = time.perf_counter()
+    bulk_writer = client.bulk_writer()
+    for doc_path, document in documents:
+        bulk_writer.set(client.document(doc_path), document)
+    bulk_writer.close()
+    write_stats["bulk"].record(len(documents), time.perf_counter() - begin)
+    return len(documents)
+
+
+WRITERS = {"batch": write_batched, "bulk": write_bulk}
+if FIRESTORE_WRITER not in WRITERS:
+    raise EnvironmentError(f"Unknown FIRESTORE_WRITER: {FIRESTORE_WRITER}")
+
+
 @functions_framework.http
 def insert_to_firestore(request):
     """HTTP Cloud Function para inserir dados no Firestore.
+
+    Aceita uma interação ({prompt_data, user_info}) ou um lote ({"interactions": [...]}, enviado
+    pelo buffer da página), gravado em uma única operação. Um GET devolve as estatísticas de
+    escrita (writes/s e latência p95) de cada caminho.
+
     Args:
         request (flask.Request): O objeto de requisição.
         <https://flask.palletsprojects.com/en/1.1.x/api/#incoming-request-data>
@@ -18,7 +185,7 @@ def insert_to_firestore(request):
     # Adicionar cabeçalhos CORS
     headers = {
         'Access-Control-Allow-Origin': '*',
-        'Access-Control-Allow-Methods': 'POST',
+        'Access-Control-Allow-Methods': 'GET, POST',
         'Access-Control-Allow-Headers': 'Content-Type',
     }
 
@@ -26,36 +193,24 @@ def insert_to_firestore(request):
         # Handle preflight requests
         return ('', 204, headers)
 
+    if request.method == 'GET':
+        stats = {path: path_stats.stats() for path, path_stats in write_stats.items()}
+        return (json.dumps(stats), 200, {**headers, 'Content-Type': 'application/json'})
+
     request_json = request.get_json(silent=True)
 
-    if request.method == 'POST' and request_json:
+    if request.method == 'POST' and isinstance(request_json, dict):
+        try:
+            documents = parse_interactions(request_json)
+        except ValueError as e:
+            return (str(e), 400, headers)
         try:
-            # Extrair dados do JSON
-            prompt_data = request_json.get('prompt_data')
-            user_info = request_json.get('user_info')
-            timestamp = datetime.utcnow().isoformat()
-
-            if not prompt_data or not user_info:
-                return ('Dados inválidos', 400, headers)
-
-            # Construir o caminho do documento
-            user_email = user_info.get('email')
-            if not user_email:
-                return ('Email do usuário não fornecido', 400, headers)
-
-            timestamp = datetime.now(timezone.utc).isoformat()
-            prompt_data['timestamp'] = timestamp
-
-            doc_path = f'users/{user_email}/interactions/{timestamp}'
-
             # Inserir dados no Firestore
-            db.document(doc_path).set({
-                'prompt_data': prompt_data,
-                'user_info': user_info
-            })
-
-            return ('Documento inserido com sucesso', 200, headers)
+            written = WRITERS[FIRESTORE_WRITER](db, documents)
+            stats = write_stats[FIRESTORE_WRITER].stats()
+            logging.info(f"{written} interações gravadas ({FIRESTORE_WRITER}): {stats}")
+            return (json.dumps({'written': written, 'writer': FIRESTORE_WRITER, 'stats': stats}), 200, {**headers, 'Content-Type': 'application/json'})
         except Exception as e:
             return ('Erro ao inserir documento: {}'.format(str(e)), 500, headers)
     else:
-        return ('Método não permitido ou dados inválidos', 405, headers)
\ No newline at end of file
+        return ('Método não permitido ou dados inválidos', 405, headers)
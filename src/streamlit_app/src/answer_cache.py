@@ -0,0 +1,306 @@
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from langchain_core.runnables import RunnableGenerator
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+import numpy as np
+
+
+@dataclass
+class CachedAnswer:
+    """
+    An answer stored in the semantic answer cache.
+
+    Attributes:
+        question (str): The standalone question that was answered.
+        namespace (str): The retriever configuration the answer was produced with.
+        answer (str): The answer.
+        documents (list): The documents the answer was based on.
+        seconds (float): How long retrieving and generating the answer took.
+        created_at (float): When the answer was stored.
+    """
+    question: str
+    namespace: str
+    answer: str
+    documents: list
+    seconds: float
+    created_at: float = field(default_factory=time.time)
+
+
+class CollectionFingerprint:
+    """
+    A fingerprint of the point ids of a Qdrant collection, refreshed at most every refresh_seconds.
+
+    The ingestion gives each chunk a deterministic id derived from its content, so the fingerprint
+    changes whenever a re-ingestion adds, changes or removes a chunk. A single caller rescans the
+    collection, without holding the lock, while the others keep getting the previous fingerprint.
+
+    Args:
+        client (QdrantClient): The Qdrant client.
+        collection_name (str): The name of the collection.
+        refresh_seconds (int): The minimum time between two scans of the collection.
+    """
+
+    def __init__(self, client, collection_name, refresh_seconds=300):
+        self.client = client
+        self.collection_name = collection_name
+        self.refresh_seconds = refresh_seconds
+        self._value = None
+        self._checked_at = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def _scan(self):
+        digest = hashlib.sha256()
+        ids, offset = [], None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=self.collection_name,
+                limit=10000,
+                offset=offset,
+                with_payload=False,
+                with_vectors=False,
+            )
+            ids.extend(str(point.id) for point in points)
+            if offset is None:
+                break
+        for point_id in sorted(ids):
+            digest.update(point_id.encode("utf-8"))
+        return digest.hexdigest()
+
+    def current(self):
+        """
+        Returns the fingerprint of the collection, scanning it again if the last scan is too old.
+
+        Returns:
+            str: The fingerprint, or None if the collection could not be scanned.
+        """
+        with self._lock:
+            if self._value is not None and (self._refreshing or time.monotonic() - self._checked_at < self.refresh_seconds):
+                return self._value
+            self._refreshing = True
+        value = None
+        try:
+            value = self._scan()
+        except Exception as e:
+            logging.warning(f"Could not fingerprint the collection: {e}")
+        with self._lock:
+            if value is not None:
+                self._value = value
+            self._checked_at = time.monotonic()
+            self._refreshing = False
+            return self._value
+
+
+class SemanticAnswerCache:
+    """
+    A cache of answers keyed on the embedding of the standalone question.
+
+    A question whose cosine similarity with a question previously answered in the same namespace
+    (retriever configuration) reaches the threshold gets the stored answer and sources without
+    retrieval or generation. The questions are kept as a normalized NumPy matrix, searched with a
+    single matrix-vector product. Entries expire after ttl_seconds, the least recently used one is
+    evicted beyond max_size, and the whole cache is cleared when the fingerprint of the collection
+    changes (a re-ingestion).
+
+    Args:
+        embeddings (Embeddings): The embeddings client used to embed the questions.
+        threshold (float): The minimum cosine similarity of a hit.
+        ttl_seconds (int): The lifetime of an entry.
+        max_size (int): The maximum number of entries.
+        fingerprint (CollectionFingerprint): The fingerprint of the collection, or None to never invalidate.
+
+    Attributes:
+        hits (int): The number of lookups answered from the cache.
+        misses (int): The number of lookups that were not.
+        saved_seconds (float): The retrieval and generation time saved by the hits.
+
+    Methods:
+        lookup(question, namespace): Returns the cached answer of a question and its embedding.
+        alookup(question, namespace): The async version of lookup().
+        store(question, namespace, vector, answer, documents, seconds): Stores an answer.
+        recorder(question, vector, namespace): Returns a runnable that passes a chain's output through and stores the answer at the end.
+        stats(): Returns the hit rate and the saved latency.
+    """
+
+    def __init__(self, embeddings, threshold=0.95, ttl_seconds=86400, max_size=1000, fingerprint=None):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self.fingerprint = fingerprint
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self._entries = OrderedDict()
+        self._vectors = {}
+        self._matrix = None
+        self._keys = []
+        self._namespaces = None
+        self._next_key = 0
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _clear(self):
+        self._entries.clear()
+        self._vectors.clear()
+        self._matrix = None
+
+    def _index(self):
+        if self._matrix is None:
+            self._keys = list(self._vectors)
+            self._matrix = np.vstack([self._vectors[key] for key in self._keys]) if self._keys else None
+            self._namespaces = np.array([self._entries[key].namespace for key in self._keys], dtype=object)
+        return self._matrix
+
+    def _remove(self, key):
+        del self._entries[key]
+        del self._vectors[key]
+        self._matrix = None
+
+    def _check_version(self):
+        if self.fingerprint is None:
+            return
+        version = self.fingerprint.current()
+        if version != self._version:
+            if self._entries:
+                logging.info(f"Collection changed, {len(self._entries)} cached answers invalidated")
+            self._clear()
+            self._version = version
+
+    def _normalize(self, embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def _expire(self):
+        # Expired entries are dropped before the search, so they cannot hide a live match
+        now = time.time()
+        for key in [key for key, entry in self._entries.items() if now - entry.created_at >= self.ttl_seconds]:
+            self._remove(key)
+
+    def _match(self, question, namespace, vector):
+        with self._lock:
+            self._check_version()
+            self._expire()
+            matrix = self._index()
+            if matrix is not None:
+                scores = np.where(self._namespaces == namespace, matrix @ vector, -1.0)
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    key = self._keys[best]
+                    entry = self._entries[key]
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    self.saved_seconds += entry.seconds
+                    logging.info(f"Answer cache hit ({scores[best]:.3f}) for: {question}")
+                    return entry
+            self.misses += 1
+        return None
+
+    def lookup(self, question, namespace=""):
+        """
+        Returns the cached answer of a question.
+
+        Args:
+            question (str): The standalone question.
+            namespace (str): The retriever configuration.
+
+        Returns:
+            tuple: The cached answer (or None on a miss) and the normalized embedding of the question.
+        """
+        vector = self._normalize(self.embeddings.embed_query(question))
+        return self._match(question, namespace, vector), vector
+
+    async def alookup(self, question, namespace=""):
+        """
+        Returns the cached answer of a question, embedding it with the async client.
+
+        Args:
+            question (str): The standalone question.
+            namespace (str): The retriever configuration.
+
+        Returns:
+            tuple: The cached answer (or None on a miss) and the normalized embedding of the question.
+        """
+        vector = self._normalize(await self.embeddings.aembed_query(question))
+        # The fingerprint may scan the collection with the blocking client
+        entry = await asyncio.to_thread(self._match, question, namespace, vector)
+        return entry, vector
+
+    def store(self, question, namespace, vector, answer, documents, seconds):
+        """
+        Stores an answer.
+
+        Args:
+            question (str): The standalone question.
+            namespace (str): The retriever configuration.
+            vector (numpy.ndarray): The normalized embedding of the question, as returned by lookup().
+            answer (str): The answer.
+            documents (list): The documents the answer was based on.
+            seconds (float): How long retrieving and generating the answer took.
+        """
+        if not answer:
+            return
+        with self._lock:
+            key = self._next_key
+            self._next_key += 1
+            self._entries[key] = CachedAnswer(question, namespace, answer, documents, seconds)
+            self._vectors[key] = vector
+            self._matrix = None
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def recorder(self, question, vector, namespace=""):
+        """
+        Returns a runnable that passes the output chunks of a retrieval chain through and stores the answer once it is complete.
+
+        Args:
+            question (str): The standalone question.
+            vector (numpy.ndarray): The normalized embedding of the question, as returned by lookup().
+            namespace (str): The retriever configuration.
+
+        Returns:
+            RunnableGenerator: The recording runnable.
+        """
+        start = time.perf_counter()
+
+        def record(chunks):
+            answer, documents = "", []
+            for chunk in chunks:
+                if "context" in chunk:
+                    documents = chunk["context"]
+                if chunk.get("answer"):
+                    answer += chunk["answer"]
+                yield chunk
+            self.store(question, namespace, vector, answer, documents, time.perf_counter() - start)
+
+        async def arecord(chunks):
+            answer, documents = "", []
+            async for chunk in chunks:
+                if "context" in chunk:
+                    documents = chunk["context"]
+                if chunk.get("answer"):
+                    answer += chunk["answer"]
+                yield chunk
+            self.store(question, namespace, vector, answer, documents, time.perf_counter() - start)
+
+        return RunnableGenerator(record, arecord)
+
+    def stats(self):
+        """
+        Returns the hit rate and the saved latency.
+
+        Returns:
+            dict: The number of entries, hits and misses, the hit rate and the saved seconds.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "saved_seconds": round(self.saved_seconds, 3),
+        }
@@ -0,0 +1,312 @@
+from aiohttp import web
+from contextlib import asynccontextmanager
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from qdrant_client import AsyncQdrantClient
+from envs import MODEL, REWRITE_MODEL, EMBEDDING_MODEL, OPENAI_API_KEY, QDRANT_URL, QDRANT_PORT, QDRANT_API_KEY, COLLECTION_NAME
+from envs import QUERY_EMBEDDING_CACHE_SIZE, QUERY_EMBEDDING_REDIS_URL, QUERY_EMBEDDING_REDIS_TTL_SECONDS, VECTOR_STORE_BACKEND, CHAIN_REGISTRY_SIZE
+from envs import ANSWER_CACHE_ENABLED, ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_TTL_SECONDS, ANSWER_CACHE_MAX_SIZE
+from envs import HYBRID_SEARCH, HYBRID_K, HYBRID_IDENTIFIER_SHARE, HYBRID_LEXICAL_FLOOR
+from envs import API_PORT, API_CONCURRENCY, API_QUEUE_TIMEOUT_SECONDS, API_TIMEOUT_SECONDS, API_OPENAI_CONNECTIONS
+from llm_models import chain, context_packer, chain_tracer, CONTEXTUALIZE_Q_SYSTEM_PROMPT
+from vector_store_client import client, vectorstore, collection_fingerprint, lexical_index, dense_search_kwargs, ScoredQdrant
+from metadata_filter import normalize_filter
+from query_embedding_cache import CachedQueryEmbeddings
+from chain_registry import ChainRegistry
+from answer_cache import SemanticAnswerCache
+from hybrid_retriever import HybridRetriever
+import asyncio
+import json
+import logging
+import httpx
+
+DEFAULT_SEARCH_TYPE = "similarity_score_threshold"
+DEFAULT_SEARCH_KWARGS = {"score_threshold": 0.5}
+SEARCH_TYPES = ("similarity", "similarity_score_threshold", "mmr")
+
+
+class RagService:
+    """
+    The clients and chains shared by every request of the API.
+
+    The chat and embedding models send their requests through one pooled httpx client, the
+    Qdrant searches go through the AsyncQdrantClient, and the chains run with ainvoke/astream, so
+    a turn holds no thread while it waits on OpenAI or Qdrant. At most concurrency turns run at
+    the same time; a request that waits longer than queue_timeout for a slot is rejected with a
+    503, and a turn that takes longer than timeout is cancelled.
+
+    Args:
+        http_client (httpx.AsyncClient): The pooled HTTP client used for the OpenAI requests.
+        qdrant_client (AsyncQdrantClient): The async Qdrant client.
+        concurrency (int): The maximum number of turns running at the same time.
+        queue_timeout (float): The maximum time a request waits for a slot, in seconds.
+        timeout (float): The maximum duration of a turn, in seconds.
+
+    Attributes:
+        chains (ChainRegistry): The chains, one per retriever configuration.
+        answer_cache (SemanticAnswerCache): The answer cache, or None if disabled.
+        in_flight (int): The number of turns running.
+        rejected (int): The number of requests rejected because every slot was busy.
+        timeouts (int): The number of turns cancelled by the timeout.
+    """
+
+    def __init__(self, http_client, qdrant_client, concurrency=32, queue_timeout=5.0, timeout=60.0):
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self.llm = ChatOpenAI(model_name=MODEL, temperature=0, stream_usage=True, http_async_client=http_client, request_timeout=timeout)
+        self.rewrite_llm = ChatOpenAI(model_name=REWRITE_MODEL, temperature=0, http_async_client=http_client, request_timeout=timeout) if REWRITE_MODEL else None
+        self.embeddings = CachedQueryEmbeddings(
+            OpenAIEmbeddings(model=EMBEDDING_MODEL, api_key=OPENAI_API_KEY, http_async_client=http_client),
+            model=EMBEDDING_MODEL,
+            max_size=QUERY_EMBEDDING_CACHE_SIZE,
+            redis_url=QUERY_EMBEDDING_REDIS_URL,
+            redis_ttl_seconds=QUERY_EMBEDDING_REDIS_TTL_SECONDS,
+            tracer=chain_tracer,
+        )
+        if VECTOR_STORE_BACKEND == "qdrant":
+            self.vectorstore = ScoredQdrant(client=client, collection_name=COLLECTION_NAME, embeddings=self.embeddings, async_client=qdrant_client)
+        else:
+            # The local index is searched in process; only the query embedding is awaited
+            self.vectorstore = vectorstore
+        self.answer_cache = SemanticAnswerCache(
+            self.embeddings,
+            threshold=ANSWER_CACHE_THRESHOLD,
+            ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+            max_size=ANSWER_CACHE_MAX_SIZE,
+            fingerprint=collection_fingerprint,
+        ) if ANSWER_CACHE_ENABLED else None
+        self.chains = ChainRegistry(self._build_chain, max_size=CHAIN_REGISTRY_SIZE)
+        self.in_flight = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self._slots = asyncio.Semaphore(concurrency)
+
+    def _build_chain(self, search_type, search_kwargs):
+        retriever = self.vectorstore.as_retriever(
+            search_type=search_type,
+            search_kwargs=dense_search_kwargs(search_kwargs),
+        )
+        if HYBRID_SEARCH:
+            retriever = HybridRetriever(
+                dense=retriever,
+                lexical_index=lexical_index,
+                search_type=search_type,
+                search_kwargs=search_kwargs,
+                k=search_kwargs.get("k", HYBRID_K),
+                identifier_share=HYBRID_IDENTIFIER_SHARE,
+                lexical_floor=HYBRID_LEXICAL_FLOOR,
+                metadata_filter=search_kwargs.get("metadata_filter"),
+            )
+        return chain(retriever=retriever, llm=self.llm, contextualize_q_system_prompt=CONTEXTUALIZE_Q_SYSTEM_PROMPT,
+                     answer_cache=self.answer_cache, rewrite_llm=self.rewrite_llm)
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Waits for a free slot of the concurrency limiter and holds it.
+
+        Raises:
+            web.HTTPServiceUnavailable: If no slot frees up within queue_timeout.
+        """
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise web.HTTPServiceUnavailable(text="Too many concurrent requests", headers={"Retry-After": "1"})
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+
+    def stats(self):
+        """
+        Returns the counters of the service and of its caches.
+
+        Returns:
+            dict: The number of turns running, rejected and timed out, and the stats of the chains and caches.
+        """
+        return {
+            "in_flight": self.in_flight,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "chains": self.chains.stats(),
+            "answer_cache": self.answer_cache.stats() if self.answer_cache else None,
+            "query_embeddings": self.embeddings.stats(),
+            "context_tokens": context_packer.stats() if context_packer else None,
+        }
+
+
+SERVICE = web.AppKey("service", RagService)
+
+
+def _sources(documents):
+    return [{"title": doc.metadata.get("title"), "source": doc.metadata.get("source")} for doc in documents]
+
+
+async def _read_request(request):
+    try:
+        payload = await request.json()
+    except json.JSONDecodeError:
+        raise web.HTTPBadRequest(text="The body must be a JSON object")
+    question = payload.get("question") if isinstance(payload, dict) else None
+    if not isinstance(question, str) or not question.strip():
+        raise web.HTTPBadRequest(text="'question' must be a non-empty string")
+    chat_history = payload.get("chat_history") or []
+    if not isinstance(chat_history, list):
+        raise web.HTTPBadRequest(text="'chat_history' must be a list of {role, content} messages")
+    search_type = payload.get("search_type", DEFAULT_SEARCH_TYPE)
+    if search_type not in SEARCH_TYPES:
+        raise web.HTTPBadRequest(text=f"'search_type' must be one of {', '.join(SEARCH_TYPES)}")
+    search_kwargs = payload.get("search_kwargs", DEFAULT_SEARCH_KWARGS)
+    if not isinstance(search_kwargs, dict):
+        raise web.HTTPBadRequest(text="'search_kwargs' must be an object of scalar values")
+    search_kwargs = dict(search_kwargs)
+    metadata_filter = search_kwargs.pop("metadata_filter", None)
+    if not all(isinstance(value, (int, float, str)) for value in search_kwargs.values()):
+        raise web.HTTPBadRequest(text="'search_kwargs' must be an object of scalar values")
+    if metadata_filter is not None:
+        try:
+            if not isinstance(metadata_filter, dict):
+                raise ValueError("expected an object")
+            metadata_filter = normalize_filter(metadata_filter)
+        except (TypeError, ValueError) as e:
+            raise web.HTTPBadRequest(text=f"Invalid 'metadata_filter': {e}")
+        if metadata_filter:
+            search_kwargs["metadata_filter"] = metadata_filter
+    rag_chain = request.app[SERVICE].chains.get(search_type, search_kwargs)
+    return rag_chain, {"input": question, "chat_history": chat_history}
+
+
+async def ask(request):
+    """
+    Answers a question.
+
+    The body is a JSON object with the question, and optionally the chat_history (a list of
+    {role, content} messages), the search_type and the search_kwargs.
+
+    Returns:
+        web.Response: The answer, the standalone question and the sources, as JSON.
+    """
+    service = request.app[SERVICE]
+    rag_chain, inputs = await _read_request(request)
+    async with service.slot():
+        try:
+            response = await asyncio.wait_for(rag_chain.ainvoke(inputs), service.timeout)
+        except asyncio.TimeoutError:
+            service.timeouts += 1
+            raise web.HTTPGatewayTimeout(text=f"The answer took longer than {service.timeout}s")
+    return web.json_response({
+        "answer": response["answer"],
+        "standalone_question": response["standalone_question"],
+        "sources": _sources(response["context"]),
+    })
+
+
+async def ask_stream(request):
+    """
+    Answers a question as a stream of newline-delimited JSON events.
+
+    The body is the same as for /ask. The events are {"standalone_question": ...}, then
+    {"context": [sources]} as soon as the retrieval returns, then one {"answer": token} per
+    token. A turn that fails or times out after the stream started ends with an {"error": ...}
+    event.
+
+    Returns:
+        web.StreamResponse: The stream of events.
+    """
+    service = request.app[SERVICE]
+    rag_chain, inputs = await _read_request(request)
+    async with service.slot():
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + service.timeout
+        chunks = rag_chain.astream(inputs)
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), deadline - loop.time())
+                except StopAsyncIteration:
+                    break
+                events = []
+                if "standalone_question" in chunk:
+                    events.append({"standalone_question": chunk["standalone_question"]})
+                if "context" in chunk:
+                    events.append({"context": _sources(chunk["context"])})
+                if chunk.get("answer"):
+                    events.append({"answer": chunk["answer"]})
+                for event in events:
+                    await response.write((json.dumps(event) + "\n").encode("utf-8"))
+        except asyncio.TimeoutError:
+            service.timeouts += 1
+            await response.write((json.dumps({"error": f"The answer took longer than {service.timeout}s"}) + "\n").encode("utf-8"))
+        except ConnectionResetError:
+            # The client went away, there is nobody to report the error to
+            raise
+        except Exception as e:
+            logging.exception("The streamed turn failed")
+            await response.write((json.dumps({"error": str(e)}) + "\n").encode("utf-8"))
+        finally:
+            await chunks.aclose()
+        await response.write_eof()
+    return response
+
+
+async def health(request):
+    """
+    Returns the counters of the service, as JSON.
+    """
+    return web.json_response({"status": "ok", **request.app[SERVICE].stats()})
+
+
+async def metrics(request):
+    """
+    Returns the stage latencies, token counts and retrieval histograms of the chain tracer and the
+    counters of the service, in the Prometheus text format.
+    """
+    service = request.app[SERVICE]
+    lines = [
+        "# TYPE rag_api_in_flight gauge", f"rag_api_in_flight {service.in_flight}",
+        "# TYPE rag_api_rejected_total counter", f"rag_api_rejected_total {service.rejected}",
+        "# TYPE rag_api_timeouts_total counter", f"rag_api_timeouts_total {service.timeouts}",
+    ]
+    body = "\n".join(lines) + "\n" + (chain_tracer.render() if chain_tracer else "")
+    return web.Response(text=body, content_type="text/plain")
+
+
+async def _service(app):
+    # One pool of connections to OpenAI for every request of the process
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=API_OPENAI_CONNECTIONS, max_keepalive_connections=API_OPENAI_CONNECTIONS),
+        timeout=httpx.Timeout(API_TIMEOUT_SECONDS, connect=10.0),
+    )
+    qdrant_client = AsyncQdrantClient(url=QDRANT_URL, port=QDRANT_PORT, api_key=QDRANT_API_KEY)
+    app[SERVICE] = RagService(http_client, qdrant_client, concurrency=API_CONCURRENCY, queue_timeout=API_QUEUE_TIMEOUT_SECONDS, timeout=API_TIMEOUT_SECONDS)
+    app[SERVICE].chains.warm(DEFAULT_SEARCH_TYPE, DEFAULT_SEARCH_KWARGS)
+    yield
+    await qdrant_client.close()
+    await http_client.aclose()
+
+
+def create_app():
+    """
+    Creates the aiohttp application of the RAG API.
+
+    Returns:
+        web.Application: The application, with the /ask, /ask/stream, /health and /metrics routes.
+    """
+    app = web.Application()
+    app.cleanup_ctx.append(_service)
+    app.add_routes([
+        web.post("/ask", ask),
+        web.post("/ask/stream", ask_stream),
+        web.get("/health", health),
+        web.get("/metrics", metrics),
+    ])
+    return app
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    web.run_app(create_app(), port=API_PORT)
@@ -0,0 +1,135 @@
+from collections import OrderedDict
+import logging
+import threading
+import time
+
+
+def _freeze(value):
+    # Nested search kwargs (e.g. the metadata filter) as a hashable key
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+class ChainRegistry:
+    """
+    A process-wide LRU registry of RAG chains, one per retriever configuration.
+
+    Streamlit runs the whole script on every rerun and for every session, so the chains are built
+    here once per configuration (search type and search kwargs) and shared by every session. The
+    least recently used configuration is evicted when the registry is full. A chain is built
+    outside the registry lock, under a lock of its configuration, so concurrent lookups of the
+    same configuration build it once and the lookups of other configurations do not wait.
+
+    Args:
+        factory (callable): A function that receives a search type and the search kwargs and returns a chain.
+        max_size (int): The maximum number of chains kept.
+
+    Attributes:
+        hits (int): The number of lookups served by an existing chain.
+        misses (int): The number of lookups that built a chain.
+        evictions (int): The number of chains evicted.
+        build_seconds (float): The total time spent building chains.
+
+    Methods:
+        get(search_type, search_kwargs): Returns the chain of a configuration, building it if needed.
+        warm(search_type, search_kwargs): Builds the chain of a configuration ahead of the first lookup.
+        stats(): Returns the counters of the registry.
+    """
+
+    def __init__(self, factory, max_size=16):
+        self.factory = factory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.build_seconds = 0.0
+        self._chains = OrderedDict()
+        self._building = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(search_type, search_kwargs):
+        return search_type, _freeze(search_kwargs)
+
+    def get(self, search_type, search_kwargs):
+        """
+        Returns the chain of a retriever configuration, building it if needed.
+
+        Args:
+            search_type (str): The search type of the retriever.
+            search_kwargs (dict): The search kwargs of the retriever.
+
+        Returns:
+            Runnable: The RAG chain.
+        """
+        return self._get(self._key(search_type, search_kwargs), search_type, search_kwargs, count=True)
+
+    def _lookup(self, key, count):
+        # Called with the registry lock held
+        rag_chain = self._chains.get(key)
+        if rag_chain is not None:
+            self._chains.move_to_end(key)
+            if count:
+                self.hits += 1
+        return rag_chain
+
+    def _get(self, key, search_type, search_kwargs, count):
+        with self._lock:
+            rag_chain = self._lookup(key, count)
+            if rag_chain is not None:
+                return rag_chain
+            build_lock = self._building.setdefault(key, threading.Lock())
+        # Only the lookups of the same configuration wait for the build, the others are served meanwhile
+        with build_lock:
+            with self._lock:
+                rag_chain = self._lookup(key, count)
+                if rag_chain is not None:
+                    return rag_chain
+                if count:
+                    self.misses += 1
+            try:
+                start = time.perf_counter()
+                rag_chain = self.factory(search_type, dict(search_kwargs))
+                seconds = time.perf_counter() - start
+            finally:
+                with self._lock:
+                    if self._building.get(key) is build_lock:
+                        del self._building[key]
+            with self._lock:
+                self.build_seconds += seconds
+                self._chains[key] = rag_chain
+                if len(self._chains) > self.max_size:
+                    self._chains.popitem(last=False)
+                    self.evictions += 1
+        logging.info(f"Chain built for {key} in {seconds:.3f}s")
+        return rag_chain
+
+    def warm(self, search_type, search_kwargs):
+        """
+        Builds the chain of a retriever configuration ahead of the first lookup.
+
+        Args:
+            search_type (str): The search type of the retriever.
+            search_kwargs (dict): The search kwargs of the retriever.
+        """
+        self._get(self._key(search_type, search_kwargs), search_type, search_kwargs, count=False)
+
+    def stats(self):
+        """
+        Returns the counters of the registry.
+
+        Returns:
+            dict: The number of chains, hits, misses and evictions, and the build time.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "chains": len(self._chains),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "build_seconds": round(self.build_seconds, 3),
+        }
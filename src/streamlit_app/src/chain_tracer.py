@@ -0,0 +1,307 @@
+from langchain_core.callbacks import BaseCallbackHandler
+from contextvars import ContextVar
+import bisect
+import math
+import threading
+import time
+
+# Latency bucket bounds in seconds, from a cached query embedding (~0.1 ms) to a long generation (~30 s)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 4, 6, 8, 10, 15, 20, 50)
+SCORE_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0)
+# Runs cancelled without an end or error event (e.g. by a timeout) are dropped past this many open runs
+MAX_OPEN_RUNS = 10000
+# The stages named with traced() (the whole turn, rag_turn, only by its run name); the LLM calls inside them inherit the name
+STAGES = ("rag_turn", "contextualize_question", "context_packing", "answer")
+
+# The embedding time of the retrieval in progress, subtracted from its search time
+_embedding_seconds = ContextVar("embedding_seconds", default=None)
+
+
+class Histogram:
+    """
+    A cumulative histogram with fixed bucket bounds, in the Prometheus layout.
+
+    Args:
+        buckets (tuple): The upper bounds of the buckets, sorted.
+
+    Methods:
+        observe(value): Counts a value.
+        quantile(q): Estimates a quantile from the buckets.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """
+        Counts a value.
+
+        Args:
+            value (float): The value.
+        """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """
+        Estimates a quantile by linear interpolation inside its bucket, like histogram_quantile.
+
+        Args:
+            q (float): The quantile, between 0 and 1.
+
+        Returns:
+            float: The estimate, or None if nothing was observed.
+        """
+        if not self.count:
+            return None
+        rank, seen = q * self.count, 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                if index == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else min(0.0, self.buckets[0])
+                return lower + (self.buckets[index] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+def _format(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _labels(labels):
+    return ",".join(f'{key}="{value}"' for key, value in labels)
+
+
+def traced(runnable, stage):
+    """
+    Names a runnable as a stage of the tracer.
+
+    The stage is also set in the metadata, which the LLM calls inside it inherit. The metadata of
+    an outer run overrides it, so the whole turn (rag_turn) is only named.
+
+    Args:
+        runnable (Runnable): The runnable.
+        stage (str): One of STAGES.
+
+    Returns:
+        Runnable: The runnable, with the stage as its run name and metadata.
+    """
+    return runnable.with_config(run_name=stage, metadata={"stage": stage})
+
+
+class ChainTracer(BaseCallbackHandler):
+    """
+    A callback handler that records where the turns of the RAG chain spend their time.
+
+    It keeps in-process histograms of the wall time of each stage (the runs named with traced(),
+    the retrievals, the query embeddings and the search itself), of the LLM calls and their time
+    to first token, of the number of retrieved documents and of their scores, and counters of the
+    LLM tokens. It runs inline, with a dict lookup and a histogram update per event, so it can stay
+    on in production. render() returns the Prometheus text format and summary() the panel view.
+
+    Args:
+        prefix (str): The prefix of the metric names.
+
+    Methods:
+        observe_embedding(seconds, cached): Records a query embedding.
+        render(): Returns the metrics in the Prometheus text format.
+        summary(): Returns the count, mean and estimated p50/p95 of each stage.
+    """
+
+    run_inline = True
+    raise_error = False
+
+    def __init__(self, prefix="rag"):
+        self.prefix = prefix
+        self._histograms = {}
+        self._counters = {}
+        self._runs = {}
+        self._lock = threading.Lock()
+
+    def _observe(self, name, labels, value, buckets=LATENCY_BUCKETS):
+        with self._lock:
+            key = (name, labels)
+            if key not in self._histograms:
+                self._histograms[key] = Histogram(buckets)
+            self._histograms[key].observe(value)
+
+    def _increment(self, name, labels, value=1):
+        with self._lock:
+            self._counters[(name, labels)] = self._counters.get((name, labels), 0) + value
+
+    def _start(self, run_id, run):
+        if len(self._runs) >= MAX_OPEN_RUNS:
+            self._runs.clear()
+        self._runs[run_id] = run
+
+    def _finish(self, run_id):
+        return self._runs.pop(run_id, None)
+
+    def observe_embedding(self, seconds, cached):
+        """
+        Records a query embedding, and adds its time to the retrieval in progress.
+
+        Args:
+            seconds (float): The duration of the embedding.
+            cached (bool): Whether it was served by the cache.
+        """
+        self._observe("stage_seconds", (("stage", "embed_query"),), seconds)
+        self._increment("query_embeddings_total", (("cache", "hit" if cached else "miss"),))
+        pending = _embedding_seconds.get()
+        if pending is not None:
+            pending[0] += seconds
+
+    # The stages named with traced()
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, tags=None, metadata=None, **kwargs):
+        name = kwargs.get("name")
+        if name in STAGES:
+            self._start(run_id, (name, time.perf_counter()))
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        run = self._finish(run_id)
+        if run is not None:
+            self._observe("stage_seconds", (("stage", run[0]),), time.perf_counter() - run[1])
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        run = self._finish(run_id)
+        if run is not None:
+            self._increment("stage_errors_total", (("stage", run[0]),))
+
+    # Only the outermost retrieval is timed (the hybrid retriever calls the dense one)
+    def on_retriever_start(self, serialized, query, *, run_id, parent_run_id=None, **kwargs):
+        parent = self._runs.get(parent_run_id)
+        if parent is not None and parent[0] == "retrieval":
+            return
+        pending = [0.0]
+        _embedding_seconds.set(pending)
+        self._start(run_id, ("retrieval", time.perf_counter(), pending))
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        run = self._finish(run_id)
+        if run is None:
+            return
+        seconds = time.perf_counter() - run[1]
+        self._observe("stage_seconds", (("stage", "retrieval"),), seconds)
+        self._observe("stage_seconds", (("stage", "search"),), max(0.0, seconds - run[2][0]))
+        self._observe("retrieved_documents", (), len(documents), COUNT_BUCKETS)
+        for doc in documents:
+            score = doc.metadata.get("_score")
+            if isinstance(score, (int, float)):
+                self._observe("retrieval_score", (), float(score), SCORE_BUCKETS)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        if self._finish(run_id) is not None:
+            self._increment("stage_errors_total", (("stage", "retrieval"),))
+
+    # The LLM calls, labelled with the stage that contains them
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, tags=None, metadata=None, **kwargs):
+        stage = (metadata or {}).get("stage", "llm")
+        self._start(run_id, [stage, time.perf_counter(), None, 0])
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, tags=None, metadata=None, **kwargs):
+        stage = (metadata or {}).get("stage", "llm")
+        self._start(run_id, [stage, time.perf_counter(), None, 0])
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        run = self._runs.get(run_id)
+        if run is None:
+            return
+        if run[2] is None:
+            run[2] = time.perf_counter()
+            self._observe("llm_first_token_seconds", (("stage", run[0]),), run[2] - run[1])
+        run[3] += 1
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        run = self._finish(run_id)
+        if run is None:
+            return
+        stage = run[0]
+        self._observe("llm_seconds", (("stage", stage),), time.perf_counter() - run[1])
+        prompt_tokens, completion_tokens = _token_usage(response)
+        if completion_tokens is None:
+            # Without the usage reported by the API (streaming), each chunk counts as a token
+            completion_tokens = run[3]
+        if prompt_tokens:
+            self._increment("llm_tokens_total", (("stage", stage), ("kind", "prompt")), prompt_tokens)
+        if completion_tokens:
+            self._increment("llm_tokens_total", (("stage", stage), ("kind", "completion")), completion_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        run = self._finish(run_id)
+        if run is not None:
+            self._increment("llm_errors_total", (("stage", run[0]),))
+
+    def render(self):
+        """
+        Returns the metrics in the Prometheus text exposition format.
+
+        Returns:
+            str: The metrics.
+        """
+        with self._lock:
+            histograms = {key: (list(h.counts), h.sum, h.count, h.buckets) for key, h in self._histograms.items()}
+            counters = dict(self._counters)
+        lines, typed = [], set()
+        for (name, labels), (counts, total, count, buckets) in sorted(histograms.items()):
+            metric = f"{self.prefix}_{name}"
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} histogram")
+                typed.add(metric)
+            cumulative = 0
+            for bound, bucket_count in zip(buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                lines.append(f"{metric}_bucket{{{_labels(labels + (('le', _format(bound)),))}}} {cumulative}")
+            suffix = f"{{{_labels(labels)}}}" if labels else ""
+            lines.append(f"{metric}_sum{suffix} {_format(total)}")
+            lines.append(f"{metric}_count{suffix} {count}")
+        for (name, labels), value in sorted(counters.items()):
+            metric = f"{self.prefix}_{name}"
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} counter")
+                typed.add(metric)
+            suffix = f"{{{_labels(labels)}}}" if labels else ""
+            lines.append(f"{metric}{suffix} {value}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """
+        Returns the count, mean and estimated p50/p95 of each stage and LLM call, in milliseconds.
+
+        Returns:
+            dict: The summary of each stage.
+        """
+        with self._lock:
+            summary = {}
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                if name not in ("stage_seconds", "llm_seconds", "llm_first_token_seconds") or not histogram.count:
+                    continue
+                label = dict(labels)["stage"] + {"stage_seconds": "", "llm_seconds": " (llm)", "llm_first_token_seconds": " (first token)"}[name]
+                summary[label] = {
+                    "count": histogram.count,
+                    "mean_ms": round(1000 * histogram.sum / histogram.count, 1),
+                    "p50_ms": round(1000 * histogram.quantile(0.5), 1),
+                    "p95_ms": round(1000 * histogram.quantile(0.95), 1),
+                }
+            return summary
+
+
+def _token_usage(response):
+    # The token usage reported by the API: in the llm_output (invoke) or in the generated message (stream_usage)
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    if usage:
+        return usage.get("prompt_tokens"), usage.get("completion_tokens")
+    for generations in response.generations:
+        for generation in generations:
+            message = getattr(generation, "message", None)
+            usage_metadata = getattr(message, "usage_metadata", None)
+            if usage_metadata:
+                return usage_metadata.get("input_tokens"), usage_metadata.get("output_tokens")
+    return None, None
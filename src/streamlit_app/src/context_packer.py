@@ -0,0 +1,219 @@
+from collections import deque
+from langchain_core.documents import Document
+from langchain_core.runnables import RunnableLambda
+import logging
+import math
+import re
+import threading
+import numpy as np
+
+_WORDS = re.compile(r"\w+")
+
+
+def _encoding(model):
+    try:
+        import tiktoken
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # Without the tokenizer (not installed, or its file cannot be downloaded) the tokens are estimated
+        logging.warning(f"No tokenizer for {model}, estimating the context tokens: {e}")
+        return None
+
+
+def _text_overlap(first, second, min_overlap):
+    # The length of the longest suffix of first that is a prefix of second
+    if len(first) < min_overlap or len(second) < min_overlap:
+        return 0
+    head = second[:min_overlap]
+    position = first.find(head, max(0, len(first) - len(second)))
+    while position != -1:
+        if second.startswith(first[position:]):
+            return len(first) - position
+        position = first.find(head, position + 1)
+    return 0
+
+
+def _trigrams(text):
+    words = _WORDS.findall(text.lower())
+    return {tuple(words[index:index + 3]) for index in range(max(1, len(words) - 2))}
+
+
+class ContextPacker:
+    """
+    Packs the retrieved chunks into the context of the answer prompt within a token budget.
+
+    The chunks of the same source are merged when they overlap or touch, using their start_index
+    when the ingestion recorded it and the overlap of their texts otherwise, so the overlapping
+    neighbors of a page are sent once. The merged blocks are then taken in retrieval (score)
+    order: a block whose word trigrams are mostly in the blocks already taken is dropped as
+    redundant, and a block that does not fit in the remaining budget is skipped for the smaller
+    ones after it. The first block is truncated if it alone exceeds the budget. The tokens
+    retrieved and sent of each turn are logged and recorded.
+
+    Args:
+        token_budget (int): The maximum number of context tokens sent to the model.
+        model (str): The chat model whose tokenizer counts the tokens.
+        redundancy (float): The share of a block's trigrams already in the context above which it is dropped.
+        min_overlap (int): The minimum number of characters for two texts to be merged on their overlap.
+        window (int): The number of recent turns used for the token statistics.
+
+    Attributes:
+        turns (int): The number of packed contexts.
+
+    Methods:
+        count(text): Returns the number of tokens of a text.
+        pack(documents): Returns the packed documents.
+        runnable(): Returns a runnable that packs a list of documents.
+        stats(): Returns the token statistics.
+    """
+
+    def __init__(self, token_budget=3000, model=None, redundancy=0.9, min_overlap=20, window=1000):
+        self.token_budget = token_budget
+        self.redundancy = redundancy
+        self.min_overlap = min_overlap
+        self.turns = 0
+        self._encoding = _encoding(model)
+        self._retrieved = deque(maxlen=window)
+        self._packed = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def count(self, text):
+        """
+        Returns the number of tokens of a text.
+
+        Args:
+            text (str): The text.
+
+        Returns:
+            int: The number of tokens, estimated at four characters per token without a tokenizer.
+        """
+        if self._encoding is None:
+            return math.ceil(len(text) / 4)
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+    def _truncate(self, text, tokens):
+        if self._encoding is None:
+            return text[:tokens * 4]
+        return self._encoding.decode(self._encoding.encode(text, disallowed_special=())[:tokens])
+
+    def _merge_positioned(self, parts):
+        # parts: (rank, document) with a start_index, merged in the order of the page
+        blocks = []
+        for rank, doc in sorted(parts, key=lambda part: part[1].metadata["start_index"]):
+            start = doc.metadata["start_index"]
+            skip = blocks[-1]["end"] - start if blocks else 0
+            # An overlap is only trusted if the texts agree on it, in case a position is out of date
+            if blocks and skip >= -2 and (skip <= 0 or blocks[-1]["text"][-skip:].startswith(doc.page_content[:skip])):
+                block = blocks[-1]
+                if skip < len(doc.page_content):
+                    block["text"] += (doc.page_content[skip:] if skip > 0 else " " + doc.page_content)
+                    block["end"] = start + len(doc.page_content)
+                block["rank"] = min(block["rank"], rank)
+                block["chunks"] += 1
+            else:
+                blocks.append({"rank": rank, "text": doc.page_content, "metadata": doc.metadata, "chunks": 1, "end": start + len(doc.page_content)})
+        return blocks
+
+    def _merge_by_text(self, parts):
+        blocks = [{"rank": rank, "text": doc.page_content, "metadata": doc.metadata, "chunks": 1} for rank, doc in parts]
+        merged = True
+        while merged and len(blocks) > 1:
+            merged = False
+            for first in blocks:
+                for second in blocks:
+                    if first is second:
+                        continue
+                    overlap = _text_overlap(first["text"], second["text"], self.min_overlap)
+                    if overlap:
+                        first["text"] += second["text"][overlap:]
+                        first["rank"] = min(first["rank"], second["rank"])
+                        first["chunks"] += second["chunks"]
+                        blocks.remove(second)
+                        merged = True
+                        break
+                if merged:
+                    break
+        return blocks
+
+    def _blocks(self, documents):
+        groups = {}
+        for rank, doc in enumerate(documents):
+            groups.setdefault(doc.metadata.get("source"), []).append((rank, doc))
+        blocks = []
+        for parts in groups.values():
+            positioned = [part for part in parts if isinstance(part[1].metadata.get("start_index"), int)]
+            # Positions are only comparable between chunks of the same version of the page
+            versions = {}
+            for part in positioned:
+                versions.setdefault(part[1].metadata.get("page_hash"), []).append(part)
+            for version in versions.values():
+                blocks.extend(self._merge_positioned(version))
+            blocks.extend(self._merge_by_text([part for part in parts if part not in positioned]))
+        return sorted(blocks, key=lambda block: block["rank"])
+
+    def pack(self, documents):
+        """
+        Merges, deduplicates and trims the retrieved documents to the token budget.
+
+        Args:
+            documents (list): The retrieved documents, best first.
+
+        Returns:
+            list: The packed documents, best first. Merged documents keep the metadata of their first chunk and have a merged_chunks count.
+        """
+        retrieved = sum(self.count(doc.page_content) for doc in documents)
+        packed, seen, tokens, dropped = [], set(), 0, 0
+        for block in self._blocks(documents):
+            trigrams = _trigrams(block["text"])
+            if packed and len(trigrams & seen) >= self.redundancy * len(trigrams):
+                dropped += 1
+                continue
+            text = block["text"]
+            size = self.count(text)
+            if tokens + size > self.token_budget:
+                if packed:
+                    dropped += 1
+                    continue
+                text = self._truncate(text, self.token_budget)
+                size = self.count(text)
+            metadata = dict(block["metadata"])
+            if block["chunks"] > 1:
+                metadata["merged_chunks"] = block["chunks"]
+            packed.append(Document(page_content=text, metadata=metadata))
+            seen |= trigrams
+            tokens += size
+        with self._lock:
+            self.turns += 1
+            self._retrieved.append(retrieved)
+            self._packed.append(tokens)
+        logging.info(f"Context packed: {len(documents)} chunks into {len(packed)} blocks ({dropped} dropped), {retrieved} -> {tokens} tokens")
+        return packed
+
+    def runnable(self):
+        """
+        Returns a runnable that packs a list of documents.
+
+        Returns:
+            RunnableLambda: The runnable.
+        """
+        return RunnableLambda(self.pack)
+
+    def stats(self):
+        """
+        Returns the token statistics of the recent turns.
+
+        Returns:
+            dict: The number of turns, the mean tokens retrieved and sent, the p95 of the tokens sent and the share of tokens saved.
+        """
+        with self._lock:
+            retrieved, packed = list(self._retrieved), list(self._packed)
+        stats = {"turns": self.turns}
+        if packed:
+            stats["mean_retrieved_tokens"] = round(float(np.mean(retrieved)), 1)
+            stats["mean_sent_tokens"] = round(float(np.mean(packed)), 1)
+            stats["p95_sent_tokens"] = round(float(np.percentile(packed, 95)), 1)
+            stats["saved_share"] = round(1 - sum(packed) / sum(retrieved), 3) if sum(retrieved) else 0.0
+        return stats
@@ -12,6 +12,40 @@ QDRANT_PORT = os.getenv("QDRANT_PORT")
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL")
 COLLECTION_NAME = os.getenv("COLLECTION_NAME")
 MODEL = os.getenv("MODEL")
+CHAIN_REGISTRY_SIZE = int(os.getenv("CHAIN_REGISTRY_SIZE", "16"))
+STREAM_ANSWERS = os.getenv("STREAM_ANSWERS", "true").lower() == "true"
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", "86400"))
+ANSWER_CACHE_MAX_SIZE = int(os.getenv("ANSWER_CACHE_MAX_SIZE", "1000"))
+COLLECTION_REFRESH_SECONDS = int(os.getenv("COLLECTION_REFRESH_SECONDS", "300"))
+REWRITE_MODEL = os.getenv("REWRITE_MODEL")
+REWRITE_POLICY = os.getenv("REWRITE_POLICY", "auto")
+REWRITE_MAX_OVERLAP = float(os.getenv("REWRITE_MAX_OVERLAP", "0.5"))
+SPECULATIVE_RETRIEVAL = os.getenv("SPECULATIVE_RETRIEVAL", "false").lower() == "true"
+SPECULATIVE_THRESHOLD = float(os.getenv("SPECULATIVE_THRESHOLD", "0.9"))
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "1024"))
+QUERY_EMBEDDING_REDIS_URL = os.getenv("QUERY_EMBEDDING_REDIS_URL")
+QUERY_EMBEDDING_REDIS_TTL_SECONDS = int(os.getenv("QUERY_EMBEDDING_REDIS_TTL_SECONDS", "604800"))
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "false").lower() == "true"
+HYBRID_K = int(os.getenv("HYBRID_K", "4"))
+HYBRID_IDENTIFIER_SHARE = float(os.getenv("HYBRID_IDENTIFIER_SHARE", "0.5"))
+HYBRID_LEXICAL_FLOOR = float(os.getenv("HYBRID_LEXICAL_FLOOR", "0.3"))
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "qdrant")
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", ".cache/local_index")
+COLLECTION_PROFILE = os.getenv("COLLECTION_PROFILE")
+CONTEXT_PACKING = os.getenv("CONTEXT_PACKING", "true").lower() == "true"
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+CONTEXT_REDUNDANCY = float(os.getenv("CONTEXT_REDUNDANCY", "0.9"))
+CHAIN_TRACING = os.getenv("CHAIN_TRACING", "true").lower() == "true"
+RAG_API_URL = os.getenv("RAG_API_URL")
+API_PORT = int(os.getenv("API_PORT", "8080"))
+API_CONCURRENCY = int(os.getenv("API_CONCURRENCY", "32"))
+API_QUEUE_TIMEOUT_SECONDS = float(os.getenv("API_QUEUE_TIMEOUT_SECONDS", "5"))
+API_TIMEOUT_SECONDS = float(os.getenv("API_TIMEOUT_SECONDS", "60"))
+API_OPENAI_CONNECTIONS = int(os.getenv("API_OPENAI_CONNECTIONS", "64"))
+# Threads of the speculative searches: one per turn running a rewrite at the same time
+SPECULATIVE_WORKERS = int(os.getenv("SPECULATIVE_WORKERS", "16"))
 LINKEDIN_URL = "https://www.linkedin.com/in/rodolfo-grimaldi/"
 GITHUB_URL = "https://github.com/grimaldi89/martechito-ga4-assistant"
 LINKEDIN_IMAGE = "https://upload.wikimedia.org/wikipedia/commons/c/ca/LinkedIn_logo_initials.png"
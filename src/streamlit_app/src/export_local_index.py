@@ -0,0 +1,29 @@
+"""
+Exports the Qdrant collection into a local index, searched in-process when VECTOR_STORE_BACKEND=local.
+
+Usage:
+    python src/export_local_index.py [--output .cache/local_index] [--dtype float16] [--hnsw]
+"""
+from qdrant_client import QdrantClient
+from local_vector_store import export_collection
+from envs import QDRANT_API_KEY, QDRANT_URL, QDRANT_PORT, COLLECTION_NAME, LOCAL_INDEX_DIR
+import argparse
+import json
+import logging
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default=LOCAL_INDEX_DIR)
+    parser.add_argument("--dtype", choices=["float32", "float16"], default="float32")
+    parser.add_argument("--hnsw", action="store_true", help="Also build an HNSW index (requires hnswlib)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    client = QdrantClient(url=QDRANT_URL, port=QDRANT_PORT, api_key=QDRANT_API_KEY)
+    manifest = export_collection(client, COLLECTION_NAME, args.output, dtype=args.dtype, hnsw=args.hnsw)
+    print(json.dumps(manifest, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from rewrite_policy import STOPWORDS
+from metadata_filter import filter_key, matches
+from collections import Counter
+from typing import Any, List, Optional
+import asyncio
+import logging
+import math
+import re
+import threading
+import time
+import numpy as np
+
+_TOKENS = re.compile(r"\w+")
+MAX_CACHED_FILTERS = 64
+
+
+def tokenize(text):
+    """
+    Splits a text into lowercase tokens without stopwords. Identifiers such as session_start are kept whole and also split into their parts.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        list: The tokens.
+    """
+    tokens = []
+    for token in _TOKENS.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        tokens.append(token)
+        if "_" in token:
+            tokens.extend(part for part in token.split("_") if part)
+    return tokens
+
+
+class BM25Index:
+    """
+    An in-memory BM25 inverted index over chunk documents.
+
+    Each token maps to the NumPy arrays of the documents containing it and of its frequency in
+    each one, so a query is scored with a few vectorized updates per query token.
+
+    Args:
+        documents (list): The documents.
+        k1 (float): The BM25 term frequency saturation.
+        b (float): The BM25 length normalization.
+
+    Attributes:
+        identifiers (set): The snake_case identifiers found in the documents (session_start, page_location...).
+    """
+
+    def __init__(self, documents, k1=1.5, b=0.75):
+        self.documents = documents
+        self.k1 = k1
+        postings = {}
+        lengths = np.zeros(len(documents), dtype=np.float32)
+        for index, doc in enumerate(documents):
+            tokens = tokenize(doc.page_content)
+            lengths[index] = len(tokens)
+            for token, count in Counter(tokens).items():
+                postings.setdefault(token, []).append((index, count))
+        average = float(lengths.mean()) if len(documents) else 0.0
+        self._norm = k1 * (1 - b + b * lengths / (average or 1.0))
+        self._postings = {}
+        for token, entries in postings.items():
+            rows = np.array([entry[0] for entry in entries], dtype=np.int32)
+            counts = np.array([entry[1] for entry in entries], dtype=np.float32)
+            idf = math.log(1 + (len(documents) - len(entries) + 0.5) / (len(entries) + 0.5))
+            self._postings[token] = (rows, counts, idf)
+        self.identifiers = {token for token in self._postings if "_" in token.strip("_")}
+        self._masks = {}
+
+    def _mask(self, metadata_filter):
+        key = filter_key(metadata_filter)
+        if key not in self._masks:
+            if len(self._masks) >= MAX_CACHED_FILTERS:
+                self._masks.clear()
+            self._masks[key] = np.array([matches(doc.metadata, metadata_filter) for doc in self.documents], dtype=bool)
+        return self._masks[key]
+
+    def search(self, query, k, metadata_filter=None, min_score=0.0):
+        """
+        Returns the documents that best match a query.
+
+        Args:
+            query (str): The query.
+            k (int): The maximum number of documents.
+            metadata_filter (dict): A canonical metadata filter the documents must pass, or None.
+            min_score (float): The minimum score, as a share of the highest score a document could reach for the query.
+
+        Returns:
+            list: The matching documents and their scores, best first.
+        """
+        scores = np.zeros(len(self.documents), dtype=np.float32)
+        ceiling = 0.0
+        for token in set(tokenize(query)):
+            if token in self._postings:
+                rows, counts, idf = self._postings[token]
+                scores[rows] += idf * counts * (self.k1 + 1) / (counts + self._norm[rows])
+                # Each term adds less than idf * (k1 + 1), whatever its frequency
+                ceiling += idf * (self.k1 + 1)
+        if min_score:
+            scores[scores < min_score * ceiling] = 0.0
+        if metadata_filter:
+            scores[~self._mask(metadata_filter)] = 0.0
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates])]
+        return [(self.documents[index], float(scores[index])) for index in candidates]
+
+    def identifier_share(self, query):
+        """
+        Returns the share of the query's content words that are known identifiers.
+
+        Args:
+            query (str): The query.
+
+        Returns:
+            float: The share, between 0 and 1.
+        """
+        words = [word for word in _TOKENS.findall(query.lower()) if word not in STOPWORDS]
+        if not words:
+            return 0.0
+        return sum(word in self.identifiers for word in words) / len(words)
+
+
+class LexicalIndex:
+    """
+    Keeps a BM25 index of a Qdrant collection, rebuilt from a scroll of the collection whenever its fingerprint changes.
+
+    Only the first build blocks, and warm() runs it in the background at startup. When the
+    collection changes, the previous index keeps serving while the new one is built in a
+    background thread, so queries never wait for the scroll of a re-ingested collection.
+
+    Args:
+        client (QdrantClient): The Qdrant client.
+        collection_name (str): The name of the collection.
+        fingerprint (CollectionFingerprint): The fingerprint of the collection.
+        content_payload_key (str): The payload key of the chunk text.
+        metadata_payload_key (str): The payload key of the chunk metadata.
+        load_documents (callable): A function returning the documents to index instead of the scroll, e.g. LocalVectorStore.documents.
+    """
+
+    def __init__(self, client, collection_name, fingerprint, content_payload_key="page_content", metadata_payload_key="metadata", load_documents=None):
+        self.client = client
+        self.collection_name = collection_name
+        self.fingerprint = fingerprint
+        self.load_documents = load_documents
+        self.content_payload_key = content_payload_key
+        self.metadata_payload_key = metadata_payload_key
+        self._index = None
+        self._version = None
+        self._building = False
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+
+    def _load(self):
+        if self.load_documents is not None:
+            return self.load_documents()
+        documents, offset = [], None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=self.collection_name,
+                limit=1000,
+                offset=offset,
+                with_payload=[self.content_payload_key, self.metadata_payload_key],
+                with_vectors=False,
+            )
+            for point in points:
+                # Same metadata as the documents returned by the Qdrant vector store
+                metadata = dict(point.payload.get(self.metadata_payload_key) or {})
+                metadata["_id"] = point.id
+                metadata["_collection_name"] = self.collection_name
+                documents.append(Document(page_content=point.payload.get(self.content_payload_key, ""), metadata=metadata))
+            if offset is None:
+                return documents
+
+    def _build(self, version):
+        with self._build_lock:
+            try:
+                with self._lock:
+                    if self._index is not None and self._version == version:
+                        return self._index
+                start = time.perf_counter()
+                index = BM25Index(self._load())
+                with self._lock:
+                    self._index, self._version = index, version
+                logging.info(f"Lexical index built with {len(index.documents)} chunks in {time.perf_counter() - start:.2f}s")
+                return index
+            finally:
+                self._building = False
+
+    def _build_in_background(self, version):
+        try:
+            self._build(version)
+        except Exception:
+            logging.exception("Failed to build the lexical index")
+
+    def current(self):
+        """
+        Returns the BM25 index. The first call builds it; later calls return the current index
+        and start a background rebuild if the collection changed.
+
+        Returns:
+            BM25Index: The index.
+        """
+        version = self.fingerprint.current()
+        with self._lock:
+            index = self._index
+            if index is not None and version != self._version and not self._building:
+                self._building = True
+                threading.Thread(target=self._build_in_background, args=(version,), daemon=True).start()
+        if index is not None:
+            return index
+        return self._build(version)
+
+    def documents(self):
+        """
+        Returns the chunks of the collection: those of the index once it is built, otherwise a fresh
+        scroll, so callers that only need the chunks do not build (and keep) the index.
+
+        Returns:
+            list: The chunk documents.
+        """
+        with self._lock:
+            index = self._index
+        return index.documents if index is not None else self._load()
+
+    def warm(self):
+        """
+        Builds the index in a background thread, so the first query does not wait for the scroll.
+        """
+        threading.Thread(target=self._build_in_background, args=(self.fingerprint.current(),), daemon=True).start()
+
+
+def _key(doc):
+    return doc.metadata.get("_id", doc.page_content)
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Runs a BM25 search alongside the dense search and merges both rankings with reciprocal rank fusion.
+
+    When the known identifiers (session_start, engagement_time_msec...) make up at least
+    identifier_share of the query's content words, only the lexical search runs. A metadata
+    filter restricts the lexical results to the same slice as the dense retriever's filter.
+    When the dense search has a score_threshold, the lexical results must reach lexical_floor,
+    the lexical counterpart of the threshold, to be fused or returned alone.
+
+    Attributes:
+        dense (BaseRetriever): The dense retriever.
+        lexical_index (LexicalIndex): The BM25 index of the collection.
+        search_type (str): The search type of the dense retriever.
+        search_kwargs (dict): The search kwargs of the dense retriever.
+        k (int): The number of documents returned.
+        rrf_k (int): The rank constant of the fusion.
+        identifier_share (float): The minimum share of identifiers for the lexical-only path.
+        lexical_floor (float): The minimum BM25 score, as a share of the highest possible score of the query, under a score_threshold.
+        metadata_filter (dict): A canonical metadata filter of the lexical search, or None.
+    """
+
+    dense: BaseRetriever
+    lexical_index: Any
+    search_type: str = "similarity"
+    search_kwargs: dict = {}
+    k: int = 4
+    rrf_k: int = 60
+    identifier_share: float = 0.5
+    lexical_floor: float = 0.3
+    metadata_filter: Optional[dict] = None
+
+    def _fuse(self, dense, lexical):
+        scores, documents = {}, {}
+        for ranking in (dense, lexical):
+            for rank, doc in enumerate(ranking):
+                key = _key(doc)
+                documents.setdefault(key, doc)
+                scores[key] = scores.get(key, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+        fused = sorted(scores, key=scores.get, reverse=True)[:self.k]
+        return [documents[key] for key in fused]
+
+    def _lexical(self, index, query):
+        floor = self.lexical_floor if self.search_kwargs.get("score_threshold") is not None else 0.0
+        return [doc for doc, _ in index.search(query, self.k, self.metadata_filter, min_score=floor)]
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        index = self.lexical_index.current()
+        lexical = self._lexical(index, query)
+        if lexical and index.identifier_share(query) >= self.identifier_share:
+            logging.info(f"Lexical fast path for: {query}")
+            return lexical
+        dense = self.dense.invoke(query, config={"callbacks": run_manager.get_child()})
+        return self._fuse(dense, lexical)
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        # The first build scrolls the collection with the blocking client
+        index = await asyncio.to_thread(self.lexical_index.current)
+        lexical = self._lexical(index, query)
+        if lexical and index.identifier_share(query) >= self.identifier_share:
+            logging.info(f"Lexical fast path for: {query}")
+            return lexical
+        dense = await self.dense.ainvoke(query, config={"callbacks": run_manager.get_child()})
+        return self._fuse(dense, lexical)
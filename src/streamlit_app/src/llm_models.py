@@ -2,19 +2,49 @@
 from langchain_openai import OpenAIEmbeddings, ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain.chains import create_retrieval_chain, create_history_aware_retriever
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import RunnableLambda, RunnablePassthrough
+from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor
 from envs import MODEL, QDRANT_API_KEY, QDRANT_URL, QDRANT_PORT, EMBEDDING_MODEL, OPENAI_API_KEY
+from envs import REWRITE_MODEL, REWRITE_POLICY, REWRITE_MAX_OVERLAP, SPECULATIVE_THRESHOLD, SPECULATIVE_WORKERS
+from envs import CONTEXT_PACKING, CONTEXT_TOKEN_BUDGET, CONTEXT_REDUNDANCY, CHAIN_TRACING
+from envs import QUERY_EMBEDDING_CACHE_SIZE, QUERY_EMBEDDING_REDIS_URL, QUERY_EMBEDDING_REDIS_TTL_SECONDS
+from rewrite_policy import RewritePolicy
+from context_packer import ContextPacker
+from speculative_retrieval import SpeculationMetrics, SpeculativeRetrieval
+from chain_tracer import ChainTracer, traced
+from query_embedding_cache import CachedQueryEmbeddings
 
-llm = ChatOpenAI(model_name=MODEL, temperature=0)
+# stream_usage: os tokens das respostas em streaming também chegam ao chain_tracer
+llm = ChatOpenAI(model_name=MODEL, temperature=0, stream_usage=True)
 embeddings = OpenAIEmbeddings(model=EMBEDDING_MODEL, api_key=OPENAI_API_KEY)
+# Modelo (mais barato/rápido) usado só para reescrever a pergunta
+rewrite_llm = ChatOpenAI(model_name=REWRITE_MODEL, temperature=0) if REWRITE_MODEL else None
+rewrite_policy = RewritePolicy(max_overlap=REWRITE_MAX_OVERLAP, mode=REWRITE_POLICY)
+speculation_metrics = SpeculationMetrics()
+# Buscas especulativas de todas as cadeias do processo (as threads só são criadas quando usadas)
+speculative_executor = ThreadPoolExecutor(max_workers=SPECULATIVE_WORKERS, thread_name_prefix="speculative-retrieval")
+# Trechos sobrepostos da mesma página são unidos e o contexto é limitado a CONTEXT_TOKEN_BUDGET tokens
+context_packer = ContextPacker(token_budget=CONTEXT_TOKEN_BUDGET, model=MODEL, redundancy=CONTEXT_REDUNDANCY) if CONTEXT_PACKING else None
+# Tempo de cada etapa do turno (reescrita, embedding, busca, geração), tokens e documentos recuperados
+chain_tracer = ChainTracer() if CHAIN_TRACING else None
+# Perguntas repetidas não voltam à API de embeddings
+query_embeddings = CachedQueryEmbeddings(
+    embeddings,
+    model=EMBEDDING_MODEL,
+    max_size=QUERY_EMBEDDING_CACHE_SIZE,
+    redis_url=QUERY_EMBEDDING_REDIS_URL,
+    redis_ttl_seconds=QUERY_EMBEDDING_REDIS_TTL_SECONDS,
+    tracer=chain_tracer,
+)
 CONTEXTUALIZE_Q_SYSTEM_PROMPT = """Given a chat history and the latest user question \
     which might reference context in the chat history, formulate a standalone question \
     which can be understood without the chat history. Do NOT answer the question, \
     just reformulate it if needed and otherwise return it as is.
     """
 
-# Função para criar a cadeia de recuperação
-def chain(retriever, llm, contextualize_q_system_prompt):
+def _contextualize_q_chain(llm, contextualize_q_system_prompt, rewrite_llm, rewrite_policy):
     contextualize_q_prompt = ChatPromptTemplate.from_messages(
         [
             ("system", contextualize_q_system_prompt),
@@ -23,10 +53,11 @@ def chain(retriever, llm, contextualize_q_system_prompt):
         ]
     )
 
-    history_aware_retriever = create_history_aware_retriever(
-        llm, retriever, contextualize_q_prompt
-    )
+    # Pergunta autônoma: a própria pergunta, ou reescrita (pelo rewrite_llm, se configurado) quando depende do histórico
+    return traced(rewrite_policy.runnable(contextualize_q_prompt | (rewrite_llm or llm) | StrOutputParser()), "contextualize_question")
+
 
+def _question_answer_chain(llm):
     qa_system_prompt = """You are an AI agent called Martechito, working for a consultancy specialized in data, specifically GA4. 
         Your job is to answer questions for clients of this consultancy who license the product with them. 
         You need to be clear, didactic, detailed, and respectful in your responses. If you don’t know an answer, respectfully say that you don’t know. 
@@ -47,6 +78,62 @@ def chain(retriever, llm, contextualize_q_system_prompt):
         ]
     )
 
-    question_answer_chain = create_stuff_documents_chain(llm, qa_prompt)
-    rag_chain = create_retrieval_chain(history_aware_retriever, question_answer_chain)
-    return rag_chain
\ No newline at end of file
+    return traced(create_stuff_documents_chain(llm, qa_prompt), "answer")
+
+
+def _with_answer_cache(retriever, context_chain, question_answer_chain, answer_cache):
+    # context_chain recebe a entrada com standalone_question e adiciona o context
+    answer_chain = context_chain.assign(answer=question_answer_chain)
+    if answer_cache is None:
+        return answer_chain
+    # Respostas de configurações de busca diferentes não são compartilhadas
+    namespace = repr((getattr(retriever, "search_type", None), getattr(retriever, "search_kwargs", None)))
+
+    def cached_answer(inputs):
+        cached, vector = answer_cache.lookup(inputs["standalone_question"], namespace)
+        if cached is not None:
+            return {**inputs, "context": cached.documents, "answer": cached.answer}
+        return answer_chain | answer_cache.recorder(inputs["standalone_question"], vector, namespace)
+
+    # Versão assíncrona (ainvoke/astream), usada pela API
+    async def acached_answer(inputs):
+        cached, vector = await answer_cache.alookup(inputs["standalone_question"], namespace)
+        if cached is not None:
+            return {**inputs, "context": cached.documents, "answer": cached.answer}
+        return answer_chain | answer_cache.recorder(inputs["standalone_question"], vector, namespace)
+
+    return RunnableLambda(cached_answer, afunc=acached_answer)
+
+
+def _packed(documents, context_packer):
+    # documents: runnable que devolve os documentos recuperados, na ordem do retriever
+    return documents if context_packer is None else documents | traced(context_packer.runnable(), "context_packing")
+
+
+def _traced_turn(rag_chain, tracer):
+    # O turno inteiro só recebe o nome: metadata no turno sobrescreveria a etapa das chamadas de LLM internas
+    return rag_chain if tracer is None else rag_chain.with_config(run_name="rag_turn", callbacks=[tracer])
+
+
+# Função para criar a cadeia de recuperação
+def chain(retriever, llm, contextualize_q_system_prompt, answer_cache=None, rewrite_llm=rewrite_llm, rewrite_policy=rewrite_policy,
+          context_packer=context_packer, tracer=chain_tracer):
+    contextualize_q_chain = _contextualize_q_chain(llm, contextualize_q_system_prompt, rewrite_llm, rewrite_policy)
+    retrieval_chain = RunnablePassthrough.assign(context=_packed(itemgetter("standalone_question") | retriever, context_packer))
+    answer_chain = _with_answer_cache(retriever, retrieval_chain, _question_answer_chain(llm), answer_cache)
+    rag_chain = RunnablePassthrough.assign(standalone_question=contextualize_q_chain) | answer_chain
+    return _traced_turn(rag_chain, tracer)
+
+
+# Alternativa: a busca na pergunta original começa junto com a reescrita
+def speculative_chain(retriever, llm, contextualize_q_system_prompt, answer_cache=None, rewrite_llm=rewrite_llm, rewrite_policy=rewrite_policy,
+                      threshold=SPECULATIVE_THRESHOLD, metrics=speculation_metrics, embeddings=query_embeddings, context_packer=context_packer,
+                      tracer=chain_tracer, executor=speculative_executor):
+    contextualize_q_chain = _contextualize_q_chain(llm, contextualize_q_system_prompt, rewrite_llm, rewrite_policy)
+    speculative_retrieval = SpeculativeRetrieval(retriever, contextualize_q_chain, rewrite_policy, embeddings, threshold=threshold, metrics=metrics,
+                                                 executor=executor)
+    # Quando a pergunta vem do cache, a busca especulativa já foi feita; só a geração é poupada
+    context_chain = RunnablePassthrough.assign(context=_packed(itemgetter("context"), context_packer))
+    answer_chain = _with_answer_cache(retriever, context_chain, _question_answer_chain(llm), answer_cache)
+    rag_chain = speculative_retrieval.runnable() | answer_chain
+    return _traced_turn(rag_chain, tracer)
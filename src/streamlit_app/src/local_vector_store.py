@@ -0,0 +1,299 @@
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+from metadata_filter import filter_key, matches
+import hashlib
+import json
+import logging
+import os
+import numpy as np
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+MANIFEST_FILE = "manifest.json"
+VECTORS_FILE = "vectors.npy"
+PAYLOADS_FILE = "payloads.json"
+HNSW_FILE = "index.hnsw"
+MAX_CACHED_FILTERS = 64
+# The rows scored per matrix product; float16 rows are widened to float32 one block at a time
+SEARCH_BLOCK_ROWS = 65536
+
+
+def export_collection(client, collection_name, directory, dtype="float32", hnsw=False, batch_size=1000):
+    """
+    Snapshots a Qdrant collection into a directory that LocalVectorStore can search.
+
+    The normalized vectors are written as a .npy matrix (memory-mapped when loaded), the payloads
+    as a compact JSON list in the same order, and, when hnsw is set and hnswlib is installed, an
+    HNSW index of the vectors.
+
+    Args:
+        client (QdrantClient): The Qdrant client.
+        collection_name (str): The name of the collection.
+        directory (str): The output directory.
+        dtype (str): "float32" or "float16".
+        hnsw (bool): Whether to build an HNSW index.
+        batch_size (int): The number of points read per scroll request.
+
+    Returns:
+        dict: The manifest of the export.
+    """
+    vectors, payloads, offset = [], [], None
+    while True:
+        points, offset = client.scroll(
+            collection_name=collection_name,
+            limit=batch_size,
+            offset=offset,
+            with_payload=True,
+            with_vectors=True,
+        )
+        for point in points:
+            vectors.append(point.vector)
+            payloads.append({"id": str(point.id), "page_content": point.payload.get("page_content", ""), "metadata": point.payload.get("metadata") or {}})
+        if offset is None:
+            break
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if len(matrix):
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, VECTORS_FILE), matrix.astype(dtype))
+    with open(os.path.join(directory, PAYLOADS_FILE), "w", encoding="utf-8") as f:
+        json.dump(payloads, f, ensure_ascii=False, separators=(",", ":"))
+    if hnsw:
+        if hnswlib is None:
+            logging.warning("hnswlib is not installed, the HNSW index was not built")
+        elif len(matrix):
+            index = hnswlib.Index(space="cosine", dim=matrix.shape[1])
+            index.init_index(max_elements=len(matrix), ef_construction=200, M=16)
+            index.add_items(matrix, np.arange(len(matrix)))
+            index.save_index(os.path.join(directory, HNSW_FILE))
+    manifest = {
+        "collection_name": collection_name,
+        "points": len(payloads),
+        "dimension": int(matrix.shape[1]) if len(matrix) else 0,
+        "dtype": dtype,
+        "fingerprint": hashlib.sha256("".join(sorted(payload["id"] for payload in payloads)).encode("utf-8")).hexdigest(),
+    }
+    with open(os.path.join(directory, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+    logging.info(f"Collection exported: {manifest}")
+    return manifest
+
+
+class ExportFingerprint:
+    """
+    The fingerprint of an exported collection, with the same interface as CollectionFingerprint.
+
+    Args:
+        manifest (dict): The manifest of the export.
+    """
+
+    def __init__(self, manifest):
+        self.manifest = manifest
+
+    def current(self):
+        """
+        Returns the fingerprint of the exported collection.
+
+        Returns:
+            str: The fingerprint.
+        """
+        return self.manifest["fingerprint"]
+
+
+class LocalVectorStore(VectorStore):
+    """
+    A read-only, in-process vector store over a collection exported by export_collection().
+
+    The vectors are memory-mapped and searched with matrix-vector products over blocks of
+    SEARCH_BLOCK_ROWS rows and a partial sort, or with the HNSW index when one was exported and
+    hnswlib is installed. float16 exports stay float16 on disk and in memory: each block is
+    widened to float32 for its product only. The scores are cosine similarities, like the Qdrant vector store with cosine
+    distance, so the similarity_score_threshold and mmr retrievers behave the same way.
+
+    The searches accept a canonical metadata filter (metadata_filter.normalize_filter) as filter:
+    the matching rows are computed once per filter and searched exactly, since the HNSW graph
+    cannot be restricted to a slice.
+
+    Args:
+        directory (str): The directory of the export.
+        embeddings (Embeddings): The embeddings client used to embed the queries.
+        use_hnsw (bool): Whether to use the HNSW index when available.
+
+    Attributes:
+        manifest (dict): The manifest of the export.
+        fingerprint (ExportFingerprint): The fingerprint of the exported collection.
+    """
+
+    def __init__(self, directory, embeddings, use_hnsw=True):
+        self.directory = directory
+        self._embeddings = embeddings
+        with open(os.path.join(directory, MANIFEST_FILE)) as f:
+            self.manifest = json.load(f)
+        self.fingerprint = ExportFingerprint(self.manifest)
+        self._matrix = np.load(os.path.join(directory, VECTORS_FILE), mmap_mode="r")
+        with open(os.path.join(directory, PAYLOADS_FILE), encoding="utf-8") as f:
+            self._payloads = json.load(f)
+        self._filtered_rows = {}
+        self._hnsw = None
+        hnsw_path = os.path.join(directory, HNSW_FILE)
+        if use_hnsw and hnswlib is not None and os.path.exists(hnsw_path) and len(self._payloads):
+            self._hnsw = hnswlib.Index(space="cosine", dim=self._matrix.shape[1])
+            self._hnsw.load_index(hnsw_path, max_elements=len(self._payloads))
+        logging.info(f"Local vector store loaded: {self.manifest['points']} points, {'HNSW' if self._hnsw else 'exact'} search")
+
+    @property
+    def embeddings(self):
+        return self._embeddings
+
+    def _document(self, row, score=None):
+        payload = self._payloads[row]
+        metadata = dict(payload["metadata"])
+        metadata["_id"] = payload["id"]
+        metadata["_collection_name"] = self.manifest["collection_name"]
+        if score is not None:
+            # Like the documents of ScoredQdrant, recorded by the chain tracer
+            metadata["_score"] = float(score)
+        return Document(page_content=payload["page_content"], metadata=metadata)
+
+    def documents(self):
+        """
+        Returns every document of the export, in the same layout as the search results.
+
+        Returns:
+            list: The documents.
+        """
+        return [self._document(row) for row in range(len(self._payloads))]
+
+    def _query_vector(self, embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def _scores(self, vector, rows=None):
+        # NumPy has no fast float16 matrix product, so the rows are widened block by block
+        count = len(self._payloads) if rows is None else len(rows)
+        scores = np.empty(count, dtype=np.float32)
+        for start in range(0, count, SEARCH_BLOCK_ROWS):
+            end = min(start + SEARCH_BLOCK_ROWS, count)
+            block = self._matrix[start:end] if rows is None else self._matrix[rows[start:end]]
+            scores[start:end] = np.asarray(block, dtype=np.float32) @ vector
+        return scores
+
+    def _rows(self, metadata_filter):
+        key = filter_key(metadata_filter)
+        if key not in self._filtered_rows:
+            if len(self._filtered_rows) >= MAX_CACHED_FILTERS:
+                self._filtered_rows.clear()
+            self._filtered_rows[key] = np.array(
+                [row for row, payload in enumerate(self._payloads) if matches(payload["metadata"], metadata_filter)],
+                dtype=np.int64,
+            )
+        return self._filtered_rows[key]
+
+    def _top_k(self, vector, k, metadata_filter=None):
+        if metadata_filter:
+            allowed = self._rows(metadata_filter)
+            k = min(k, len(allowed))
+            if k <= 0:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+            scores = self._scores(vector, allowed)
+            best = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+            best = best[np.argsort(-scores[best])]
+            return allowed[best], scores[best]
+        k = min(k, len(self._payloads))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        if self._hnsw is not None:
+            self._hnsw.set_ef(max(k, 50))
+            rows, distances = self._hnsw.knn_query(vector, k=k)
+            return rows[0].astype(np.int64), 1.0 - distances[0]
+        scores = self._scores(vector)
+        rows = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+        rows = rows[np.argsort(-scores[rows])]
+        return rows, scores[rows]
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, score_threshold=None, filter=None, **kwargs):
+        """
+        Returns the documents most similar to an embedding.
+
+        Args:
+            embedding (list): The query embedding.
+            k (int): The number of documents.
+            score_threshold (float): The minimum cosine similarity, or None.
+            filter (dict): A canonical metadata filter, or None.
+
+        Returns:
+            list: The documents and their cosine similarities, best first.
+        """
+        rows, scores = self._top_k(self._query_vector(embedding), k, filter)
+        return [
+            (self._document(row, score), float(score))
+            for row, score in zip(rows, scores)
+            if score_threshold is None or score >= score_threshold
+        ]
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_with_score_by_vector(self._embeddings.embed_query(query), k=k, **kwargs)
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k, **kwargs)]
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k=k, **kwargs)]
+
+    def _similarity_search_with_relevance_scores(self, query, k=4, **kwargs):
+        # The cosine similarities are already relevance scores, like in the Qdrant vector store
+        return self.similarity_search_with_score(query, k=k, **kwargs)
+
+    # The async searches only await the query embedding; the search itself takes about a millisecond
+    async def asimilarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_with_score_by_vector(await self._embeddings.aembed_query(query), k=k, **kwargs)
+
+    async def asimilarity_search(self, query, k=4, **kwargs):
+        return [doc for doc, _ in await self.asimilarity_search_with_score(query, k=k, **kwargs)]
+
+    async def _asimilarity_search_with_relevance_scores(self, query, k=4, **kwargs):
+        return await self.asimilarity_search_with_score(query, k=k, **kwargs)
+
+    def max_marginal_relevance_search_by_vector(self, embedding, k=4, fetch_k=20, lambda_mult=0.5, filter=None, **kwargs):
+        """
+        Returns the documents selected by maximal marginal relevance among the fetch_k most similar ones.
+
+        Args:
+            embedding (list): The query embedding.
+            k (int): The number of documents.
+            fetch_k (int): The number of candidates.
+            lambda_mult (float): 1 for pure similarity, 0 for maximum diversity.
+            filter (dict): A canonical metadata filter, or None.
+
+        Returns:
+            list: The selected documents.
+        """
+        vector = self._query_vector(embedding)
+        rows, scores = self._top_k(vector, fetch_k, filter)
+        if not len(rows):
+            return []
+        candidates = np.asarray(self._matrix[rows], dtype=np.float32)
+        similarities = candidates @ candidates.T
+        selected = [0]
+        while len(selected) < min(k, len(rows)):
+            redundancy = similarities[:, selected].max(axis=1)
+            mmr = lambda_mult * scores - (1 - lambda_mult) * redundancy
+            mmr[selected] = -np.inf
+            selected.append(int(np.argmax(mmr)))
+        return [self._document(rows[index], scores[index]) for index in selected]
+
+    def max_marginal_relevance_search(self, query, k=4, fetch_k=20, lambda_mult=0.5, **kwargs):
+        return self.max_marginal_relevance_search_by_vector(self._embeddings.embed_query(query), k=k, fetch_k=fetch_k, lambda_mult=lambda_mult, **kwargs)
+
+    async def amax_marginal_relevance_search(self, query, k=4, fetch_k=20, lambda_mult=0.5, **kwargs):
+        return self.max_marginal_relevance_search_by_vector(await self._embeddings.aembed_query(query), k=k, fetch_k=fetch_k, lambda_mult=lambda_mult, **kwargs)
+
+    def add_texts(self, texts, metadatas=None, **kwargs):
+        raise NotImplementedError("The local vector store is read-only, export the collection again instead")
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, **kwargs):
+        raise NotImplementedError("The local vector store is built with export_collection()")
@@ -0,0 +1,118 @@
+from qdrant_client.http.models import DatetimeRange, FieldCondition, Filter, MatchAny
+import datetime
+
+# Metadata written by the ingestion for every chunk, indexed in the collection
+FILTER_FIELDS = ("tool", "subject", "type", "category")
+DATE_FIELD = "date"
+
+
+def normalize_filter(metadata_filter):
+    """
+    Validates a metadata filter and puts it in its canonical form.
+
+    A filter maps each of FILTER_FIELDS to the accepted values (a string or a list), and may have
+    a date_from and a date_to (ISO dates, inclusive) on the ingestion date. The canonical form has
+    sorted tuples of values and no empty entries, so equal filters compare and hash the same way.
+
+    Args:
+        metadata_filter (dict): The filter, or None.
+
+    Returns:
+        dict: The canonical filter, or None if it filters nothing.
+
+    Raises:
+        ValueError: If the filter has an unknown key or an invalid date.
+    """
+    if not metadata_filter:
+        return None
+    normalized = {}
+    for key, value in metadata_filter.items():
+        if key in FILTER_FIELDS:
+            values = [value] if isinstance(value, str) else list(value or [])
+            if values:
+                normalized[key] = tuple(sorted(set(str(item) for item in values)))
+        elif key in ("date_from", "date_to"):
+            if value:
+                normalized[key] = datetime.date.fromisoformat(str(value)[:10]).isoformat()
+        else:
+            raise ValueError(f"Unknown metadata filter key: {key}")
+    return normalized or None
+
+
+def filter_key(metadata_filter):
+    """
+    Returns a hashable key of a canonical filter, for the caches of filtered rows.
+
+    Args:
+        metadata_filter (dict): The canonical filter, or None.
+
+    Returns:
+        tuple: The key.
+    """
+    return tuple(sorted((metadata_filter or {}).items()))
+
+
+def matches(metadata, metadata_filter):
+    """
+    Returns whether the metadata of a chunk passes a canonical filter.
+
+    Args:
+        metadata (dict): The metadata of the chunk.
+        metadata_filter (dict): The canonical filter, or None.
+
+    Returns:
+        bool: Whether the chunk passes.
+    """
+    if not metadata_filter:
+        return True
+    for key in FILTER_FIELDS:
+        if key in metadata_filter and metadata.get(key) not in metadata_filter[key]:
+            return False
+    date = str(metadata.get(DATE_FIELD) or "")[:10]
+    if "date_from" in metadata_filter and not (date and date >= metadata_filter["date_from"]):
+        return False
+    if "date_to" in metadata_filter and not (date and date <= metadata_filter["date_to"]):
+        return False
+    return True
+
+
+def qdrant_filter(metadata_filter, metadata_payload_key="metadata"):
+    """
+    Converts a canonical filter into a Qdrant filter on the payload indexes.
+
+    Args:
+        metadata_filter (dict): The canonical filter.
+        metadata_payload_key (str): The payload key of the chunk metadata.
+
+    Returns:
+        Filter: The Qdrant filter.
+    """
+    conditions = [
+        FieldCondition(key=f"{metadata_payload_key}.{key}", match=MatchAny(any=list(metadata_filter[key])))
+        for key in FILTER_FIELDS
+        if key in metadata_filter
+    ]
+    if "date_from" in metadata_filter or "date_to" in metadata_filter:
+        conditions.append(FieldCondition(
+            key=f"{metadata_payload_key}.{DATE_FIELD}",
+            range=DatetimeRange(gte=metadata_filter.get("date_from"), lte=metadata_filter.get("date_to")),
+        ))
+    return Filter(must=conditions)
+
+
+def filter_options(documents):
+    """
+    Returns the values of the filter fields found in a set of chunks, for the filter widgets.
+
+    Args:
+        documents (list): The chunk documents.
+
+    Returns:
+        dict: The sorted values of each of FILTER_FIELDS.
+    """
+    options = {key: set() for key in FILTER_FIELDS}
+    for doc in documents:
+        for key in FILTER_FIELDS:
+            if doc.metadata.get(key):
+                options[key].add(str(doc.metadata[key]))
+    return {key: sorted(values) for key, values in options.items()}
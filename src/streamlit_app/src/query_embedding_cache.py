@@ -0,0 +1,187 @@
+from langchain_core.embeddings import Embeddings
+from collections import OrderedDict
+from array import array
+import asyncio
+import hashlib
+import logging
+import re
+import threading
+import time
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(text):
+    """
+    Normalizes a query before it is used as a cache key.
+
+    Args:
+        text (str): The query.
+
+    Returns:
+        str: The query with collapsed whitespace and no leading or trailing blanks.
+    """
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """
+    An embeddings client that keeps the most recent query embeddings in memory.
+
+    The query vectors are kept in a bounded LRU keyed by the model and the normalized query. When
+    a Redis URL is given (and the redis package is installed), the vectors are also written to
+    Redis, so the instances of a service share them; the in-memory LRU is checked first. Document
+    embeddings are passed through. aembed_query takes the same path with the async client of the
+    wrapped embeddings.
+
+    Args:
+        embeddings (Embeddings): The embeddings client used for the cache misses.
+        model (str): The embedding model name, part of the cache key.
+        max_size (int): The maximum number of vectors kept in memory.
+        redis_url (str): The URL of the shared Redis store, or None.
+        redis_ttl_seconds (int): The lifetime of the vectors in Redis.
+        tracer (ChainTracer): The tracer that records the duration of each query embedding, or None.
+
+    Attributes:
+        hits (int): The number of queries served from memory.
+        shared_hits (int): The number of queries served from Redis.
+        misses (int): The number of queries sent to the embeddings client.
+        miss_seconds (float): The time spent embedding the missed queries.
+        hit_seconds (float): The time spent serving the hits.
+    """
+
+    def __init__(self, embeddings, model, max_size=1024, redis_url=None, redis_ttl_seconds=604800, tracer=None):
+        self.embeddings = embeddings
+        self.tracer = tracer
+        self.model = model
+        self.max_size = max_size
+        self.redis_ttl_seconds = redis_ttl_seconds
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.miss_seconds = 0.0
+        self.hit_seconds = 0.0
+        self._vectors = OrderedDict()
+        self._lock = threading.Lock()
+        self._redis = None
+        if redis_url:
+            if redis is None:
+                logging.warning("QUERY_EMBEDDING_REDIS_URL is set but the redis package is not installed")
+            else:
+                self._redis = redis.Redis.from_url(redis_url, socket_timeout=0.2, socket_connect_timeout=0.2)
+
+    def _key(self, text):
+        return f"query-embedding:{self.model}:{hashlib.sha256(normalize_query(text).encode('utf-8')).hexdigest()}"
+
+    def _shared_get(self, key):
+        if self._redis is None:
+            return None
+        try:
+            blob = self._redis.get(key)
+        except Exception as e:
+            logging.warning(f"Query embedding store unavailable: {e}")
+            return None
+        return list(array("f", blob)) if blob else None
+
+    def _shared_put(self, key, vector):
+        if self._redis is None:
+            return
+        try:
+            self._redis.set(key, array("f", vector).tobytes(), ex=self.redis_ttl_seconds)
+        except Exception as e:
+            logging.warning(f"Query embedding store unavailable: {e}")
+
+    def _remember(self, key, vector):
+        with self._lock:
+            self._vectors[key] = vector
+            self._vectors.move_to_end(key)
+            while len(self._vectors) > self.max_size:
+                self._vectors.popitem(last=False)
+
+    def _memory_get(self, key, start):
+        with self._lock:
+            vector = self._vectors.get(key)
+            if vector is not None:
+                self._vectors.move_to_end(key)
+                self.hits += 1
+                self.hit_seconds += time.perf_counter() - start
+        if vector is not None and self.tracer is not None:
+            self.tracer.observe_embedding(time.perf_counter() - start, cached=True)
+        return vector
+
+    def _shared_hit(self, key, vector, start):
+        self._remember(key, vector)
+        with self._lock:
+            self.shared_hits += 1
+            self.hit_seconds += time.perf_counter() - start
+        if self.tracer is not None:
+            self.tracer.observe_embedding(time.perf_counter() - start, cached=True)
+        return vector
+
+    def _miss(self, key, vector, start):
+        self._remember(key, vector)
+        with self._lock:
+            self.misses += 1
+            self.miss_seconds += time.perf_counter() - start
+        if self.tracer is not None:
+            self.tracer.observe_embedding(time.perf_counter() - start, cached=False)
+        return vector
+
+    def embed_query(self, text):
+        start = time.perf_counter()
+        key = self._key(text)
+        vector = self._memory_get(key, start)
+        if vector is not None:
+            return vector
+        vector = self._shared_get(key)
+        if vector is not None:
+            return self._shared_hit(key, vector, start)
+        vector = self._miss(key, self.embeddings.embed_query(text), start)
+        self._shared_put(key, vector)
+        return vector
+
+    async def aembed_query(self, text):
+        start = time.perf_counter()
+        key = self._key(text)
+        vector = self._memory_get(key, start)
+        if vector is not None:
+            return vector
+        if self._redis is not None:
+            # The redis client is blocking, it runs in a worker thread
+            vector = await asyncio.to_thread(self._shared_get, key)
+            if vector is not None:
+                return self._shared_hit(key, vector, start)
+        vector = self._miss(key, await self.embeddings.aembed_query(text), start)
+        if self._redis is not None:
+            await asyncio.to_thread(self._shared_put, key, vector)
+        return vector
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    async def aembed_documents(self, texts):
+        return await self.embeddings.aembed_documents(texts)
+
+    def stats(self):
+        """
+        Returns the hit rate and latency of the cache.
+
+        Returns:
+            dict: The number of vectors, hits and misses, the hit rate, and the mean latency of hits and misses in milliseconds.
+        """
+        hits = self.hits + self.shared_hits
+        lookups = hits + self.misses
+        return {
+            "vectors": len(self._vectors),
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            "hit_ms": round(1000 * self.hit_seconds / hits, 3) if hits else 0.0,
+            "miss_ms": round(1000 * self.miss_seconds / self.misses, 1) if self.misses else 0.0,
+        }
@@ -0,0 +1,92 @@
+from langchain_core.documents import Document
+from langchain_core.messages import convert_to_messages
+import json
+
+_ROLES = {"human": "user", "ai": "assistant"}
+
+
+def serialize_history(chat_history):
+    """
+    Converts a chat history into the {role, content} messages accepted by the RAG API.
+
+    Args:
+        chat_history (list): The messages, in any format accepted by the chain (dicts, messages, strings).
+
+    Returns:
+        list: The messages as {role, content} dicts.
+    """
+    return [{"role": _ROLES.get(message.type, message.type), "content": message.content} for message in convert_to_messages(chat_history)]
+
+
+def _documents(sources):
+    return [Document(page_content="", metadata=source) for source in sources]
+
+
+class RagApiClient:
+    """
+    Calls the RAG API (api_server.py) with the invoke/stream interface of the local chain.
+
+    The outputs have the same keys as the chain's (standalone_question, context and answer), and
+    the context documents carry the title and source metadata of the sources, so the app renders
+    them the same way.
+
+    Args:
+        http_client (httpx.Client): The pooled HTTP client.
+        url (str): The base URL of the API.
+        search_type (str): The search type of the retriever.
+        search_kwargs (dict): The search kwargs of the retriever.
+    """
+
+    def __init__(self, http_client, url, search_type, search_kwargs):
+        self.http_client = http_client
+        self.url = url.rstrip("/")
+        self.search_type = search_type
+        self.search_kwargs = search_kwargs
+
+    def _payload(self, inputs):
+        return {
+            "question": inputs["input"],
+            "chat_history": serialize_history(inputs.get("chat_history") or []),
+            "search_type": self.search_type,
+            "search_kwargs": self.search_kwargs,
+        }
+
+    def invoke(self, inputs):
+        """
+        Answers a question.
+
+        Args:
+            inputs (dict): The input and chat_history of the chain.
+
+        Returns:
+            dict: The inputs with the standalone_question, context and answer added.
+        """
+        response = self.http_client.post(f"{self.url}/ask", json=self._payload(inputs))
+        response.raise_for_status()
+        body = response.json()
+        return {**inputs, "standalone_question": body["standalone_question"], "context": _documents(body["sources"]), "answer": body["answer"]}
+
+    def stream(self, inputs):
+        """
+        Answers a question as a stream of chunks.
+
+        Args:
+            inputs (dict): The input and chat_history of the chain.
+
+        Yields:
+            dict: The standalone_question, then the context, then each token of the answer.
+
+        Raises:
+            RuntimeError: If the API reports an error after the stream started.
+        """
+        with self.http_client.stream("POST", f"{self.url}/ask/stream", json=self._payload(inputs)) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                event = json.loads(line)
+                if "error" in event:
+                    raise RuntimeError(f"RAG API error: {event['error']}")
+                if "context" in event:
+                    event = {"context": _documents(event["context"])}
+                yield event
@@ -0,0 +1,167 @@
+from langchain_core.runnables import RunnableLambda
+import logging
+import re
+import threading
+import time
+
+# Words that refer back to an earlier turn, in English and Portuguese
+REFERRING_WORDS = {
+    "it", "its", "this", "that", "these", "those", "they", "them", "their", "theirs", "he", "she", "him", "her",
+    "one", "ones", "there", "above", "previous", "same", "former", "latter", "else", "also",
+    "isso", "isto", "aquilo", "esse", "essa", "esses", "essas", "este", "esta", "estes", "estas", "aquele", "aquela",
+    "ele", "ela", "eles", "elas", "dele", "dela", "deles", "delas", "nele", "nela", "disso", "disto", "nisso", "nisto",
+    "lo", "la", "los", "las", "mesmo", "mesma", "anterior", "acima", "também", "tambem",
+}
+# Openings of elliptical follow-ups ("and for web streams?", "e no app?")
+ELLIPTICAL_OPENINGS = (
+    "and ", "but ", "so ", "what about", "how about", "why not", "same ", "or ",
+    "e ", "mas ", "então ", "entao ", "e quanto", "e se", "e sobre", "e no", "e na", "ou ",
+)
+STOPWORDS = {
+    "a", "an", "the", "of", "to", "in", "on", "for", "and", "or", "is", "are", "was", "be", "how", "what", "why",
+    "when", "where", "which", "who", "do", "does", "can", "i", "my", "we", "our", "you", "your", "with", "ga4",
+    "o", "os", "as", "de", "do", "da", "dos", "das", "em", "no", "na", "para", "por", "com", "que", "como", "qual",
+    "quais", "é", "e", "um", "uma", "eu", "meu", "minha", "se", "ao", "google", "analytics",
+}
+MIN_WORDS = 4
+# Input key of a (rewrite, reason) decision already taken for the turn, so runnable() does not decide again
+REWRITE_DECISION_KEY = "rewrite_decision"
+
+_WORDS = re.compile(r"\w+")
+
+
+def _text(message):
+    if isinstance(message, dict):
+        return str(message.get("content", ""))
+    return str(getattr(message, "content", message))
+
+
+class RewritePolicy:
+    """
+    Decides per turn whether the question has to be rewritten into a standalone question.
+
+    A question is treated as self-contained, and sent to retrieval as is, when there is no chat
+    history, or when it has no words referring back to earlier turns (pronouns, "the same",
+    "isso"...), does not open like an elliptical follow-up ("and for apps?", "e no iOS?"), is not
+    too short, and shares few of its content words with the history. Every other question is
+    rewritten by the rewrite chain. The path taken by each turn is logged along with the time it
+    took or, for skipped rewrites, the time saved (the average duration of the rewrites so far).
+
+    Args:
+        max_overlap (float): The maximum share of the question's content words found in the history for a self-contained question.
+        mode (str): "auto" to apply the policy, "always" to always rewrite when there is history, "never" to never rewrite.
+
+    Attributes:
+        rewrites (int): The number of rewritten questions.
+        skips (int): The number of questions sent as is despite a chat history.
+        rewrite_seconds (float): The total time spent rewriting.
+        saved_seconds (float): The estimated time saved by the skipped rewrites.
+
+    Methods:
+        decide(question, chat_history): Returns whether the question must be rewritten and why.
+        runnable(rewrite_chain): Returns a runnable that produces the standalone question.
+        stats(): Returns the counters of the policy.
+    """
+
+    def __init__(self, max_overlap=0.5, mode="auto"):
+        if mode not in ("auto", "always", "never"):
+            raise ValueError(f"Unknown rewrite mode: {mode}")
+        self.max_overlap = max_overlap
+        self.mode = mode
+        self.rewrites = 0
+        self.skips = 0
+        self.rewrite_seconds = 0.0
+        self.saved_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def decide(self, question, chat_history):
+        """
+        Returns whether a question must be rewritten.
+
+        Args:
+            question (str): The user question.
+            chat_history (list): The previous turns.
+
+        Returns:
+            tuple: True if the question must be rewritten, and the reason.
+        """
+        if not chat_history:
+            return False, "no history"
+        if self.mode != "auto":
+            return self.mode == "always", f"mode={self.mode}"
+        lowered = question.lower().strip()
+        words = _WORDS.findall(lowered)
+        referring = REFERRING_WORDS.intersection(words)
+        if referring:
+            return True, f"refers back ({', '.join(sorted(referring))})"
+        if lowered.startswith(ELLIPTICAL_OPENINGS):
+            return True, "elliptical opening"
+        if len(words) < MIN_WORDS:
+            return True, "too short"
+        content = {word for word in words if word not in STOPWORDS and len(word) > 2}
+        history = set(_WORDS.findall(" ".join(_text(message) for message in chat_history).lower()))
+        overlap = len(content & history) / len(content) if content else 1.0
+        if overlap > self.max_overlap:
+            return True, f"overlap {overlap:.2f}"
+        return False, f"self-contained (overlap {overlap:.2f})"
+
+    def runnable(self, rewrite_chain):
+        """
+        Returns a runnable that maps the chain input to the standalone question.
+
+        Args:
+            rewrite_chain (Runnable): The chain that rewrites the question, receiving the input and chat_history.
+
+        Returns:
+            RunnableLambda: A runnable that returns the question as is or rewritten. A decision already
+            taken for the turn can be passed in the REWRITE_DECISION_KEY input.
+        """
+
+        def skip(inputs, reason):
+            with self._lock:
+                if inputs.get("chat_history"):
+                    self.skips += 1
+                    saved = self.rewrite_seconds / self.rewrites if self.rewrites else 0.0
+                    self.saved_seconds += saved
+                    logging.info(f"Rewrite skipped: {reason}, ~{saved:.2f}s saved")
+            return inputs["input"]
+
+        def record(reason, question, seconds):
+            with self._lock:
+                self.rewrites += 1
+                self.rewrite_seconds += seconds
+            logging.info(f"Rewrite run: {reason}, took {seconds:.2f}s: {question}")
+            return question
+
+        def standalone_question(inputs, config):
+            rewrite, reason = inputs.get(REWRITE_DECISION_KEY) or self.decide(inputs["input"], inputs.get("chat_history"))
+            if not rewrite:
+                return skip(inputs, reason)
+            start = time.perf_counter()
+            question = rewrite_chain.invoke(inputs, config)
+            return record(reason, question, time.perf_counter() - start)
+
+        # Used by ainvoke/astream, so the rewrite call does not hold a thread
+        async def astandalone_question(inputs, config):
+            rewrite, reason = inputs.get(REWRITE_DECISION_KEY) or self.decide(inputs["input"], inputs.get("chat_history"))
+            if not rewrite:
+                return skip(inputs, reason)
+            start = time.perf_counter()
+            question = await rewrite_chain.ainvoke(inputs, config)
+            return record(reason, question, time.perf_counter() - start)
+
+        return RunnableLambda(standalone_question, afunc=astandalone_question)
+
+    def stats(self):
+        """
+        Returns the counters of the policy.
+
+        Returns:
+            dict: The number of rewrites and skips, the mean rewrite time and the estimated saved time.
+        """
+        return {
+            "rewrites": self.rewrites,
+            "skips": self.skips,
+            "mean_rewrite_seconds": round(self.rewrite_seconds / self.rewrites, 3) if self.rewrites else 0.0,
+            "saved_seconds": round(self.saved_seconds, 3),
+        }
@@ -0,0 +1,186 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from langchain_core.runnables import RunnableLambda
+from rewrite_policy import REWRITE_DECISION_KEY
+import logging
+import threading
+import time
+import numpy as np
+
+
+class SpeculationMetrics:
+    """
+    Counters and latency samples of the speculative retrieval, shared by the chains of a process.
+
+    Args:
+        window (int): The number of recent turns used for the latency percentiles.
+
+    Attributes:
+        speculated (int): The number of turns with a speculative search.
+        reused (int): The number of speculative searches whose documents were used.
+
+    Methods:
+        record(reused, actual, sequential): Records a speculative turn.
+        stats(): Returns the reuse rate and the latency percentiles.
+    """
+
+    def __init__(self, window=1000):
+        self.speculated = 0
+        self.reused = 0
+        # Time until the context is ready, with speculation and as if the steps had run one after the other
+        self._actual = deque(maxlen=window)
+        self._sequential = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, reused, actual, sequential):
+        """
+        Records a speculative turn.
+
+        Args:
+            reused (bool): Whether the prefetched documents were used.
+            actual (float): The time until the context was ready.
+            sequential (float): The time the rewrite and the search would have taken one after the other.
+        """
+        with self._lock:
+            self.speculated += 1
+            self.reused += reused
+            self._actual.append(actual)
+            self._sequential.append(sequential)
+
+    def stats(self):
+        """
+        Returns the reuse rate and the latency percentiles.
+
+        Returns:
+            dict: The number of speculative turns, the reuse rate and the p50/p95 time until the context is ready, with speculation and sequentially.
+        """
+        with self._lock:
+            actual, sequential = list(self._actual), list(self._sequential)
+        stats = {
+            "speculated": self.speculated,
+            "reused": self.reused,
+            "reuse_rate": round(self.reused / self.speculated, 3) if self.speculated else 0.0,
+        }
+        if actual:
+            for name, samples in (("speculative", actual), ("sequential", sequential)):
+                stats[f"{name}_p50"] = round(float(np.percentile(samples, 50)), 3)
+                stats[f"{name}_p95"] = round(float(np.percentile(samples, 95)), 3)
+        return stats
+
+
+class SpeculativeRetrieval:
+    """
+    Retrieves on the raw question while the question is being rewritten.
+
+    When a turn needs a rewrite, the search on the raw user input starts in a worker thread at
+    the same moment as the rewrite call; the prefetch embeds the raw input first, so its vector
+    is at hand. Once the rewritten question is back, its embedding is compared with that vector.
+    If they are close enough, the prefetched documents are reused; otherwise the prefetch is
+    cancelled (if it has not started) and the search is repeated with the rewritten question.
+    The embeddings should be the query embedding cache of the retriever, so the rewritten
+    question is embedded once for the comparison, the search and the answer cache. Turns that
+    need no rewrite are retrieved directly. If the prefetch fails, the rewritten question is
+    searched instead, so the turn does not fail with it. The rewrite decision is taken once and
+    handed to the rewrite runnable of the policy.
+
+    Args:
+        retriever (BaseRetriever): The retriever.
+        rewrite (Runnable): The runnable that returns the standalone question from the input and chat_history.
+        rewrite_policy (RewritePolicy): The policy that decides whether a turn needs a rewrite.
+        embeddings (Embeddings): The embeddings client used to compare the questions.
+        threshold (float): The minimum cosine similarity to reuse the prefetched documents.
+        metrics (SpeculationMetrics): The metrics the speculative turns are recorded in.
+        executor (ThreadPoolExecutor): The threads running the prefetch searches, shared by the chains of a process.
+            Each turn that runs a rewrite holds one thread until its prefetch ends.
+
+    Methods:
+        retrieve(inputs, config): Adds the standalone_question and context to the chain input.
+        runnable(): Returns a runnable that adds the standalone_question and context to the chain input.
+    """
+
+    def __init__(self, retriever, rewrite, rewrite_policy, embeddings, threshold=0.9, metrics=None, executor=None):
+        self.retriever = retriever
+        self.rewrite = rewrite
+        self.rewrite_policy = rewrite_policy
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.metrics = metrics or SpeculationMetrics()
+        self.executor = executor or ThreadPoolExecutor(max_workers=4, thread_name_prefix="speculative-retrieval")
+
+    def _similarity(self, vector, question):
+        vectors = np.asarray([vector, self.embeddings.embed_query(question)], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1)
+        return float(vectors[0] @ vectors[1] / (norms[0] * norms[1])) if norms.all() else 0.0
+
+    def _timed_search(self, question, config):
+        start = time.perf_counter()
+        documents = self.retriever.invoke(question, config)
+        return documents, time.perf_counter() - start
+
+    def _prefetch(self, question, config, vector):
+        # The raw input is embedded first and its vector handed over before the search, which finds it in the cache
+        try:
+            vector.set_result(self.embeddings.embed_query(question))
+        except Exception as e:
+            vector.set_exception(e)
+            raise
+        return self._timed_search(question, config)
+
+    def retrieve(self, inputs, config=None):
+        """
+        Produces the standalone question and its documents.
+
+        Args:
+            inputs (dict): The input and chat_history of the chain.
+            config (RunnableConfig): The config of the run.
+
+        Returns:
+            dict: The inputs with the standalone_question and the context added.
+        """
+        decision = self.rewrite_policy.decide(inputs["input"], inputs.get("chat_history"))
+        rewrite_inputs = {**inputs, REWRITE_DECISION_KEY: decision}
+        if not decision[0]:
+            question = self.rewrite.invoke(rewrite_inputs, config)
+            return {**inputs, "standalone_question": question, "context": self.retriever.invoke(question, config)}
+        start = time.perf_counter()
+        vector = Future()
+        prefetch = self.executor.submit(self._prefetch, inputs["input"], config, vector)
+        question = self.rewrite.invoke(rewrite_inputs, config)
+        rewrite_seconds = time.perf_counter() - start
+        if inputs["input"].strip().lower() == question.strip().lower():
+            similarity = 1.0
+        elif prefetch.cancel():
+            # Every prefetch thread was busy: searching the rewritten question is faster than waiting
+            similarity = 0.0
+        else:
+            try:
+                similarity = self._similarity(vector.result(), question)
+            except Exception as e:
+                logging.warning(f"Speculative prefetch failed, searching the rewritten question: {e}")
+                similarity = 0.0
+        reused = False
+        if similarity >= self.threshold:
+            try:
+                documents, search_seconds = prefetch.result()
+                reused = True
+            except Exception as e:
+                logging.warning(f"Speculative search failed, searching the rewritten question: {e}")
+                similarity = 0.0
+        else:
+            prefetch.cancel()
+        if not reused:
+            documents, search_seconds = self._timed_search(question, config)
+        actual = time.perf_counter() - start
+        self.metrics.record(reused, actual, rewrite_seconds + search_seconds if reused else actual)
+        logging.info(f"Speculative retrieval {'reused' if reused else 'discarded'} (similarity {similarity:.3f}), context ready in {actual:.2f}s")
+        return {**inputs, "standalone_question": question, "context": documents}
+
+    def runnable(self):
+        """
+        Returns a runnable that adds the standalone_question and context to the chain input.
+
+        Returns:
+            RunnableLambda: The runnable.
+        """
+        return RunnableLambda(self.retrieve)
+
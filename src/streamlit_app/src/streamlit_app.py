@@ -2,12 +2,24 @@
 import streamlit as st
 import logging
 import json
+import time
 import streamlit.components.v1 as components
 from langchain_core.messages import HumanMessage
 from langchain.globals import set_verbose
-from llm_models import chain, llm, CONTEXTUALIZE_Q_SYSTEM_PROMPT
-from vector_store_client import vectorstore
-from envs import LINKEDIN_URL, GITHUB_URL, LINKEDIN_IMAGE, GITHUB_IMAGE
+from llm_models import chain, speculative_chain, llm, rewrite_policy, speculation_metrics, context_packer, chain_tracer, CONTEXTUALIZE_Q_SYSTEM_PROMPT
+from vector_store_client import vectorstore, query_embeddings, collection_fingerprint, lexical_index, dense_search_kwargs
+from chain_registry import ChainRegistry
+from answer_cache import SemanticAnswerCache
+from hybrid_retriever import HybridRetriever
+from rag_api_client import RagApiClient
+from metadata_filter import FILTER_FIELDS, filter_options, normalize_filter
+from envs import LINKEDIN_URL, GITHUB_URL, LINKEDIN_IMAGE, GITHUB_IMAGE, CHAIN_REGISTRY_SIZE, STREAM_ANSWERS, SPECULATIVE_RETRIEVAL
+from envs import ANSWER_CACHE_ENABLED, ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_TTL_SECONDS, ANSWER_CACHE_MAX_SIZE
+from envs import HYBRID_SEARCH, HYBRID_K, HYBRID_IDENTIFIER_SHARE, HYBRID_LEXICAL_FLOOR, RAG_API_URL, API_TIMEOUT_SECONDS
+import httpx
+
+DEFAULT_SEARCH_TYPE = "similarity_score_threshold"
+DEFAULT_SEARCH_KWARGS = {"score_threshold": 0.5}
 
 # Configurações iniciais
 def setup_logging():
@@ -32,15 +44,132 @@ def initialize_state():
     if "conversation" not in st.session_state:
         st.session_state.conversation = []
         
-def create_retriever():
-    return vectorstore.as_retriever(
-        search_type="similarity_score_threshold",
-        search_kwargs={"score_threshold": 0.5}
+def create_retriever(search_type=DEFAULT_SEARCH_TYPE, search_kwargs=DEFAULT_SEARCH_KWARGS):
+    retriever = vectorstore.as_retriever(
+        search_type=search_type,
+        search_kwargs=dense_search_kwargs(search_kwargs)
+    )
+    if not HYBRID_SEARCH:
+        return retriever
+    # Busca léxica (BM25) junto com a densa, para identificadores como session_start
+    return HybridRetriever(
+        dense=retriever,
+        lexical_index=lexical_index,
+        search_type=search_type,
+        search_kwargs=search_kwargs,
+        k=search_kwargs.get("k", HYBRID_K),
+        identifier_share=HYBRID_IDENTIFIER_SHARE,
+        lexical_floor=HYBRID_LEXICAL_FLOOR,
+        metadata_filter=search_kwargs.get("metadata_filter"),
     )
     
 
-def create_rag_chain(retriever,contextualize_q_system_prompt):
-    return chain(retriever=retriever, llm=llm, contextualize_q_system_prompt=contextualize_q_system_prompt)
+def create_rag_chain(retriever,contextualize_q_system_prompt,answer_cache=None):
+    if SPECULATIVE_RETRIEVAL:
+        return speculative_chain(retriever=retriever, llm=llm, contextualize_q_system_prompt=contextualize_q_system_prompt, answer_cache=answer_cache, embeddings=query_embeddings)
+    return chain(retriever=retriever, llm=llm, contextualize_q_system_prompt=contextualize_q_system_prompt, answer_cache=answer_cache)
+
+
+@st.cache_resource
+def get_answer_cache():
+    # Compartilhado por todas as sessões; invalidado quando a coleção é re-ingerida
+    if not ANSWER_CACHE_ENABLED:
+        return None
+    return SemanticAnswerCache(
+        query_embeddings,
+        threshold=ANSWER_CACHE_THRESHOLD,
+        ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+        max_size=ANSWER_CACHE_MAX_SIZE,
+        fingerprint=collection_fingerprint,
+    )
+
+
+def build_chain(search_type, search_kwargs):
+    return create_rag_chain(create_retriever(search_type, search_kwargs), CONTEXTUALIZE_Q_SYSTEM_PROMPT, get_answer_cache())
+
+
+def format_sources(documents):
+    sources = list(set([f"[{doc.metadata['title']}]({doc.metadata['source']})" for doc in documents]))
+    if not sources:
+        return ""
+    return " \n\n**Sources**:\n\n" + "\n\n".join(sources) + "\n"
+
+
+def stream_answer(rag_chain, inputs):
+    """
+    Streams the answer of the chain into the current chat message.
+
+    The sources are rendered as soon as the retrieval step returns its context, before the
+    generation starts, and the answer is rendered token by token below them.
+
+    Args:
+        rag_chain (Runnable): The RAG chain.
+        inputs (dict): The input and chat_history of the chain.
+
+    Returns:
+        str: The full answer followed by its sources.
+    """
+    answer_box = st.empty()
+    sources_box = st.empty()
+    answer, sources = "", ""
+    start = time.perf_counter()
+    first_token = None
+    for chunk in rag_chain.stream(inputs):
+        if "context" in chunk:
+            sources = format_sources(chunk["context"])
+            sources_box.markdown(sources)
+            logging.info(f"Sources shown after {time.perf_counter() - start:.2f}s")
+        if chunk.get("answer"):
+            if first_token is None:
+                first_token = time.perf_counter() - start
+                logging.info(f"Time to first token: {first_token:.2f}s")
+            answer += chunk["answer"]
+            answer_box.markdown(answer + "▌")
+    answer_box.markdown(answer)
+    logging.info(f"Answer streamed in {time.perf_counter() - start:.2f}s")
+    return answer + sources
+
+
+@st.cache_resource
+def get_chain_registry():
+    # Shared by every session of the process; the default configuration is built before the first question
+    registry = ChainRegistry(build_chain, max_size=CHAIN_REGISTRY_SIZE)
+    registry.warm(DEFAULT_SEARCH_TYPE, DEFAULT_SEARCH_KWARGS)
+    return registry
+
+
+@st.cache_resource
+def get_filter_options(version):
+    # Valores de tool/subject/type/category presentes na coleção, recalculados quando ela é re-ingerida
+    try:
+        return filter_options(lexical_index.documents())
+    except Exception as e:
+        logging.warning(f"Could not load the metadata filter options: {e}")
+        return filter_options([])
+
+
+def metadata_filter_inputs():
+    """
+    Renders the metadata filter widgets of the custom search panel.
+
+    Returns:
+        dict: The canonical metadata filter, or None if nothing is selected.
+    """
+    options = get_filter_options(collection_fingerprint.current())
+    selected = {}
+    for field in FILTER_FIELDS:
+        if options[field]:
+            selected[field] = st.multiselect(f"Filter by {field}", options[field])
+    indexed_since = st.date_input("Indexed since", value=None)
+    if indexed_since is not None:
+        selected["date_from"] = indexed_since.isoformat()
+    return normalize_filter(selected)
+
+
+@st.cache_resource
+def get_api_client():
+    # Conexões com a API reaproveitadas por todas as sessões
+    return httpx.Client(timeout=httpx.Timeout(API_TIMEOUT_SECONDS + 5, connect=5.0))
 
 
 # Configuração de recuperação
@@ -56,10 +185,11 @@ def main():
     setup_logging()
     setup_page()
     initialize_state()
-    retriever = create_retriever()
-    rag_chain = create_rag_chain(retriever,CONTEXTUALIZE_Q_SYSTEM_PROMPT)
+    # Com RAG_API_URL o app é só um cliente da API; sem ela, os chains rodam no próprio processo
+    chain_registry = None if RAG_API_URL else get_chain_registry()
+    search_type, search_kwargs = DEFAULT_SEARCH_TYPE, DEFAULT_SEARCH_KWARGS
    
-    logging.info(st.session_state)
+    logging.debug(st.session_state)
     
     # Barra lateral
     with st.sidebar:
@@ -71,13 +201,33 @@ def main():
             option = st.selectbox("Select a search method", ["Similarity Score Threshold", "MMR"])
             if option == "Similarity Score Threshold":
                 score_threshold = st.slider("Select a similarity score threshold", 0.0, 1.0, value=0.5)
-                retriever = vectorstore.as_retriever(search_type="similarity_score_threshold", search_kwargs={"score_threshold": score_threshold})
+                search_type, search_kwargs = "similarity_score_threshold", {"score_threshold": score_threshold}
             elif option == "MMR":
                 k = st.slider("Select a number of results", 1, 10, value=6)
                 lambda_mult = st.slider("Select a lambda multiplier", 0.0, 1.0, value=0.25)
-                retriever = vectorstore.as_retriever(search_type="mmr", search_kwargs={'k': k, 'lambda_mult': lambda_mult})
-            # Atualize o rag_chain com o novo retriever
-            rag_chain = chain(retriever=retriever, llm=llm, contextualize_q_system_prompt=CONTEXTUALIZE_Q_SYSTEM_PROMPT)
+                search_type, search_kwargs = "mmr", {'k': k, 'lambda_mult': lambda_mult}
+            # Busca só no recorte escolhido (ex.: uma ferramenta), com os índices de payload da coleção
+            metadata_filter = metadata_filter_inputs()
+            if metadata_filter:
+                search_kwargs = {**search_kwargs, "metadata_filter": metadata_filter}
+            if chain_registry is not None:
+                st.caption(f"Chain cache: {chain_registry.stats()}")
+            if get_answer_cache() is not None:
+                st.caption(f"Answer cache: {get_answer_cache().stats()}")
+            st.caption(f"Question rewrites: {rewrite_policy.stats()}")
+            st.caption(f"Query embeddings: {query_embeddings.stats()}")
+            if SPECULATIVE_RETRIEVAL:
+                st.caption(f"Speculative retrieval: {speculation_metrics.stats()}")
+            if context_packer is not None:
+                st.caption(f"Context tokens: {context_packer.stats()}")
+            if chain_tracer is not None:
+                # Painel de depuração: tempo de cada etapa dos turnos deste processo
+                with st.expander("Chain timings"):
+                    timings = chain_tracer.summary()
+                    if timings:
+                        st.table([{"stage": stage, **values} for stage, values in timings.items()])
+                    else:
+                        st.caption("No turns traced yet")
             
         st.image("src/img/martechito-logo.png", use_column_width=True)
         language = st.sidebar.selectbox("Select Language", ["English","Português"])
@@ -141,6 +291,11 @@ def main():
 
      # Reagir à entrada do usuário
     if prompt := st.chat_input("Type your message here..."):
+        # O chain da configuração escolhida é compartilhado entre sessões e reruns
+        if RAG_API_URL:
+            rag_chain = RagApiClient(get_api_client(), RAG_API_URL, search_type, search_kwargs)
+        else:
+            rag_chain = chain_registry.get(search_type, search_kwargs)
             
         with st.chat_message("user"):
             st.markdown(prompt)
@@ -150,19 +305,20 @@ def main():
         
             # Invocar o modelo QA
         last_four_interactions = st.session_state.conversation[-4:]
-        response = rag_chain.invoke({"input": prompt, "chat_history": last_four_interactions})
-        sources = list(set([f"[{doc.metadata['title']}]({doc.metadata['source']})" for doc in response["context"]]))
-            
-        if sources:
-            response["answer"] = f"{response['answer']} \n\n**Sources**:\n\n" + "\n\n".join(sources) + "\n"
-
+        inputs = {"input": prompt, "chat_history": last_four_interactions}
         with st.chat_message("assistant"):
-            st.markdown(response["answer"])
-        st.session_state.conversation.extend([HumanMessage(content=prompt), response["answer"]])
-        st.session_state.messages.append({"role": "assistant", "content": response["answer"]})
+            if STREAM_ANSWERS:
+                answer = stream_answer(rag_chain, inputs)
+            else:
+                response = rag_chain.invoke(inputs)
+                answer = response["answer"] + format_sources(response["context"])
+                st.markdown(answer)
+        st.session_state.conversation.extend([HumanMessage(content=prompt), answer])
+        st.session_state.messages.append({"role": "assistant", "content": answer})
+        if get_answer_cache() is not None:
+            logging.info(f"Answer cache: {get_answer_cache().stats()}")
         
         ##escaped_prompt = json.dumps(prompt)
-        answer = response["answer"]
         components.html(f"""
         <script>
           window.parent.parent.postMessage({{ type: 'prompt', prompt_data: {{'question':'{json.dumps(prompt)}','answer':'{json.dumps(answer)}'}} }}, '*');
@@ -1,13 +1,125 @@
 
 from qdrant_client import QdrantClient
+from qdrant_client.http.models import BinaryQuantization, QuantizationSearchParams, ScalarQuantization, SearchParams
 from langchain_qdrant import Qdrant
-from envs import QDRANT_API_KEY, QDRANT_URL, QDRANT_PORT, COLLECTION_NAME
-from llm_models import embeddings
+from envs import QDRANT_API_KEY, QDRANT_URL, QDRANT_PORT, COLLECTION_NAME, COLLECTION_REFRESH_SECONDS
+from envs import VECTOR_STORE_BACKEND, LOCAL_INDEX_DIR, COLLECTION_PROFILE, HYBRID_SEARCH
+from llm_models import query_embeddings
+from answer_cache import CollectionFingerprint
+from hybrid_retriever import LexicalIndex
+from local_vector_store import LocalVectorStore
+from metadata_filter import qdrant_filter
+import logging
 client = QdrantClient(url=QDRANT_URL, port=QDRANT_PORT, api_key=QDRANT_API_KEY)
+# Busca nos perfis criados pela ingestão (collection_profile.py do doc_extractor): os vetores quantizados
+# são reavaliados com os originais, sobre oversampling vezes mais candidatos
+HNSW_EF = 128
+RESCORE_OVERSAMPLING = {"float": None, "scalar": 2.0, "binary": 3.0}
 
 
-vectorstore = Qdrant(
-    client=client,
-    collection_name=COLLECTION_NAME,
-    embeddings=embeddings
-)
+class ScoredQdrant(Qdrant):
+    """
+    The Qdrant vector store, with the score of each result in the _score metadata of its document (recorded by the chain tracer).
+    """
+
+    @classmethod
+    def _document_from_scored_point(cls, scored_point, collection_name, content_payload_key, metadata_payload_key):
+        doc = super()._document_from_scored_point(scored_point, collection_name, content_payload_key, metadata_payload_key)
+        score = getattr(scored_point, "score", None)
+        if score is not None:
+            doc.metadata["_score"] = score
+        return doc
+
+
+def collection_profile(client, collection_name):
+    """
+    Returns the profile of an existing collection, read from its quantization config.
+
+    Args:
+        client (QdrantClient): The Qdrant client.
+        collection_name (str): The name of the collection.
+
+    Returns:
+        str: "float", "scalar" or "binary". "float" if the collection cannot be read.
+    """
+    try:
+        quantization = client.get_collection(collection_name).config.quantization_config
+    except Exception as e:
+        logging.warning(f"Could not read the config of {collection_name}, assuming the float profile: {e}")
+        return "float"
+    if isinstance(quantization, ScalarQuantization):
+        return "scalar"
+    if isinstance(quantization, BinaryQuantization):
+        return "binary"
+    return "float"
+
+
+def profile_search_params(profile):
+    """
+    Returns the search params that match a collection profile: the HNSW ef and, for the quantized profiles, rescoring with oversampling.
+
+    Args:
+        profile (str): "float", "scalar" or "binary".
+
+    Returns:
+        SearchParams: The search params.
+
+    Raises:
+        ValueError: If the profile is unknown.
+    """
+    if profile not in RESCORE_OVERSAMPLING:
+        raise ValueError(f"Unknown collection profile: {profile} (expected one of {', '.join(RESCORE_OVERSAMPLING)})")
+    if RESCORE_OVERSAMPLING[profile] is None:
+        return SearchParams(hnsw_ef=HNSW_EF)
+    return SearchParams(
+        hnsw_ef=HNSW_EF,
+        quantization=QuantizationSearchParams(ignore=False, rescore=True, oversampling=RESCORE_OVERSAMPLING[profile]),
+    )
+
+
+if VECTOR_STORE_BACKEND == "local":
+    # Índice exportado por export_local_index.py, buscado no próprio processo (sem chamadas ao Qdrant)
+    vectorstore = LocalVectorStore(LOCAL_INDEX_DIR, query_embeddings)
+    collection_fingerprint = vectorstore.fingerprint
+    lexical_index = LexicalIndex(client, COLLECTION_NAME, collection_fingerprint, load_documents=vectorstore.documents)
+    search_params = None
+elif VECTOR_STORE_BACKEND == "qdrant":
+    vectorstore = ScoredQdrant(
+        client=client,
+        collection_name=COLLECTION_NAME,
+        embeddings=query_embeddings
+    )
+    # Detecta re-ingestões da coleção (cache de respostas e índice léxico)
+    collection_fingerprint = CollectionFingerprint(client, COLLECTION_NAME, refresh_seconds=COLLECTION_REFRESH_SECONDS)
+    lexical_index = LexicalIndex(client, COLLECTION_NAME, collection_fingerprint)
+    # Parâmetros de busca do perfil da coleção (rescoring dos vetores quantizados); sem COLLECTION_PROFILE, lido da própria coleção
+    search_params = profile_search_params(COLLECTION_PROFILE or collection_profile(client, COLLECTION_NAME))
+else:
+    raise EnvironmentError(f"Unknown VECTOR_STORE_BACKEND: {VECTOR_STORE_BACKEND}")
+if HYBRID_SEARCH:
+    # Constrói o índice léxico na inicialização, em segundo plano, e não na primeira pergunta
+    lexical_index.warm()
+
+
+
+def dense_search_kwargs(search_kwargs):
+    """
+    Returns the search kwargs of the dense retriever for the app's search kwargs.
+
+    The metadata_filter of the app (a canonical filter) becomes the filter of the backend, a
+    Qdrant filter on the payload indexes or the filter itself for the local index, and the
+    search params of the collection profile are added.
+
+    Args:
+        search_kwargs (dict): The search kwargs of the app.
+
+    Returns:
+        dict: The search kwargs of the vector store retriever.
+    """
+    dense = {key: value for key, value in search_kwargs.items() if key != "metadata_filter"}
+    if search_params is not None:
+        dense["search_params"] = search_params
+    metadata_filter = search_kwargs.get("metadata_filter")
+    if metadata_filter:
+        dense["filter"] = metadata_filter if VECTOR_STORE_BACKEND == "local" else qdrant_filter(metadata_filter)
+    return dense
@@ -0,0 +1,206 @@
+from langchain_core.documents import Document
+import copy
+import re
+
+DEFAULT_SEPARATORS = ("\n\n", "\n", " ", "")
+
+
+class FastTextSplitter:
+    """
+    A single-pass text splitter, a drop-in replacement for RecursiveCharacterTextSplitter.split_documents.
+
+    The text is cut into atoms with precompiled separator patterns (paragraphs, then lines, then
+    words, then characters, only going down a level for pieces that do not fit), and the atoms are
+    packed greedily into chunks with a sliding overlap. Atoms are kept as offsets into the text and
+    measured once, and each chunk is a single slice of the original text, so nothing is re-joined.
+
+    Sizes are measured in characters or, with length_unit="tokens", in tokens of the embedding
+    model's tokenizer, which is what the embeddings API bills.
+
+    Args:
+        chunk_size (int): The maximum size of a chunk.
+        chunk_overlap (int): The maximum overlap between consecutive chunks.
+        separators (tuple): The separators, from the strongest to the weakest. "" cuts anywhere.
+        length_unit (str): "chars" or "tokens".
+        model (str): The embedding model whose tokenizer measures the tokens.
+        add_start_index (bool): Whether to add the start_index of each chunk to its metadata.
+    """
+
+    def __init__(self, chunk_size, chunk_overlap, separators=DEFAULT_SEPARATORS, length_unit="chars", model=None, add_start_index=False):
+        if chunk_overlap >= chunk_size:
+            raise ValueError(f"chunk_overlap ({chunk_overlap}) must be smaller than chunk_size ({chunk_size})")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = tuple(separators)
+        self.add_start_index = add_start_index
+        self._patterns = [re.compile(re.escape(separator)) if separator else None for separator in self.separators]
+        self._encoding = None
+        if length_unit == "tokens":
+            import tiktoken
+            try:
+                self._encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                self._encoding = tiktoken.get_encoding("cl100k_base")
+        elif length_unit != "chars":
+            raise ValueError(f"Unknown length unit: {length_unit}")
+        self._separator_lengths = {}
+
+    def _length(self, text):
+        if self._encoding is None:
+            return len(text)
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+    def _hard_cut(self, text, start, end, atoms):
+        if self._encoding is None:
+            for position in range(start, end, self.chunk_size):
+                atoms.append((position, min(position + self.chunk_size, end), min(self.chunk_size, end - position)))
+            return
+        segment = text[start:end]
+        data = segment.encode("utf-8")
+        tokens = self._encoding.encode(segment, disallowed_special=())
+        position, cut = start, 0
+        for index in range(0, len(tokens), self.chunk_size):
+            cut += len(self._encoding.decode_bytes(tokens[index:index + self.chunk_size]))
+            # A cut inside a multi-byte character moves back to its start, so every atom is a slice of the text
+            stop = start + len(data[:cut].decode("utf-8", "ignore"))
+            if stop > position:
+                atoms.append((position, stop, len(tokens[index:index + self.chunk_size])))
+                position = stop
+        if position < end:
+            atoms.append((position, end, self._length(text[position:end])))
+
+    def _atoms(self, text, start, end, level, atoms):
+        separator = self.separators[level] if level < len(self.separators) else ""
+        if not separator:
+            self._hard_cut(text, start, end, atoms)
+            return
+        position = start
+        for part in self._patterns[level].split(text[start:end]):
+            if part:
+                length = self._length(part)
+                if length <= self.chunk_size:
+                    atoms.append((position, position + len(part), length))
+                else:
+                    self._atoms(text, position, position + len(part), level + 1, atoms)
+            position += len(part) + len(separator)
+
+    def _gap_length(self, text, end, start):
+        if self._encoding is None:
+            return start - end
+        gap = text[end:start]
+        if gap not in self._separator_lengths:
+            self._separator_lengths[gap] = self._length(gap)
+        return self._separator_lengths[gap]
+
+    def _spans(self, text):
+        atoms = []
+        length = self._length(text)
+        if length <= self.chunk_size:
+            atoms.append((0, len(text), length))
+        else:
+            self._atoms(text, 0, len(text), 0, atoms)
+        spans, first, total = [], 0, 0
+        for index, (start, end, length) in enumerate(atoms):
+            gap = self._gap_length(text, atoms[index - 1][1], start) if index else 0
+            if index > first and total + gap + length > self.chunk_size:
+                spans.append((atoms[first][0], atoms[index - 1][1]))
+                while first < index and (total > self.chunk_overlap or total + gap + length > self.chunk_size):
+                    total -= atoms[first][2]
+                    first += 1
+                    if first < index:
+                        total -= self._gap_length(text, atoms[first - 1][1], atoms[first][0])
+                if first == index:
+                    gap = 0
+            total += gap + length
+        if atoms:
+            spans.append((atoms[first][0], atoms[-1][1]))
+        return spans
+
+    def _chunks(self, text):
+        for start, end in self._spans(text):
+            chunk = text[start:end]
+            stripped = chunk.strip()
+            if stripped:
+                yield start + len(chunk) - len(chunk.lstrip()), stripped
+
+    def _document(self, chunk, metadata, start_index):
+        chunk_metadata = copy.deepcopy(metadata)
+        if self.add_start_index:
+            chunk_metadata["start_index"] = start_index
+        return Document(page_content=chunk, metadata=chunk_metadata)
+
+    def split_text(self, text):
+        """
+        Splits a text into chunks.
+
+        Args:
+            text (str): The text to be split.
+
+        Returns:
+            list: The chunks.
+        """
+        return [chunk for _, chunk in self._chunks(text)]
+
+    def create_documents(self, texts, metadatas=None):
+        """
+        Splits texts into chunk documents.
+
+        Args:
+            texts (list): The texts to be split.
+            metadatas (list): The metadata of each text, copied to each of its chunks.
+
+        Returns:
+            list: The chunk documents.
+        """
+        metadatas = metadatas or [{}] * len(texts)
+        return [
+            self._document(chunk, metadata, start_index)
+            for text, metadata in zip(texts, metadatas)
+            for start_index, chunk in self._chunks(text)
+        ]
+
+    def split_stream(self, segments, metadata=None):
+        """
+        Splits a stream of text segments into chunk documents, yielding each chunk as soon as it is complete.
+
+        The last chunk of every split may still grow with the next segment, so the text from its start
+        onwards is carried to the next split, which keeps the overlap across segment boundaries. With
+        add_start_index, the start_index of each chunk is its position in the whole text.
+
+        Args:
+            segments (iterable): The text segments, in order.
+            metadata (dict): The metadata copied to each chunk.
+
+        Yields:
+            Document: A chunk.
+        """
+        metadata = metadata or {}
+        # offset: the position in the whole text of the start of the buffer
+        buffer, offset = "", 0
+        for segment in segments:
+            buffer += segment
+            if len(buffer) < 2 * self.chunk_size:
+                continue
+            chunks = list(self._chunks(buffer))
+            # A blank buffer has no chunk to carry over
+            if not chunks:
+                buffer, offset = "", offset + len(buffer)
+                continue
+            for start_index, chunk in chunks[:-1]:
+                yield self._document(chunk, metadata, offset + start_index)
+            carried = chunks[-1][0]
+            buffer, offset = buffer[carried:], offset + carried
+        for start_index, chunk in self._chunks(buffer):
+            yield self._document(chunk, metadata, offset + start_index)
+
+    def split_documents(self, documents):
+        """
+        Splits documents into chunks that keep the metadata of their document.
+
+        Args:
+            documents (list): A list of documents.
+
+        Returns:
+            list: The chunk documents.
+        """
+        return self.create_documents([doc.page_content for doc in documents], [doc.metadata for doc in documents])
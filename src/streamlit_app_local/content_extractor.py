@@ -0,0 +1,107 @@
+from urllib.parse import urlparse
+import re
+
+# Article body selectors of the documentation sites we ingest, tried in order
+SITE_SELECTORS = {
+    "support.google.com": ["div.article-container section.article", "div.article-container", "section.article", "div.cc"],
+    "developers.google.com": ["article.devsite-article", "div.devsite-article-body"],
+    "cloud.google.com": ["article.devsite-article", "div.devsite-article-body"],
+}
+GENERIC_SELECTORS = ["main article", "article", "main", "[role=main]"]
+BOILERPLATE_TAGS = ["script", "style", "noscript", "template", "svg", "iframe", "form", "button", "nav", "aside"]
+# Page headers and footers are dropped, but not the ones inside an article (which hold its title)
+PAGE_CHROME_TAGS = ["header", "footer"]
+BOILERPLATE_SELECTORS = [
+    "[role=navigation]", "[role=banner]", "[role=contentinfo]", "[role=search]", "[aria-hidden=true]",
+    ".article-feedback", ".feedback", ".survey", ".helpful", ".rating", ".related", ".related-articles",
+    ".breadcrumbs", ".breadcrumb", ".sibling-nav", ".hcfe-nav", ".devsite-nav", ".devsite-rating", ".devsite-banner",
+    ".cookie", ".share", ".print",
+]
+BLOCK_TAGS = ["p", "div", "section", "article", "table", "tr", "pre", "blockquote", "ul", "ol", "dl", "dt", "dd"]
+HEADING_TAGS = ["h1", "h2", "h3", "h4", "h5", "h6"]
+MIN_CONTENT_LENGTH = 200
+
+_BLANK_LINES = re.compile(r"\n\s*\n\s*(\n\s*)+")
+_SPACES = re.compile(r"[ \t\r\f\v]+")
+
+
+def _site_candidates(soup, url):
+    host = urlparse(url).netloc
+    for site, selectors in SITE_SELECTORS.items():
+        if host == site or host.endswith("." + site):
+            for selector in selectors:
+                element = soup.select_one(selector)
+                if element is not None:
+                    yield element
+
+
+def _link_density(element):
+    text_length = len(element.get_text(" ", strip=True))
+    link_length = sum(len(link.get_text(" ", strip=True)) for link in element.find_all("a"))
+    return link_length / text_length if text_length else 1.0
+
+
+def _readability_candidate(soup):
+    # Each paragraph votes for its parent and, with half the weight, its grandparent
+    body = soup.body or soup
+    elements, scores = {}, {}
+    for paragraph in body.find_all(["p", "pre", "li", "td"]):
+        text = paragraph.get_text(" ", strip=True)
+        if len(text) < 25:
+            continue
+        score = 1 + text.count(",") + min(len(text) // 100, 3)
+        for ancestor, weight in ((paragraph.parent, 1.0), (paragraph.parent.parent if paragraph.parent else None, 0.5)):
+            if ancestor is not None:
+                elements[id(ancestor)] = ancestor
+                scores[id(ancestor)] = scores.get(id(ancestor), 0) + score * weight
+    if not scores:
+        return body
+    best = max(scores, key=lambda key: scores[key] * (1 - _link_density(elements[key])))
+    return elements[best]
+
+
+def _to_text(element):
+    for heading in element.find_all(HEADING_TAGS):
+        level = int(heading.name[1])
+        heading.replace_with(f"\n\n{'#' * level} {heading.get_text(' ', strip=True)}\n\n")
+    for item in element.find_all("li"):
+        item.insert(0, "- ")
+        item.append("\n")
+    for line_break in element.find_all("br"):
+        line_break.replace_with("\n")
+    for block in element.find_all(BLOCK_TAGS):
+        block.append("\n\n")
+    text = element.get_text()
+    text = "\n".join(_SPACES.sub(" ", line).strip() for line in text.splitlines())
+    return _BLANK_LINES.sub("\n\n", text).strip()
+
+
+def extract_main_content(soup, url):
+    """
+    Extracts the article body of a page, dropping navigation menus, footers, feedback widgets and related-article lists.
+
+    The site-specific selectors are tried first, then common article containers, then the element
+    with the highest text density (a readability-style heuristic). Headings are kept as markdown
+    headings and list items as "- " lines, so the chunks keep the structure of the article.
+    The soup is modified in place.
+
+    Args:
+        soup (BeautifulSoup): The parsed page.
+        url (str): The URL of the page, used to pick the site-specific selectors.
+
+    Returns:
+        str: The text of the article body.
+    """
+    for selector in BOILERPLATE_SELECTORS:
+        for element in soup.select(selector):
+            element.decompose()
+    for element in soup.find_all(BOILERPLATE_TAGS):
+        element.decompose()
+    for element in soup.find_all(PAGE_CHROME_TAGS):
+        if element.find_parent(["article", "main"]) is None:
+            element.decompose()
+    candidates = list(_site_candidates(soup, url)) + [soup.select_one(selector) for selector in GENERIC_SELECTORS]
+    for candidate in candidates:
+        if candidate is not None and len(candidate.get_text(" ", strip=True)) >= MIN_CONTENT_LENGTH:
+            return _to_text(candidate)
+    return _to_text(_readability_candidate(soup))
@@ -0,0 +1,126 @@
+import logging
+import re
+import zlib
+import numpy as np
+
+_WORDS = re.compile(r"\w+")
+# A Mersenne prime larger than every 32-bit shingle hash
+_PRIME = np.uint64((1 << 61) - 1)
+
+
+class NearDuplicateIndex:
+    """
+    Collapses near-identical chunks with MinHash signatures and an LSH band index.
+
+    Each chunk is reduced to the MinHash signature of its word shingles. Signatures are split into
+    bands, and only chunks sharing a band bucket are compared, so the cost grows linearly with the
+    number of chunks. A chunk whose estimated Jaccard similarity with an earlier chunk reaches the
+    threshold is dropped, and its source is appended to the metadata["sources"] list of that earlier
+    chunk (the representative). The merges are reported to an on_merge callback, so the ingestion
+    state can persist them (IngestionState.merge) and reprocess the merged pages when their
+    representative goes away.
+
+    Args:
+        threshold (float): The minimum estimated Jaccard similarity of two near-duplicates.
+        num_perm (int): The number of MinHash permutations.
+        bands (int): The number of LSH bands. num_perm must be divisible by it.
+        shingle_size (int): The number of words of each shingle.
+
+    Attributes:
+        seen (int): The number of chunks added.
+        removed (int): The number of chunks dropped as near-duplicates.
+    """
+
+    def __init__(self, threshold=0.85, num_perm=64, bands=16, shingle_size=5):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be divisible by bands ({bands})")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        generator = np.random.default_rng(1)
+        self._a = generator.integers(1, 1 << 31, size=(num_perm, 1), dtype=np.uint64)
+        self._b = generator.integers(0, 1 << 31, size=(num_perm, 1), dtype=np.uint64)
+        self._buckets = {}
+        self._signatures = []
+        self._representatives = []
+        self.seen = 0
+        self.removed = 0
+
+    def signature(self, text):
+        """
+        Computes the MinHash signature of a text.
+
+        Args:
+            text (str): The text.
+
+        Returns:
+            numpy.ndarray: The signature, one value per permutation.
+        """
+        words = _WORDS.findall(text.lower())
+        size = min(self.shingle_size, len(words)) or 1
+        shingles = {" ".join(words[index:index + size]) for index in range(max(len(words) - size + 1, 1))}
+        hashes = np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles), dtype=np.uint64, count=len(shingles))
+        return ((self._a * hashes + self._b) % _PRIME).min(axis=1)
+
+    def add(self, chunk):
+        """
+        Adds a chunk to the index.
+
+        Args:
+            chunk (Document): The chunk.
+
+        Returns:
+            Document: The representative the chunk was merged into, or None if the chunk is new.
+        """
+        self.seen += 1
+        signature = self.signature(chunk.page_content)
+        keys = [(band, signature[band * self.rows:(band + 1) * self.rows].tobytes()) for band in range(self.bands)]
+        candidates = {index for key in keys for index in self._buckets.get(key, ())}
+        for index in sorted(candidates):
+            if np.mean(self._signatures[index] == signature) >= self.threshold:
+                representative = self._representatives[index]
+                sources = representative.metadata["sources"]
+                if chunk.metadata["source"] not in sources:
+                    sources.append(chunk.metadata["source"])
+                self.removed += 1
+                return representative
+        index = len(self._representatives)
+        chunk.metadata["sources"] = [chunk.metadata["source"]]
+        self._signatures.append(signature)
+        self._representatives.append(chunk)
+        for key in keys:
+            self._buckets.setdefault(key, []).append(index)
+        return None
+
+    def deduplicate(self, chunks, on_merge=None):
+        """
+        Adds a batch of chunks to the index.
+
+        Args:
+            chunks (list): A list of chunks.
+            on_merge (callable): Called with each dropped chunk and its representative, e.g. IngestionState.merge.
+
+        Returns:
+            list: The chunks that are not near-duplicates of an earlier chunk.
+        """
+        unique = []
+        for chunk in chunks:
+            representative = self.add(chunk)
+            if representative is None:
+                unique.append(chunk)
+            elif on_merge is not None:
+                on_merge(chunk, representative)
+        return unique
+
+    def stats(self):
+        """
+        Logs and returns the number of chunks seen and removed.
+
+        Returns:
+            dict: The number of chunks seen and removed.
+        """
+        stats = {"seen": self.seen, "removed": self.removed}
+        logging.info(f"Near-duplicate chunks removed: {stats}")
+        return stats
@@ -1,10 +1,18 @@
 from qdrant_client import QdrantClient
-from qdrant_client.http.models import Distance, VectorParams
-from langchain_qdrant import Qdrant
-from langchain_openai import OpenAIEmbeddings
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.document_loaders import WebBaseLoader
+from langchain_community.document_loaders.web_base import _build_metadata
+from langchain_core.documents import Document
+from bs4 import BeautifulSoup
 from dotenv import load_dotenv
+from incremental import IngestionState
+from embedding_cache import cached_embeddings
+from fetcher import AsyncPageFetcher
+from content_extractor import extract_main_content
+from pipeline import Pipeline
+from chunking import FastTextSplitter
+from bulk_upsert import BulkLoader, build_points
+from dedup import NearDuplicateIndex
+from collection_profile import create_payload_indexes, provision_collection
 import nest_asyncio
 import logging
 import datetime
@@ -37,15 +45,31 @@ validate_env_variables()
 QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
 QDRANT_URL = os.getenv("QDRANT_URL")
 QDRANT_PORT = os.getenv("QDRANT_PORT")
+QDRANT_GRPC_PORT = int(os.getenv("QDRANT_GRPC_PORT", "6334"))
+QDRANT_PREFER_GRPC = os.getenv("QDRANT_PREFER_GRPC", "false").lower() == "true"
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 COLLECTION_NAME = os.getenv("COLLECTION_NAME")
 CHUNK_SIZE = int(os.getenv("CHUNK_SIZE"))
 CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP"))
+CHUNK_LENGTH_UNIT = os.getenv("CHUNK_LENGTH_UNIT", "chars")
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL")
+COLLECTION_PROFILE = os.getenv("COLLECTION_PROFILE", "float")
+INCREMENTAL_INGESTION = os.getenv("INCREMENTAL_INGESTION", "true").lower() == "true"
+FETCH_CACHE_DIR = os.getenv("FETCH_CACHE_DIR", ".cache/pages")
+FETCH_CONCURRENCY = int(os.getenv("FETCH_CONCURRENCY", "16"))
+FETCH_CONCURRENCY_PER_HOST = int(os.getenv("FETCH_CONCURRENCY_PER_HOST", "4"))
+CONTENT_EXTRACTION = os.getenv("CONTENT_EXTRACTION", "true").lower() == "true"
+PIPELINE_BUFFER_SIZE = int(os.getenv("PIPELINE_BUFFER_SIZE", "4"))
+DOCUMENT_BATCH_SIZE = int(os.getenv("DOCUMENT_BATCH_SIZE", "8"))
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+UPSERT_BATCH_SIZE = int(os.getenv("UPSERT_BATCH_SIZE", "128"))
+UPSERT_PARALLEL = int(os.getenv("UPSERT_PARALLEL", "1"))
+BULK_PAUSE_INDEXING = os.getenv("BULK_PAUSE_INDEXING", "false").lower() == "true"
+DEDUP_CHUNKS = os.getenv("DEDUP_CHUNKS", "true").lower() == "true"
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.85"))
 
-embedding_client = OpenAIEmbeddings(model=EMBEDDING_MODEL, api_key=OPENAI_API_KEY)
-qdrant_client = QdrantClient(url=QDRANT_URL, port=QDRANT_PORT, api_key=QDRANT_API_KEY,timeout=10000)
-vector_store = Qdrant(client=qdrant_client, collection_name=COLLECTION_NAME, embeddings=embedding_client)
+embedding_client = cached_embeddings(EMBEDDING_MODEL, OPENAI_API_KEY)
+qdrant_client = QdrantClient(url=QDRANT_URL, port=QDRANT_PORT, grpc_port=QDRANT_GRPC_PORT, prefer_grpc=QDRANT_PREFER_GRPC, api_key=QDRANT_API_KEY,timeout=10000)
 
 def extract_urls(list_name: str):
     with open(list_name) as f:
@@ -55,17 +79,32 @@ def extract_urls(list_name: str):
 class CustomWebBaseLoader(WebBaseLoader):
    
     def __init__(self, urls_with_metadata):
-        super().__init__([item['url'] for item in urls_with_metadata],requests_per_second=5)
+        super().__init__([item['url'] for item in urls_with_metadata])
         self.urls_with_metadata = urls_with_metadata
+        self.fetcher = AsyncPageFetcher(
+            cache_dir=FETCH_CACHE_DIR,
+            concurrency=FETCH_CONCURRENCY,
+            per_host=FETCH_CONCURRENCY_PER_HOST,
+            headers=dict(self.session.headers),
+        )
 
-    def load(self):
+    def lazy_load(self):
         
-        documents = super().load()
-        for doc, metadata in zip(documents, self.urls_with_metadata):
+        for index, page in self.fetcher.iter_fetch(self.web_paths):
+            if page is None:
+                continue
+            metadata = self.urls_with_metadata[index]
+            soup = BeautifulSoup(page.text, self.default_parser)
+            page_metadata = _build_metadata(soup, page.url)
+            text = extract_main_content(soup, page.url) if CONTENT_EXTRACTION else soup.get_text(**self.bs_get_text_kwargs)
+            doc = Document(page_content=text, metadata=page_metadata)
             doc.metadata['subject'] = metadata['subject']
             doc.metadata['tool'] = metadata['tool']
             doc.metadata["date"] = datetime.date.today().isoformat()
-        return documents
+            yield doc
+
+    def load(self):
+        return list(self.lazy_load())
 
 
 def extract_documents(url_list_with_metadata: list):
@@ -76,34 +115,69 @@ def extract_documents(url_list_with_metadata: list):
     
 def get_chunks(documents: list):
     logging.info("Splitting documents into chunks...")
-    text_splitter = RecursiveCharacterTextSplitter(
-        separators=["\n\n", "\n", " ", ""],
+    text_splitter = FastTextSplitter(
         chunk_size=CHUNK_SIZE,
         chunk_overlap=CHUNK_OVERLAP,
-        length_function=len
+        length_unit=CHUNK_LENGTH_UNIT,
+        model=EMBEDDING_MODEL,
+        add_start_index=True,
     )
     chunks = text_splitter.split_documents(documents)
     return chunks
 
 def create_collection():
     logging.info("Creating collection...")
-    qdrant_client.create_collection(
-        collection_name=COLLECTION_NAME,
-        vectors_config=VectorParams(size=CHUNK_SIZE, distance=Distance.COSINE),
-    ) 
+    provision_collection(qdrant_client, COLLECTION_NAME, EMBEDDING_MODEL, profile=COLLECTION_PROFILE, embeddings=embedding_client)
         
+def embed_chunks(chunks: list, state: IngestionState):
+    new_chunks, ids = state.new_chunks(chunks)
+    if not new_chunks:
+        return []
+    vectors = embedding_client.embed_documents([chunk.page_content for chunk in new_chunks])
+    return build_points(new_chunks, vectors, ids)
+        
+def ingest(urls, state, deduplicator, bulk_loader):
+    loader = CustomWebBaseLoader(urls)
+    pipeline = Pipeline(loader.lazy_load(), buffer_size=PIPELINE_BUFFER_SIZE)
+    pipeline.stage("chunk", lambda documents: get_chunks(state.changed_documents(documents)), batch_size=DOCUMENT_BATCH_SIZE)
+    if DEDUP_CHUNKS:
+        pipeline.stage("dedup", lambda chunks: deduplicator.deduplicate(chunks, on_merge=state.merge), batch_size=EMBED_BATCH_SIZE)
+    pipeline.stage("embed", lambda chunks: embed_chunks(chunks, state), batch_size=EMBED_BATCH_SIZE)
+    pipeline.stage("upsert", bulk_loader.upload, batch_size=UPSERT_BATCH_SIZE * UPSERT_PARALLEL)
+    stats = pipeline.run()
+    state.commit()
+    return stats
+
 def main():
     try:
         logging.info("Starting URL Extractor...")
         urls = extract_urls("ga4_documents.json")
-        documents = extract_documents(urls)
-        chunks = get_chunks(documents)
+        state = IngestionState(qdrant_client, COLLECTION_NAME, version=f"{CHUNK_SIZE}:{CHUNK_OVERLAP}:{CHUNK_LENGTH_UNIT}")
+        if INCREMENTAL_INGESTION:
+            state.load()
         collection_exists = qdrant_client.collection_exists(COLLECTION_NAME)
         if not collection_exists:
             create_collection()
+        else:
+            create_payload_indexes(qdrant_client, COLLECTION_NAME)
         
-        vector_store.add_documents(chunks)
-        logging.info("Documents added to vector store")
+        bulk_loader = BulkLoader(
+            qdrant_client,
+            COLLECTION_NAME,
+            batch_size=UPSERT_BATCH_SIZE,
+            parallel=UPSERT_PARALLEL,
+            pause_indexing=BULK_PAUSE_INDEXING,
+        )
+        deduplicator = NearDuplicateIndex(threshold=DEDUP_THRESHOLD)
+        with bulk_loader:
+            stats = ingest(urls, state, deduplicator, bulk_loader)
+            chunks = stats["upsert"]["in"]
+            # The pages merged into a deleted representative are ingested again
+            while state.reprocess:
+                logging.info(f"Reprocessing {len(state.reprocess)} pages that lost merged content")
+                chunks += ingest([item for item in urls if item["url"] in state.reprocess], state, deduplicator, bulk_loader)["upsert"]["in"]
+        deduplicator.stats()
+        logging.info(f"{chunks} chunks added to vector store")
     except Exception as e:
         logging.error(e)
         raise e
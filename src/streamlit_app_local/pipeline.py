@@ -0,0 +1,141 @@
+import logging
+import queue
+import threading
+import time
+
+_DONE = object()
+
+
+class Pipeline:
+    """
+    Runs items from a source iterator through a chain of stages, each one in its own thread.
+
+    Consecutive stages are connected by bounded queues, so a slow stage blocks the ones before it
+    instead of letting items pile up in memory, and the network waits of different stages overlap.
+
+    Args:
+        source (iterable): The iterable that feeds the first stage.
+        buffer_size (int): The maximum number of items waiting between two stages.
+
+    Attributes:
+        stats (dict): The number of items received and produced and the busy time of each stage.
+
+    Methods:
+        stage(name, func, batch_size): Appends a stage to the pipeline.
+        run(): Runs the pipeline until the source is exhausted and returns the stats.
+    """
+
+    def __init__(self, source, buffer_size=4):
+        self.source = source
+        self.buffer_size = buffer_size
+        self.stages = []
+        self.stats = {}
+        self._stop = threading.Event()
+        self._error = None
+
+    def stage(self, name, func, batch_size=1):
+        """
+        Appends a stage to the pipeline.
+
+        Args:
+            name (str): The name of the stage, used in the stats and logs.
+            func (callable): A function that receives a list of up to batch_size items and returns an iterable of output items.
+            batch_size (int): The number of items handed to func at once.
+
+        Returns:
+            Pipeline: The pipeline itself, so stages can be chained.
+        """
+        self.stages.append((name, func, batch_size))
+        return self
+
+    def _put(self, output, item):
+        while not self._stop.is_set():
+            try:
+                output.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, input):
+        while True:
+            try:
+                return input.get(timeout=0.1)
+            except queue.Empty:
+                if self._stop.is_set():
+                    return _DONE
+
+    def _fail(self, name, error):
+        logging.error(f"Pipeline stage {name} failed", exc_info=error)
+        if self._error is None:
+            self._error = error
+        self._stop.set()
+
+    def _run_source(self, output):
+        try:
+            for item in self.source:
+                if not self._put(output, item):
+                    return
+                self.stats["source"]["out"] += 1
+        except Exception as e:
+            self._fail("source", e)
+        finally:
+            self._put(output, _DONE)
+
+    def _run_stage(self, name, func, batch_size, input, output):
+        stats = self.stats[name]
+
+        def flush(batch):
+            start = time.perf_counter()
+            for result in func(batch) or ():
+                stats["out"] += 1
+                if output is not None and not self._put(output, result):
+                    break
+            stats["seconds"] += time.perf_counter() - start
+
+        try:
+            batch = []
+            while True:
+                item = self._get(input)
+                if item is _DONE:
+                    break
+                stats["in"] += 1
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    flush(batch)
+                    batch = []
+            if batch and not self._stop.is_set():
+                flush(batch)
+        except Exception as e:
+            self._fail(name, e)
+        finally:
+            if output is not None:
+                self._put(output, _DONE)
+
+    def run(self):
+        """
+        Runs the pipeline until the source is exhausted.
+
+        Returns:
+            dict: The stats of each stage.
+
+        Raises:
+            Exception: The first exception raised by the source or by any stage.
+        """
+        start = time.perf_counter()
+        self.stats = {"source": {"out": 0}}
+        queues = [queue.Queue(maxsize=self.buffer_size) for _ in self.stages]
+        threads = [threading.Thread(target=self._run_source, args=(queues[0],), daemon=True)]
+        for index, (name, func, batch_size) in enumerate(self.stages):
+            self.stats[name] = {"in": 0, "out": 0, "seconds": 0.0}
+            output = queues[index + 1] if index + 1 < len(queues) else None
+            threads.append(threading.Thread(target=self._run_stage, args=(name, func, batch_size, queues[index], output), daemon=True))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.stats["seconds"] = time.perf_counter() - start
+        logging.info(f"Pipeline finished: {self.stats}")
+        if self._error is not None:
+            raise self._error
+        return self.stats
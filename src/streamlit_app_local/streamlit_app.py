@@ -10,6 +10,7 @@ import os
 import streamlit as st
 from dotenv import load_dotenv
 import logging
+from collection_profile import collection_profile, search_params
 
 set_verbose(True)
 logging.basicConfig(level=logging.INFO)
@@ -38,7 +39,8 @@ vectorstore = Qdrant(
         collection_name=COLLECTION_NAME,
         embeddings=embeddings
 )
-retriever = vectorstore.as_retriever()
+# Rescoring with oversampling when the collection is quantized
+retriever = vectorstore.as_retriever(search_kwargs={"search_params": search_params(collection_profile(client, COLLECTION_NAME))})
 
 contextualize_q_system_prompt = """Given a chat history and the latest user question \
     which might reference context in the chat history, formulate a standalone question \
@@ -0,0 +1,290 @@
+"""
+A deterministic stand-in for the OpenAI embeddings and chat completions APIs, for the offline benchmarks.
+
+The embeddings are feature-hashed bags of words, normalized, so texts that share words have a
+positive cosine similarity and the retrieval still returns related chunks. The chat completions
+return the question itself to the standalone-question prompt, and an answer made of words of the
+prompt otherwise. Token-id inputs are read as the bytes of the byte-level tokenizer installed by
+the benchmark workers. Both endpoints answer after a configurable latency (which includes the time
+spent computing the response), so the benchmarks measure the code around the API calls under a
+known, repeatable API cost.
+"""
+from aiohttp import web
+from collections import Counter
+from functools import lru_cache
+import asyncio
+import base64
+import hashlib
+import json
+import re
+import socket
+import threading
+import time
+import numpy as np
+
+# Dimension of the vectors of each model (the dimensions field of the request takes precedence)
+EMBEDDING_DIMENSIONS = {
+    "text-embedding-3-large": 3072,
+    "text-embedding-3-small": 1536,
+    "text-embedding-ada-002": 1536,
+}
+DEFAULT_DIMENSION = 1536
+# Words of the contextualize prompt of llm_models, answered with the question itself
+STANDALONE_MARKER = "standalone question"
+
+_WORDS = re.compile(r"\w+")
+
+
+@lru_cache(maxsize=65536)
+def _slots(token, dimension):
+    # Each word adds +-1 to two coordinates, picked by its hash
+    digest = hashlib.blake2b(token.encode("utf-8"), digest_size=10).digest()
+    return tuple(
+        (int.from_bytes(digest[start:start + 4], "little") % dimension, 1.0 if digest[start + 4] & 1 else -1.0)
+        for start in (0, 5)
+    )
+
+
+def embed(text, dimension):
+    """
+    Returns the deterministic embedding of a text.
+
+    Args:
+        text (str): The text.
+        dimension (int): The dimension of the vector.
+
+    Returns:
+        numpy.ndarray: The normalized float32 vector.
+    """
+    vector = np.zeros(dimension, dtype=np.float32)
+    counts = Counter(_WORDS.findall(text.lower()))
+    if counts:
+        slots = [(index, sign * count) for token, count in counts.items() for index, sign in _slots(token, dimension)]
+        indexes, values = zip(*slots)
+        np.add.at(vector, np.array(indexes), np.array(values, dtype=np.float32))
+    norm = np.linalg.norm(vector)
+    if not norm:
+        vector[0] = 1.0
+        return vector
+    return vector / norm
+
+
+def _text(item):
+    # The client sends token ids when it checks the context length (bytes, with the workers' tokenizer)
+    if isinstance(item, str):
+        return item
+    if all(0 <= token < 256 for token in item):
+        return bytes(item).decode("utf-8", "replace")
+    return " ".join(str(token) for token in item)
+
+
+def _content(message):
+    content = message.get("content") or ""
+    if isinstance(content, list):
+        return " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content
+
+
+def answer_tokens(messages, length):
+    """
+    Returns the tokens of the deterministic completion of a conversation.
+
+    Args:
+        messages (list): The messages of the request.
+        length (int): The number of tokens of an answer.
+
+    Returns:
+        list: The tokens, each with its leading space.
+    """
+    system = " ".join(_content(message) for message in messages if message.get("role") == "system")
+    question = next((_content(message) for message in reversed(messages) if message.get("role") == "user"), "")
+    if STANDALONE_MARKER in system:
+        words = question.split()
+    else:
+        words = _WORDS.findall(system) or question.split() or ["ok"]
+        words = [words[(index * 7) % len(words)] for index in range(length)]
+    return [(" " if index else "") + word for index, word in enumerate(words)]
+
+
+class FakeOpenAI:
+    """
+    An HTTP server with the /v1/embeddings and /v1/chat/completions endpoints of the OpenAI API.
+
+    Args:
+        embedding_latency (float): The latency of an embeddings request, in seconds.
+        embedding_latency_per_input (float): The added latency of each input of an embeddings request, in seconds.
+        chat_latency (float): The latency of a chat completion until its first token, in seconds.
+        token_latency (float): The latency of each further token of a chat completion, in seconds.
+        answer_length (int): The number of tokens of an answer.
+
+    Attributes:
+        requests (dict): The number of embeddings requests, embedded inputs and chat completions served.
+
+    Methods:
+        app(): Returns the aiohttp application.
+        stats(): Returns a copy of the request counters.
+    """
+
+    def __init__(self, embedding_latency=0.05, embedding_latency_per_input=0.0005, chat_latency=0.3, token_latency=0.01, answer_length=60):
+        self.embedding_latency = embedding_latency
+        self.embedding_latency_per_input = embedding_latency_per_input
+        self.chat_latency = chat_latency
+        self.token_latency = token_latency
+        self.answer_length = answer_length
+        self.requests = {"embeddings": 0, "embedded_inputs": 0, "chat_completions": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, key, value=1):
+        with self._lock:
+            self.requests[key] += value
+
+    def stats(self):
+        """
+        Returns a copy of the request counters.
+
+        Returns:
+            dict: The counters.
+        """
+        with self._lock:
+            return dict(self.requests)
+
+    async def embeddings(self, request):
+        body = await request.json()
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        # A single list of token ids is one input
+        if inputs and isinstance(inputs[0], int):
+            inputs = [inputs]
+        self._count("embeddings")
+        self._count("embedded_inputs", len(inputs))
+        start = time.perf_counter()
+        dimension = body.get("dimensions") or EMBEDDING_DIMENSIONS.get(body.get("model"), DEFAULT_DIMENSION)
+        vectors = await asyncio.to_thread(lambda: [embed(_text(item), dimension) for item in inputs])
+        latency = self.embedding_latency + self.embedding_latency_per_input * len(inputs)
+        await asyncio.sleep(max(0.0, latency - (time.perf_counter() - start)))
+        # The OpenAI client asks for base64 unless a format is given
+        if body.get("encoding_format") == "base64":
+            encoded = [base64.b64encode(vector.tobytes()).decode("ascii") for vector in vectors]
+        else:
+            encoded = [vector.tolist() for vector in vectors]
+        tokens = sum(len(_text(item)) // 4 + 1 for item in inputs)
+        return web.json_response({
+            "object": "list",
+            "model": body.get("model"),
+            "data": [{"object": "embedding", "index": index, "embedding": embedding} for index, embedding in enumerate(encoded)],
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+    async def chat_completions(self, request):
+        body = await request.json()
+        self._count("chat_completions")
+        messages = body.get("messages", [])
+        tokens = answer_tokens(messages, self.answer_length)
+        usage = {
+            "prompt_tokens": sum(len(_content(message)) // 4 + 1 for message in messages),
+            "completion_tokens": len(tokens),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        completion = {"id": "chatcmpl-benchmark", "created": 0, "model": body.get("model"), "system_fingerprint": None}
+        await asyncio.sleep(self.chat_latency)
+        if not body.get("stream"):
+            await asyncio.sleep(self.token_latency * max(len(tokens) - 1, 0))
+            return web.json_response({
+                **completion,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        async def send(choices, **extra):
+            chunk = {**completion, "object": "chat.completion.chunk", "choices": choices, **extra}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+
+        await send([{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+        for index, token in enumerate(tokens):
+            if index:
+                await asyncio.sleep(self.token_latency)
+            await send([{"index": 0, "delta": {"content": token}, "finish_reason": None}])
+        await send([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        if (body.get("stream_options") or {}).get("include_usage"):
+            await send([], usage=usage)
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    def app(self):
+        """
+        Returns the aiohttp application of the fake API.
+
+        Returns:
+            web.Application: The application.
+        """
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.add_routes([
+            web.post("/v1/embeddings", self.embeddings),
+            web.post("/v1/chat/completions", self.chat_completions),
+        ])
+        return app
+
+
+class BackgroundServer:
+    """
+    Runs an aiohttp application on its own event loop, in a daemon thread.
+
+    Args:
+        app (web.Application): The application.
+        host (str): The host to bind.
+        port (int): The port to bind, or 0 for a free port.
+
+    Attributes:
+        url (str): The base URL of the server, once started.
+
+    Methods:
+        start(): Starts the server and waits until it accepts connections.
+        stop(): Stops the server.
+    """
+
+    def __init__(self, app, host="127.0.0.1", port=0):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.url = None
+        self._loop = asyncio.new_event_loop()
+        self._runner = None
+        self._thread = None
+
+    async def _start(self, sock):
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.SockSite(self._runner, sock).start()
+
+    def start(self):
+        """
+        Starts the server and waits until it accepts connections.
+
+        Returns:
+            BackgroundServer: The server.
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        self.url = f"http://{self.host}:{sock.getsockname()[1]}"
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(sock), self._loop).result()
+        return self
+
+    def stop(self):
+        """
+        Stops the server.
+        """
+        if self._runner is not None:
+            asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
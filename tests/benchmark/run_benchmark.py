@@ -0,0 +1,279 @@
+"""
+Offline benchmark of the ingestion and of the RAG chain, with local stand-ins for OpenAI and Qdrant.
+
+Starts a deterministic fake of the OpenAI API (fake_openai.py) and a server with the HTML
+snapshot of the pages of ga4_documents.json (snapshot.py), then measures, each in its own
+process (workers.py) against an in-memory Qdrant:
+    - the ingestion throughput (pages/s, chunks/s) of load_qdrant_vector_db and url_extractor;
+    - the latency percentiles of the turns of llm_models.chain, and its stage breakdown.
+The results are written to a JSON file; --compare prints the change against a previous run.
+Runs are only comparable with the same snapshot and latency settings (both are in the results).
+
+Usage:
+    python run_benchmark.py record [--snapshot-dir snapshot]     # once, needs network access
+    python run_benchmark.py [--turns 30] [--output results/run.json] [--compare results/previous.json]
+"""
+from fake_openai import FakeOpenAI, BackgroundServer
+from snapshot import load_pages, local_documents, record, snapshot_app
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.abspath(os.path.join(BENCHMARK_DIR, "..", ".."))
+DOCUMENTS_PATH = os.path.join(ROOT, "src", "streamlit_app_local", "ga4_documents.json")
+COLLECTION_NAME = "benchmark"
+# Settings read from the environment by the measured code, recorded with the results
+TUNING_VARIABLES = (
+    "CONTENT_EXTRACTION", "FETCH_CONCURRENCY", "FETCH_CONCURRENCY_PER_HOST", "PIPELINE_BUFFER_SIZE", "DOCUMENT_BATCH_SIZE",
+    "EMBED_BATCH_SIZE", "UPSERT_BATCH_SIZE", "UPSERT_PARALLEL", "DEDUP_CHUNKS", "DEDUP_THRESHOLD", "HYBRID_SEARCH", "HYBRID_K",
+    "HYBRID_LEXICAL_FLOOR", "REWRITE_POLICY", "REWRITE_MODEL", "CONTEXT_PACKING", "CONTEXT_TOKEN_BUDGET",
+)
+# The metrics shown by --compare, and whether higher is better
+COMPARED_METRICS = (
+    ("ingestion.load_qdrant_vector_db.pages_per_second", True),
+    ("ingestion.load_qdrant_vector_db.chunks_per_second", True),
+    ("ingestion.url_extractor.pages_per_second", True),
+    ("ingestion.url_extractor.chunks_per_second", True),
+    ("chain.turn_ms.p50", False),
+    ("chain.turn_ms.p95", False),
+    ("chain.turn_ms.p99", False),
+    ("chain.first_token_ms.p50", False),
+    ("chain.first_token_ms.p95", False),
+    ("chain.turns_per_second", True),
+)
+
+
+def worker_environment(args, openai_url, workdir):
+    """
+    Returns the environment of the worker processes.
+
+    Args:
+        args (argparse.Namespace): The command line arguments.
+        openai_url (str): The base URL of the fake OpenAI API.
+        workdir (str): The working directory of the run (caches).
+
+    Returns:
+        dict: The environment.
+    """
+    return {
+        **os.environ,
+        "OPENAI_API_KEY": "sk-benchmark",
+        "OPENAI_API_BASE": f"{openai_url}/v1",
+        # Never contacted: the workers replace the client with an in-memory one
+        "QDRANT_URL": "http://127.0.0.1",
+        "QDRANT_PORT": "6333",
+        "QDRANT_API_KEY": "benchmark",
+        "COLLECTION_NAME": COLLECTION_NAME,
+        "COLLECTION_PROFILE": args.collection_profile,
+        "EMBEDDING_MODEL": args.embedding_model,
+        "MODEL": args.model,
+        "CHUNK_SIZE": str(args.chunk_size),
+        "CHUNK_OVERLAP": str(args.chunk_overlap),
+        "CHUNK_LENGTH_UNIT": "chars",
+        "FETCH_CACHE_DIR": os.path.join(workdir, "pages-cache"),
+        "EMBEDDING_CACHE_PATH": os.path.join(workdir, "embeddings.sqlite3"),
+        "INCREMENTAL_INGESTION": "false",
+        "ANSWER_CACHE_ENABLED": "false",
+        "QUERY_EMBEDDING_REDIS_URL": "",
+        "PROJECT_NAME": "benchmark",
+        "DATASET": "benchmark",
+        "TABLE": "benchmark",
+    }
+
+
+def run_worker(name, config, env, workdir, openai):
+    """
+    Runs a measurement of workers.py in its own process.
+
+    Args:
+        name (str): The name of the worker.
+        config (dict): The config of the worker.
+        env (dict): The environment of the process.
+        workdir (str): The working directory of the run.
+        openai (FakeOpenAI): The fake API, whose requests are counted.
+
+    Returns:
+        dict: The result of the worker, with the API requests it made, or its error.
+    """
+    run_dir = os.path.join(workdir, name)
+    os.makedirs(run_dir, exist_ok=True)
+    config_path, result_path = os.path.join(run_dir, "config.json"), os.path.join(run_dir, "result.json")
+    with open(config_path, "w") as f:
+        json.dump({**config, "workdir": run_dir}, f)
+    before = openai.stats()
+    logging.info(f"Running {name}...")
+    process = subprocess.run(
+        [sys.executable, os.path.join(BENCHMARK_DIR, "workers.py"), name, config_path, result_path],
+        env=env, capture_output=True, text=True,
+    )
+    if process.returncode != 0:
+        logging.error(f"{name} failed:\n{process.stderr[-4000:]}")
+        return {"error": process.stderr.strip().splitlines()[-1] if process.stderr.strip() else f"exit code {process.returncode}"}
+    with open(result_path) as f:
+        result = json.load(f)
+    after = openai.stats()
+    if "skipped" not in result:
+        result["openai_requests"] = {key: after[key] - before[key] for key in after}
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _metric(results, path):
+    value = results
+    for key in path.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value if isinstance(value, (int, float)) else None
+
+
+def compare(previous, current):
+    """
+    Returns a table of the change of the main metrics between two runs.
+
+    Args:
+        previous (dict): The results of the previous run.
+        current (dict): The results of the current run.
+
+    Returns:
+        str: The table, preceded by a warning if the runs are not comparable.
+    """
+    lines = []
+    for key in ("snapshot", "fake_openai"):
+        if previous.get("config", {}).get(key) != current.get("config", {}).get(key):
+            lines.append(f"WARNING: the runs have a different {key} config, the numbers are not comparable")
+    lines.append(f"{'metric':<52} {'previous':>10} {'current':>10} {'change':>9}")
+    for path, higher_is_better in COMPARED_METRICS:
+        old, new = _metric(previous, path), _metric(current, path)
+        if old is None or new is None:
+            continue
+        change = (new - old) / old * 100 if old else 0.0
+        better = change > 0 if higher_is_better else change < 0
+        lines.append(f"{path:<52} {old:>10} {new:>10} {change:>+8.1f}%{'' if abs(change) < 1 else (' better' if better else ' worse')}")
+    return "\n".join(lines)
+
+
+def run(args):
+    with open(args.documents) as f:
+        documents = json.load(f)
+    if args.pages:
+        documents = documents[:args.pages]
+    documents, pages, snapshot = load_pages(documents, args.snapshot_dir, page_kb=args.page_kb)
+    openai = FakeOpenAI(
+        embedding_latency=args.embedding_latency_ms / 1000,
+        embedding_latency_per_input=args.embedding_latency_per_input_ms / 1000,
+        chat_latency=args.chat_latency_ms / 1000,
+        token_latency=args.token_latency_ms / 1000,
+        answer_length=args.answer_tokens,
+    )
+    results = {
+        "started_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "config": {
+            "snapshot": {**snapshot, "page_latency_ms": args.page_latency_ms},
+            "fake_openai": {
+                "embedding_latency_ms": args.embedding_latency_ms,
+                "embedding_latency_per_input_ms": args.embedding_latency_per_input_ms,
+                "chat_latency_ms": args.chat_latency_ms,
+                "token_latency_ms": args.token_latency_ms,
+                "answer_tokens": args.answer_tokens,
+            },
+            "embedding_model": args.embedding_model,
+            "collection_profile": args.collection_profile,
+            "chunk_size": args.chunk_size,
+            "chunk_overlap": args.chunk_overlap,
+            "environment": {name: os.environ[name] for name in TUNING_VARIABLES if name in os.environ},
+        },
+    }
+    with tempfile.TemporaryDirectory(prefix="rag-benchmark-") as workdir, \
+            BackgroundServer(openai.app()) as openai_server, \
+            BackgroundServer(snapshot_app(pages, latency=args.page_latency_ms / 1000)) as snapshot_server:
+        env = worker_environment(args, openai_server.url, workdir)
+        ingestion_documents = local_documents(documents, snapshot_server.url)
+        points_path = os.path.join(workdir, "points.npz")
+        results["ingestion"] = {
+            "load_qdrant_vector_db": run_worker("ingest-local", {
+                "documents": ingestion_documents, "collection_name": COLLECTION_NAME, "points_path": points_path,
+            }, env, workdir, openai),
+            "url_extractor": run_worker("ingest-doc-extractor", {
+                "documents": ingestion_documents, "collection_name": COLLECTION_NAME,
+            }, env, workdir, openai),
+        }
+        if not os.path.exists(points_path):
+            results["chain"] = {"error": "load_qdrant_vector_db did not produce the collection"}
+        else:
+            results["chain"] = run_worker("chain", {
+                "documents": documents,
+                "collection_name": COLLECTION_NAME,
+                "points_path": points_path,
+                "turns": args.turns,
+                "warmup": args.warmup,
+                "concurrency": args.concurrency,
+                "pipeline": args.pipeline,
+                "search_type": args.search_type,
+                "search_kwargs": json.loads(args.search_kwargs),
+            }, env, workdir, openai)
+    output = args.output or os.path.join(BENCHMARK_DIR, "results", datetime.datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps({key: results[key] for key in ("ingestion", "chain")}, indent=2))
+    logging.info(f"Results written to {output}")
+    if args.compare:
+        with open(args.compare) as f:
+            print(compare(json.load(f), results))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", nargs="?", choices=("run", "record"), default="run")
+    parser.add_argument("--documents", default=DOCUMENTS_PATH)
+    parser.add_argument("--snapshot-dir", default=os.path.join(BENCHMARK_DIR, "snapshot"))
+    parser.add_argument("--pages", type=int, default=0, help="Only the first N documents (0 for all)")
+    parser.add_argument("--page-kb", type=int, default=20, help="Article size of the synthetic pages")
+    parser.add_argument("--page-latency-ms", type=float, default=20)
+    parser.add_argument("--embedding-latency-ms", type=float, default=50)
+    parser.add_argument("--embedding-latency-per-input-ms", type=float, default=0.5)
+    parser.add_argument("--chat-latency-ms", type=float, default=300, help="Latency until the first token of a completion")
+    parser.add_argument("--token-latency-ms", type=float, default=10)
+    parser.add_argument("--answer-tokens", type=int, default=60)
+    parser.add_argument("--embedding-model", default="text-embedding-3-large")
+    parser.add_argument("--model", default="gpt-4o")
+    parser.add_argument("--collection-profile", default="float")
+    parser.add_argument("--chunk-size", type=int, default=int(os.getenv("CHUNK_SIZE", "3072")))
+    parser.add_argument("--chunk-overlap", type=int, default=int(os.getenv("CHUNK_OVERLAP", "500")))
+    parser.add_argument("--turns", type=int, default=30)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--pipeline", choices=("chain", "speculative"), default="chain")
+    parser.add_argument("--search-type", default="similarity")
+    parser.add_argument("--search-kwargs", default='{"k": 4}', help="JSON search kwargs of the retriever")
+    parser.add_argument("--output")
+    parser.add_argument("--compare", help="A previous results file")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if args.command == "record":
+        with open(args.documents) as f:
+            record(json.load(f), args.snapshot_dir)
+    else:
+        run(args)
+
+
+if __name__ == "__main__":
+    main()
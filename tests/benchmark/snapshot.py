@@ -0,0 +1,194 @@
+"""
+The HTML snapshot of the pages of ga4_documents.json used by the offline benchmarks.
+
+A snapshot is recorded once (record() needs network access) into a directory with a pages/
+folder and a manifest.json mapping each URL to its file and sha256. When there is no recorded
+snapshot, GA4-like pages are synthesized deterministically from the subjects, with the header,
+navigation, feedback and footer boilerplate that the content extractor drops. Either way the
+pages are served from a local HTTP server, so the ingestion fetches them like the real site.
+"""
+from aiohttp import web
+import asyncio
+import datetime
+import hashlib
+import json
+import logging
+import os
+import random
+import requests
+
+WORDS = ("analytics event session_start page_location engagement_time_msec user property report conversion "
+         "the a of to in and is for with on data stream tag configuration dimension metric audience").split()
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+
+
+def page_key(url):
+    """
+    Returns the file name of a page in the snapshot.
+
+    Args:
+        url (str): The URL of the page.
+
+    Returns:
+        str: The file name.
+    """
+    return hashlib.sha1(url.encode("utf-8")).hexdigest()[:16] + ".html"
+
+
+def record(documents, snapshot_dir, timeout=30):
+    """
+    Downloads the pages of the documents into a snapshot directory.
+
+    Args:
+        documents (list): The items of ga4_documents.json.
+        snapshot_dir (str): The snapshot directory.
+        timeout (int): The timeout of each request, in seconds.
+
+    Returns:
+        dict: The manifest of the snapshot.
+    """
+    os.makedirs(os.path.join(snapshot_dir, "pages"), exist_ok=True)
+    pages = {}
+    with requests.Session() as session:
+        session.headers["User-Agent"] = USER_AGENT
+        for item in documents:
+            try:
+                response = session.get(item["url"], timeout=timeout)
+                response.raise_for_status()
+            except requests.RequestException as e:
+                logging.error(f"Failed to record {item['url']}: {e}")
+                continue
+            key = page_key(item["url"])
+            with open(os.path.join(snapshot_dir, "pages", key), "wb") as f:
+                f.write(response.content)
+            pages[item["url"]] = {"file": key, "sha256": hashlib.sha256(response.content).hexdigest()}
+    manifest = {"recorded_at": datetime.datetime.now(datetime.timezone.utc).isoformat(), "pages": pages}
+    with open(os.path.join(snapshot_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    logging.info(f"Recorded {len(pages)} of {len(documents)} pages into {snapshot_dir}")
+    return manifest
+
+
+def synthetic_page(item, page_kb):
+    """
+    Builds a deterministic GA4-like help page for a document.
+
+    Args:
+        item (dict): The item of ga4_documents.json.
+        page_kb (int): The approximate size of the article text, in KB.
+
+    Returns:
+        str: The HTML of the page.
+    """
+    generator = random.Random(item["url"])
+    subject = item["subject"]
+    vocabulary = WORDS + subject.replace("[GA4]", "").lower().split()
+    sections, size = [], 0
+    while size < page_kb * 1024:
+        heading = " ".join(generator.choice(vocabulary) for _ in range(generator.randint(2, 6))).capitalize()
+        paragraphs = [
+            "<p>%s.</p>" % " ".join(generator.choice(vocabulary) for _ in range(generator.randint(20, 80))).capitalize()
+            for _ in range(generator.randint(1, 4))
+        ]
+        items = "".join("<li>%s</li>" % " ".join(generator.choice(vocabulary) for _ in range(generator.randint(3, 12))) for _ in range(generator.randint(0, 5)))
+        section = f"<h2>{heading}</h2>{''.join(paragraphs)}" + (f"<ul>{items}</ul>" if items else "")
+        sections.append(section)
+        size += len(section)
+    navigation = "".join(f'<li><a href="/analytics/answer/{generator.randint(1000000, 9999999)}">{generator.choice(WORDS)} help</a></li>' for _ in range(30))
+    return (
+        f"<!DOCTYPE html><html lang=\"en\"><head><meta charset=\"utf-8\"><title>{subject} - Analytics Help</title>"
+        f"<meta name=\"description\" content=\"{subject}\"><script>var benchmark = true;</script><style>body {{ margin: 0; }}</style></head>"
+        f"<body><header role=\"banner\"><a href=\"/\">Analytics Help</a><form role=\"search\"><input name=\"q\"></form></header>"
+        f"<nav class=\"hcfe-nav\"><ul>{navigation}</ul></nav>"
+        f"<main><article><header><h1>{subject}</h1></header>{''.join(sections)}"
+        f"<div class=\"article-feedback\">Was this helpful? <button>Yes</button><button>No</button></div></article>"
+        f"<aside class=\"related-articles\"><ul>{navigation}</ul></aside></main>"
+        f"<footer role=\"contentinfo\">&copy; Google - Privacy Policy - Terms of Service</footer></body></html>"
+    )
+
+
+def load_pages(documents, snapshot_dir, page_kb=20):
+    """
+    Loads the pages of the recorded snapshot, or synthesizes them when there is none.
+
+    Args:
+        documents (list): The items of ga4_documents.json.
+        snapshot_dir (str): The snapshot directory.
+        page_kb (int): The approximate size of the synthetic articles, in KB.
+
+    Returns:
+        tuple: The documents that have a page, the pages (bytes) by file name and the snapshot description.
+    """
+    manifest_path = os.path.join(snapshot_dir, "manifest.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        recorded, pages = [], {}
+        for item in documents:
+            entry = manifest["pages"].get(item["url"])
+            if entry is None:
+                continue
+            with open(os.path.join(snapshot_dir, "pages", entry["file"]), "rb") as f:
+                pages[entry["file"]] = f.read()
+            recorded.append(item)
+        description = {"source": "recorded", "recorded_at": manifest.get("recorded_at")}
+        documents = recorded
+    else:
+        pages = {page_key(item["url"]): synthetic_page(item, page_kb).encode("utf-8") for item in documents}
+        description = {"source": "synthetic", "page_kb": page_kb}
+    digest = hashlib.sha256()
+    for key in sorted(pages):
+        digest.update(key.encode("utf-8"))
+        digest.update(hashlib.sha256(pages[key]).digest())
+    description.update(pages=len(pages), megabytes=round(sum(map(len, pages.values())) / 1024 / 1024, 2), digest=digest.hexdigest()[:16])
+    return documents, pages, description
+
+
+def local_documents(documents, base_url):
+    """
+    Points the documents at the pages of the local snapshot server.
+
+    The pages are served from localhost, so the content extractor uses its generic selectors
+    instead of the ones of support.google.com.
+
+    Args:
+        documents (list): The items of ga4_documents.json.
+        base_url (str): The base URL of the snapshot server.
+
+    Returns:
+        list: The documents, with local URLs and the type and category of the BigQuery rows.
+    """
+    return [
+        {
+            **item,
+            "url": f"{base_url}/pages/{page_key(item['url'])}",
+            "type": item.get("type", "article"),
+            "category": item.get("category", item.get("tool", "ga4")),
+        }
+        for item in documents
+    ]
+
+
+def snapshot_app(pages, latency=0.0):
+    """
+    Returns an aiohttp application that serves the pages of a snapshot.
+
+    Args:
+        pages (dict): The pages (bytes) by file name.
+        latency (float): The latency of each response, in seconds.
+
+    Returns:
+        web.Application: The application.
+    """
+
+    async def page(request):
+        body = pages.get(request.match_info["key"])
+        if body is None:
+            raise web.HTTPNotFound()
+        if latency:
+            await asyncio.sleep(latency)
+        return web.Response(body=body, content_type="text/html", charset="utf-8")
+
+    app = web.Application()
+    app.add_routes([web.get("/pages/{key}", page)])
+    return app
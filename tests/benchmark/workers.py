@@ -0,0 +1,307 @@
+"""
+The measurements of the offline benchmarks, each run in its own process by run_benchmark.py.
+
+Each deployed unit imports its modules by their bare names (and some names exist in several
+units), so every measurement gets a fresh interpreter with its unit on sys.path. The environment
+(OPENAI_API_BASE pointing at the fake API, the chunking and pipeline settings) is set by the
+orchestrator; Qdrant runs in local in-memory mode inside the worker.
+
+Usage:
+    python workers.py <ingest-local|ingest-doc-extractor|chain> <config.json> <result.json>
+"""
+from qdrant_client import QdrantClient
+import json
+import logging
+import os
+import sys
+import time
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+UNITS = {
+    "ingest-local": os.path.join(ROOT, "src", "streamlit_app_local"),
+    "ingest-doc-extractor": os.path.join(ROOT, "scripts", "doc_extractor"),
+    "chain": os.path.join(ROOT, "src", "streamlit_app", "src"),
+}
+
+
+def percentiles(samples):
+    """
+    Returns the summary of a list of durations, in milliseconds.
+
+    Args:
+        samples (list): The durations, in seconds.
+
+    Returns:
+        dict: The count, mean, p50, p90, p95, p99 and max, or only the count if there are no samples.
+    """
+    if not samples:
+        return {"count": 0}
+    values = np.array(samples) * 1000
+    summary = {"count": len(samples), "mean": round(float(values.mean()), 1)}
+    for q in (50, 90, 95, 99):
+        summary[f"p{q}"] = round(float(np.percentile(values, q)), 1)
+    summary["max"] = round(float(values.max()), 1)
+    return summary
+
+
+def install_offline_tokenizer():
+    """
+    Registers a byte-level stand-in for the cl100k_base tokenizer, whose file cannot be downloaded offline.
+
+    OpenAIEmbeddings tokenizes the texts to check their context length and then sends them in
+    batches; without the check it sends one request per text. The stand-in keeps the batched path
+    of production, with one token per byte, and is used on every machine so runs stay comparable.
+    """
+    import tiktoken
+    import tiktoken.registry
+
+    tiktoken.registry.ENCODINGS["cl100k_base"] = tiktoken.Encoding(
+        "cl100k_base",
+        pat_str=r"\S+|\s+",
+        mergeable_ranks={bytes([byte]): byte for byte in range(256)},
+        special_tokens={"<|endoftext|>": 256},
+    )
+
+
+def _ingestion_result(client, collection_name, seconds, pages_requested):
+    # The pages are counted by their distinct sources in the collection
+    chunks = client.count(collection_name, exact=True).count if client.collection_exists(collection_name) else 0
+    sources, offset = set(), None
+    while chunks:
+        points, offset = client.scroll(collection_name, limit=1024, offset=offset, with_payload=["metadata.source"], with_vectors=False)
+        sources.update(((point.payload or {}).get("metadata") or {}).get("source") for point in points)
+        if offset is None:
+            break
+    return {
+        "seconds": round(seconds, 3),
+        "pages_requested": pages_requested,
+        "pages": len(sources),
+        "chunks": chunks,
+        "pages_per_second": round(len(sources) / seconds, 2) if seconds else None,
+        "chunks_per_second": round(chunks / seconds, 2) if seconds else None,
+    }
+
+
+def export_points(client, collection_name, path):
+    """
+    Writes the vectors and payloads of a collection, for the chain benchmark.
+
+    Args:
+        client (QdrantClient): The Qdrant client.
+        collection_name (str): The name of the collection.
+        path (str): The path of the .npz file.
+    """
+    ids, vectors, payloads, offset = [], [], [], None
+    while True:
+        points, offset = client.scroll(collection_name, limit=1024, offset=offset, with_payload=True, with_vectors=True)
+        for point in points:
+            ids.append(str(point.id))
+            vectors.append(point.vector)
+            payloads.append(json.dumps(point.payload))
+        if offset is None:
+            break
+    np.savez(path, ids=np.array(ids), vectors=np.array(vectors, dtype=np.float32), payloads=np.array(payloads))
+
+
+def ingest_local(config):
+    """
+    Runs load_qdrant_vector_db.main() on the snapshot pages and an in-memory Qdrant.
+
+    Args:
+        config (dict): The worker config (workdir, documents, collection_name, points_path).
+
+    Returns:
+        dict: The ingestion throughput.
+    """
+    os.chdir(config["workdir"])
+    with open("ga4_documents.json", "w") as f:
+        json.dump(config["documents"], f)
+    import load_qdrant_vector_db as loader
+
+    client = QdrantClient(":memory:")
+    loader.qdrant_client = client
+    start = time.perf_counter()
+    loader.main()
+    seconds = time.perf_counter() - start
+    result = _ingestion_result(client, config["collection_name"], seconds, len(config["documents"]))
+    export_points(client, config["collection_name"], config["points_path"])
+    return result
+
+
+def ingest_doc_extractor(config):
+    """
+    Runs the url_extractor endpoint of the doc extractor on the snapshot pages and an in-memory Qdrant.
+
+    The BigQuery query is replaced by the documents of the snapshot. The module needs the Google
+    Cloud libraries and default credentials at import time; without them the run is skipped.
+
+    Args:
+        config (dict): The worker config (workdir, documents, collection_name).
+
+    Returns:
+        dict: The ingestion throughput, or the reason the run was skipped.
+    """
+    os.chdir(config["workdir"])
+    try:
+        import url_extractor
+    except Exception as e:
+        return {"skipped": f"{type(e).__name__}: {e}"}
+    from flask import Flask
+
+    client = QdrantClient(":memory:")
+    url_extractor.qdrant_client = client
+    url_extractor.BQ_WATERMARK_COLUMN = None
+    url_extractor.extract_urls = lambda *args, **kwargs: iter([dict(item) for item in config["documents"]])
+    app = Flask(__name__)
+    with app.test_request_context("/url_extractor"):
+        start = time.perf_counter()
+        response, status = url_extractor.main()
+        seconds = time.perf_counter() - start
+    result = _ingestion_result(client, config["collection_name"], seconds, len(config["documents"]))
+    result["duplicates_removed"] = response.get_json().get("duplicates_removed")
+    return result
+
+
+def chain_turns(config):
+    """
+    Builds the questions of the chain benchmark from the subjects of the documents.
+
+    Every third turn is a follow-up with the previous turn in its chat history, so the
+    standalone-question rewrite also runs.
+
+    Args:
+        config (dict): The worker config (documents, turns, warmup).
+
+    Returns:
+        list: The inputs of each turn.
+    """
+    subjects = [item["subject"].replace("[GA4]", "").strip() for item in config["documents"]]
+    templates = ("What is {}?", "How do I configure {} in GA4?", "Explain {} with an example.")
+    turns = []
+    for index in range(config["warmup"] + config["turns"]):
+        subject = subjects[(index * 7) % len(subjects)]
+        question = templates[index % len(templates)].format(subject)
+        if index % 3 == 2:
+            history = [{"role": "user", "content": question}, {"role": "assistant", "content": f"{subject} is a GA4 feature."}]
+            turns.append({"input": "Can you give more details about it?", "chat_history": history})
+        else:
+            turns.append({"input": question, "chat_history": []})
+    return turns
+
+
+def _run_turn(rag_chain, inputs):
+    start = time.perf_counter()
+    first_token = None
+    for chunk in rag_chain.stream(inputs):
+        if chunk.get("answer") and first_token is None:
+            first_token = time.perf_counter() - start
+    return time.perf_counter() - start, first_token
+
+
+def chain_latency(config):
+    """
+    Streams turns through llm_models.chain (or speculative_chain) over an in-memory Qdrant with the ingested points.
+
+    The retriever is built like the app builds it: the query embedding cache, the scored Qdrant
+    store with the search params of the collection profile and, with HYBRID_SEARCH, the hybrid
+    retriever over the BM25 index of the collection. The warmup turns (which also build the BM25
+    index) are not measured.
+
+    Args:
+        config (dict): The worker config (points_path, collection_name, documents, turns, warmup,
+            concurrency, pipeline, search_type, search_kwargs).
+
+    Returns:
+        dict: The turn latency and time-to-first-token percentiles, and the stage summary of the chain tracer.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from qdrant_client.http.models import PointStruct
+    import llm_models
+    from envs import EMBEDDING_MODEL, HYBRID_SEARCH, HYBRID_K, HYBRID_IDENTIFIER_SHARE, HYBRID_LEXICAL_FLOOR, COLLECTION_PROFILE
+    from vector_store_client import ScoredQdrant, dense_search_kwargs
+    from query_embedding_cache import CachedQueryEmbeddings
+    from answer_cache import CollectionFingerprint
+    from hybrid_retriever import HybridRetriever, LexicalIndex
+    from chain_tracer import ChainTracer
+
+    # The collection is provisioned like the ingestion does it; the chain unit only reads its profile
+    sys.path.append(UNITS["ingest-doc-extractor"])
+    from collection_profile import provision_collection
+
+    collection_name = config["collection_name"]
+    client = QdrantClient(":memory:")
+    provision_collection(client, collection_name, EMBEDDING_MODEL, profile=COLLECTION_PROFILE)
+    points = np.load(config["points_path"])
+    client.upload_points(collection_name, [
+        PointStruct(id=point_id, vector=vector.tolist(), payload=json.loads(payload))
+        for point_id, vector, payload in zip(points["ids"], points["vectors"], points["payloads"])
+    ])
+    query_embeddings = CachedQueryEmbeddings(llm_models.embeddings, model=EMBEDDING_MODEL)
+    vectorstore = ScoredQdrant(client=client, collection_name=collection_name, embeddings=query_embeddings)
+    lexical_index = LexicalIndex(client, collection_name, CollectionFingerprint(client, collection_name))
+    search_type, search_kwargs = config["search_type"], config["search_kwargs"]
+
+    def build(tracer):
+        retriever = vectorstore.as_retriever(search_type=search_type, search_kwargs=dense_search_kwargs(search_kwargs))
+        if HYBRID_SEARCH:
+            retriever = HybridRetriever(
+                dense=retriever,
+                lexical_index=lexical_index,
+                search_type=search_type,
+                search_kwargs=search_kwargs,
+                k=search_kwargs.get("k", HYBRID_K),
+                identifier_share=HYBRID_IDENTIFIER_SHARE,
+                lexical_floor=HYBRID_LEXICAL_FLOOR,
+            )
+        factory = llm_models.speculative_chain if config["pipeline"] == "speculative" else llm_models.chain
+        extra = {"embeddings": query_embeddings} if config["pipeline"] == "speculative" else {}
+        return factory(retriever=retriever, llm=llm_models.llm, contextualize_q_system_prompt=llm_models.CONTEXTUALIZE_Q_SYSTEM_PROMPT,
+                       tracer=tracer, **extra)
+
+    turns = chain_turns(config)
+    warmup_chain = build(None)
+    for inputs in turns[:config["warmup"]]:
+        _run_turn(warmup_chain, inputs)
+    tracer = ChainTracer()
+    query_embeddings.tracer = tracer
+    hits, misses = query_embeddings.hits, query_embeddings.misses
+    rag_chain = build(tracer)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=config["concurrency"]) as executor:
+        timings = list(executor.map(lambda inputs: _run_turn(rag_chain, inputs), turns[config["warmup"]:]))
+    seconds = time.perf_counter() - start
+    return {
+        "pipeline": config["pipeline"],
+        "turns": len(timings),
+        "concurrency": config["concurrency"],
+        "chunks": len(points["ids"]),
+        "turns_per_second": round(len(timings) / seconds, 2) if seconds else None,
+        "turn_ms": percentiles([total for total, _ in timings]),
+        "first_token_ms": percentiles([first for _, first in timings if first is not None]),
+        "query_embedding_cache": {"hits": query_embeddings.hits - hits, "misses": query_embeddings.misses - misses},
+        "stages": tracer.summary(),
+    }
+
+
+WORKERS = {
+    "ingest-local": ingest_local,
+    "ingest-doc-extractor": ingest_doc_extractor,
+    "chain": chain_latency,
+}
+
+
+def main():
+    name, config_path, result_path = sys.argv[1:4]
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    sys.path.insert(0, UNITS[name])
+    install_offline_tokenizer()
+    with open(config_path) as f:
+        config = json.load(f)
+    result = WORKERS[name](config)
+    with open(result_path, "w") as f:
+        json.dump(result, f)
+
+
+if __name__ == "__main__":
+    main()
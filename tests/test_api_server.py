@@ -0,0 +1,246 @@
+import unittest
+import asyncio
+import json
+import os
+import socket
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "streamlit_app", "src"))
+
+
+def closed_port():
+    # A port nobody listens to, so no Qdrant is reached while the modules are imported
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return str(port)
+
+
+for name, value in (
+    ("OPENAI_API_KEY", "test"),
+    ("MODEL", "gpt-4o-mini"),
+    ("EMBEDDING_MODEL", "text-embedding-3-small"),
+    ("COLLECTION_NAME", "test"),
+    ("QDRANT_URL", "http://127.0.0.1"),
+    ("QDRANT_PORT", closed_port()),
+    ("QDRANT_API_KEY", "test"),
+):
+    os.environ.setdefault(name, value)
+
+from aiohttp.test_utils import AioHTTPTestCase
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from api_server import DEFAULT_SEARCH_KWARGS, DEFAULT_SEARCH_TYPE, SERVICE, RagService, create_app
+from chain_registry import ChainRegistry
+from query_embedding_cache import CachedQueryEmbeddings
+
+SOURCES = [
+    Document(page_content="Events are sent with gtag", metadata={"title": "Events", "source": "https://a"}),
+    Document(page_content="Tags are published", metadata={"title": "Tags", "source": "https://b"}),
+]
+
+
+class StubChain:
+    """
+    A RAG chain stand-in that answers every question the same way, after a delay, or fails while it streams.
+    """
+
+    def __init__(self, delay=0.0, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.inputs = []
+
+    async def ainvoke(self, inputs):
+        self.inputs.append(inputs)
+        await asyncio.sleep(self.delay)
+        return {"answer": "Use gtag.", "standalone_question": inputs["input"], "context": SOURCES}
+
+    async def astream(self, inputs):
+        self.inputs.append(inputs)
+        yield {"standalone_question": inputs["input"]}
+        yield {"context": SOURCES}
+        await asyncio.sleep(self.delay)
+        yield {"answer": "Use "}
+        if self.fail:
+            raise RuntimeError("generation failed")
+        yield {"answer": "gtag."}
+
+
+class ZeroEmbeddings(Embeddings):
+    """
+    An embeddings stand-in, never called by the stub chains.
+    """
+
+    def embed_documents(self, texts):
+        return [[0.0] for _ in texts]
+
+    def embed_query(self, text):
+        return [0.0]
+
+
+class StubService(RagService):
+    """
+    A RagService whose chains are StubChain instances, recording the configurations they are built for.
+    """
+
+    def __init__(self, rag_chain, concurrency=32, queue_timeout=5.0, timeout=60.0):
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self.rag_chain = rag_chain
+        self.configurations = []
+        self.embeddings = CachedQueryEmbeddings(ZeroEmbeddings(), model="test")
+        self.answer_cache = None
+        self.chains = ChainRegistry(self._build_chain)
+        self.in_flight = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self._slots = asyncio.Semaphore(concurrency)
+
+    def _build_chain(self, search_type, search_kwargs):
+        self.configurations.append((search_type, search_kwargs))
+        return self.rag_chain
+
+
+class TestApiServer(AioHTTPTestCase):
+    """
+    A class that contains unit tests for the routes of the RAG API, with aiohttp's test client and a stub service.
+    """
+
+    async def get_application(self):
+        app = create_app()
+        # The stub service replaces the one built from the OpenAI and Qdrant clients
+        app.cleanup_ctx.clear()
+        app[SERVICE] = StubService(StubChain())
+        return app
+
+    async def test_ask(self):
+        """
+        /ask returns the answer, the standalone question and the sources, with the default retriever configuration.
+        """
+        response = await self.client.post("/ask", json={"question": "How do I send events?", "chat_history": [{"role": "user", "content": "Hi"}]})
+        self.assertEqual(response.status, 200)
+        self.assertEqual(await response.json(), {
+            "answer": "Use gtag.",
+            "standalone_question": "How do I send events?",
+            "sources": [{"title": "Events", "source": "https://a"}, {"title": "Tags", "source": "https://b"}],
+        })
+        service = self.app[SERVICE]
+        self.assertEqual(service.configurations, [(DEFAULT_SEARCH_TYPE, DEFAULT_SEARCH_KWARGS)])
+        self.assertEqual(service.rag_chain.inputs, [{"input": "How do I send events?", "chat_history": [{"role": "user", "content": "Hi"}]}])
+
+    async def test_search_configuration(self):
+        """
+        The search type, the search kwargs and the normalized metadata filter select the chain.
+        """
+        body = {"question": "q", "search_type": "mmr", "search_kwargs": {"k": 3, "metadata_filter": {"tool": ["GTM", "GA4"]}}}
+        for _ in range(2):
+            self.assertEqual((await self.client.post("/ask", json=body)).status, 200)
+        self.assertEqual(self.app[SERVICE].configurations, [("mmr", {"k": 3, "metadata_filter": {"tool": ("GA4", "GTM")}})])
+        self.assertEqual(self.app[SERVICE].chains.stats()["hits"], 1)
+
+    async def test_invalid_requests(self):
+        """
+        Invalid bodies are rejected with a 400 before any chain is built.
+        """
+        bodies = [
+            {},
+            {"question": "  "},
+            {"question": "q", "chat_history": "Hi"},
+            {"question": "q", "search_type": "keyword"},
+            {"question": "q", "search_kwargs": [4]},
+            {"question": "q", "search_kwargs": {"k": [4]}},
+            {"question": "q", "search_kwargs": {"metadata_filter": {"author": "x"}}},
+            {"question": "q", "search_kwargs": {"metadata_filter": "GA4"}},
+        ]
+        for body in bodies:
+            response = await self.client.post("/ask", json=body)
+            self.assertEqual(response.status, 400, body)
+        response = await self.client.post("/ask", data="not json", headers={"Content-Type": "application/json"})
+        self.assertEqual(response.status, 400)
+        self.assertEqual(self.app[SERVICE].configurations, [])
+
+    async def test_ask_stream(self):
+        """
+        /ask/stream sends the standalone question, the sources and the answer tokens as newline-delimited JSON.
+        """
+        response = await self.client.post("/ask/stream", json={"question": "How do I send events?"})
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.headers["Content-Type"], "application/x-ndjson")
+        events = [json.loads(line) for line in (await response.text()).splitlines()]
+        self.assertEqual(events, [
+            {"standalone_question": "How do I send events?"},
+            {"context": [{"title": "Events", "source": "https://a"}, {"title": "Tags", "source": "https://b"}]},
+            {"answer": "Use "},
+            {"answer": "gtag."},
+        ])
+
+    async def test_stream_errors_end_the_stream(self):
+        """
+        A turn that fails after the stream started ends with an error event.
+        """
+        self.app[SERVICE].rag_chain.fail = True
+        response = await self.client.post("/ask/stream", json={"question": "q"})
+        events = [json.loads(line) for line in (await response.text()).splitlines()]
+        self.assertEqual(events[-2:], [{"answer": "Use "}, {"error": "generation failed"}])
+
+    async def test_health(self):
+        """
+        /health returns the counters of the service and of its caches.
+        """
+        await self.client.post("/ask", json={"question": "q"})
+        body = await (await self.client.get("/health")).json()
+        self.assertEqual(body["status"], "ok")
+        self.assertEqual((body["in_flight"], body["rejected"], body["timeouts"]), (0, 0, 0))
+        self.assertEqual(body["chains"]["chains"], 1)
+        self.assertIsNone(body["answer_cache"])
+
+    async def test_metrics(self):
+        """
+        /metrics returns the counters of the service in the Prometheus text format.
+        """
+        response = await self.client.get("/metrics")
+        self.assertEqual(response.content_type, "text/plain")
+        lines = (await response.text()).splitlines()
+        for name, kind in (("rag_api_in_flight", "gauge"), ("rag_api_rejected_total", "counter"), ("rag_api_timeouts_total", "counter")):
+            self.assertIn(f"# TYPE {name} {kind}", lines)
+            self.assertIn(f"{name} 0", lines)
+
+
+class TestApiServerLimits(AioHTTPTestCase):
+    """
+    A class that contains unit tests for the concurrency limit and the timeout of the RAG API.
+    """
+
+    async def get_application(self):
+        app = create_app()
+        app.cleanup_ctx.clear()
+        app[SERVICE] = StubService(StubChain(delay=0.5), concurrency=1, queue_timeout=0.05, timeout=0.2)
+        return app
+
+    async def test_slow_turns_time_out(self):
+        """
+        A turn longer than the timeout is cancelled with a 504, and a streamed one ends with an error event.
+        """
+        response = await self.client.post("/ask", json={"question": "q"})
+        self.assertEqual(response.status, 504)
+        response = await self.client.post("/ask/stream", json={"question": "q"})
+        self.assertEqual(json.loads((await response.text()).splitlines()[-1]), {"error": "The answer took longer than 0.2s"})
+        self.assertEqual(self.app[SERVICE].timeouts, 2)
+
+    async def test_busy_service_rejects_requests(self):
+        """
+        A request that finds every slot busy for longer than the queue timeout gets a 503 with Retry-After.
+        """
+        first = asyncio.ensure_future(self.client.post("/ask", json={"question": "first"}))
+        while self.app[SERVICE].in_flight == 0:
+            await asyncio.sleep(0.01)
+        response = await self.client.post("/ask", json={"question": "second"})
+        self.assertEqual(response.status, 503)
+        self.assertEqual(response.headers["Retry-After"], "1")
+        self.assertEqual((await first).status, 504)
+        self.assertEqual(self.app[SERVICE].rejected, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,269 @@
+import unittest
+import asyncio
+import os
+import socket
+import sys
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "streamlit_app", "src"))
+
+from langchain_core.embeddings import Embeddings
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import Distance, PointStruct, VectorParams
+from answer_cache import CollectionFingerprint, SemanticAnswerCache
+import query_embedding_cache
+from query_embedding_cache import CachedQueryEmbeddings, normalize_query
+
+VECTORS = {
+    "how do I create an event": [1.0, 0.0, 0.0],
+    "how can I create an event": [0.99, 0.14, 0.0],
+    "what is a session": [0.0, 1.0, 0.0],
+    "how do I publish a tag": [0.0, 0.0, 1.0],
+}
+
+
+class DictEmbeddings(Embeddings):
+    """
+    An embeddings stand-in with fixed vectors, which counts the texts it embeds.
+    """
+
+    def __init__(self, vectors=VECTORS):
+        self.vectors = vectors
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        self.embedded.append(text)
+        return self.vectors[text]
+
+
+class RecordingTracer:
+    """
+    A ChainTracer stand-in that records the embedding observations.
+    """
+
+    def __init__(self):
+        self.cached = []
+
+    def observe_embedding(self, seconds, cached):
+        self.cached.append(cached)
+
+
+def closed_port_redis_url():
+    # A Redis URL on a port nobody listens to
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return f"redis://127.0.0.1:{port}/0"
+
+
+class StaticFingerprint:
+    """
+    A CollectionFingerprint stand-in whose value is set by the test.
+    """
+
+    def __init__(self, value="v1"):
+        self.value = value
+
+    def current(self):
+        return self.value
+
+
+class TestSemanticAnswerCache(unittest.TestCase):
+    """
+    A class that contains unit tests for the semantic answer cache.
+    """
+
+    def setUp(self):
+        self.fingerprint = StaticFingerprint()
+        self.cache = SemanticAnswerCache(DictEmbeddings(), threshold=0.95, ttl_seconds=60, max_size=2, fingerprint=self.fingerprint)
+
+    def store(self, question, answer, namespace=""):
+        _, vector = self.cache.lookup(question, namespace)
+        self.cache.store(question, namespace, vector, answer, [], 1.5)
+
+    def answer(self, question, namespace=""):
+        entry, _ = self.cache.lookup(question, namespace)
+        return entry.answer if entry else None
+
+    def test_similar_questions_hit(self):
+        """
+        A question close enough to a stored one gets its answer, in the same namespace only.
+        """
+        self.store("how do I create an event", "With gtag")
+        self.assertEqual(self.answer("how can I create an event"), "With gtag")
+        self.assertIsNone(self.answer("what is a session"))
+        self.assertIsNone(self.answer("how can I create an event", namespace="hybrid"))
+        self.assertEqual(self.cache.stats(), {"entries": 1, "hits": 1, "misses": 3, "hit_rate": 0.25, "saved_seconds": 1.5})
+
+    def test_empty_answers_are_not_stored(self):
+        """
+        An empty answer is not cached.
+        """
+        self.store("how do I create an event", "")
+        self.assertEqual(self.cache.stats()["entries"], 0)
+
+    def test_expired_entries_are_dropped(self):
+        """
+        An expired entry is not returned, and does not hide a live entry that also matches.
+        """
+        self.store("how can I create an event", "Live answer")
+        self.store("how do I create an event", "Old answer")
+        entry, _ = self.cache.lookup("how do I create an event")
+        self.assertEqual(entry.answer, "Old answer")
+        entry.created_at -= 60
+        self.assertEqual(self.answer("how do I create an event"), "Live answer")
+        self.assertEqual(self.cache.stats()["entries"], 1)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        """
+        Beyond max_size, the entry used least recently is evicted.
+        """
+        self.store("how do I create an event", "Events")
+        self.store("what is a session", "Sessions")
+        self.assertEqual(self.answer("how do I create an event"), "Events")
+        self.store("how do I publish a tag", "Tags")
+        self.assertEqual(self.answer("how do I create an event"), "Events")
+        self.assertIsNone(self.answer("what is a session"))
+        self.assertEqual(self.answer("how do I publish a tag"), "Tags")
+
+    def test_fingerprint_change_clears_the_cache(self):
+        """
+        A change of the collection fingerprint invalidates every cached answer.
+        """
+        self.store("how do I create an event", "Events")
+        self.fingerprint.value = "v2"
+        self.assertIsNone(self.answer("how do I create an event"))
+        self.store("how do I create an event", "New events")
+        self.assertEqual(self.answer("how do I create an event"), "New events")
+
+    def test_recorder_stores_the_streamed_answer(self):
+        """
+        The recorder passes the chunks through and stores the concatenated answer and the context.
+        """
+        _, vector = self.cache.lookup("what is a session")
+        chunks = [{"context": ["doc"]}, {"answer": "A session "}, {"answer": "is a visit"}]
+        self.assertEqual(list(self.cache.recorder("what is a session", vector).transform(iter(chunks))), chunks)
+        entry, _ = self.cache.lookup("what is a session")
+        self.assertEqual((entry.answer, entry.documents), ("A session is a visit", ["doc"]))
+
+
+class TestCollectionFingerprint(unittest.TestCase):
+    """
+    A class that contains unit tests for the fingerprint of the point ids of a collection, on an in-memory Qdrant collection.
+    """
+
+    def setUp(self):
+        self.client = QdrantClient(":memory:")
+        self.client.create_collection("test", vectors_config=VectorParams(size=2, distance=Distance.COSINE))
+        self.client.upsert("test", [PointStruct(id=1, vector=[1.0, 0.0])])
+
+    def test_fingerprint_follows_the_point_ids(self):
+        """
+        The fingerprint changes when a point is added, and not when a point is only updated.
+        """
+        fingerprint = CollectionFingerprint(self.client, "test", refresh_seconds=0)
+        first = fingerprint.current()
+        self.client.upsert("test", [PointStruct(id=1, vector=[0.0, 1.0])])
+        self.assertEqual(fingerprint.current(), first)
+        self.client.upsert("test", [PointStruct(id=2, vector=[1.0, 0.0])])
+        self.assertNotEqual(fingerprint.current(), first)
+
+    def test_fingerprint_is_refreshed_after_refresh_seconds(self):
+        """
+        Within refresh_seconds the previous fingerprint is returned without scanning the collection.
+        """
+        fingerprint = CollectionFingerprint(self.client, "test", refresh_seconds=3600)
+        first = fingerprint.current()
+        self.client.upsert("test", [PointStruct(id=2, vector=[1.0, 0.0])])
+        self.assertEqual(fingerprint.current(), first)
+
+    def test_scan_errors_keep_the_previous_fingerprint(self):
+        """
+        If the collection cannot be scanned, the last fingerprint is kept.
+        """
+        fingerprint = CollectionFingerprint(self.client, "test", refresh_seconds=0)
+        first = fingerprint.current()
+        self.client.delete_collection("test")
+        self.assertEqual(fingerprint.current(), first)
+        self.assertIsNone(CollectionFingerprint(self.client, "missing").current())
+
+
+
+class TestCachedQueryEmbeddings(unittest.TestCase):
+    """
+    A class that contains unit tests for the in-memory LRU of query embeddings, without a Redis store.
+    """
+
+    def setUp(self):
+        self.embeddings = DictEmbeddings()
+        self.tracer = RecordingTracer()
+        self.cache = CachedQueryEmbeddings(self.embeddings, "model", max_size=2, tracer=self.tracer)
+
+    def test_repeated_queries_are_embedded_once(self):
+        """
+        A query is embedded once, whatever its whitespace, and the hits and misses are counted and traced.
+        """
+        self.assertEqual(normalize_query("  what is\n a   session "), "what is a session")
+        self.assertEqual(self.cache.embed_query("what is a session"), VECTORS["what is a session"])
+        self.embeddings.vectors = {**VECTORS, " what is  a session": VECTORS["what is a session"]}
+        self.assertEqual(self.cache.embed_query(" what is  a session"), VECTORS["what is a session"])
+        self.assertEqual(self.embeddings.embedded, ["what is a session"])
+        stats = self.cache.stats()
+        self.assertEqual({key: stats[key] for key in ("vectors", "hits", "shared_hits", "misses", "hit_rate")},
+                         {"vectors": 1, "hits": 1, "shared_hits": 0, "misses": 1, "hit_rate": 0.5})
+        self.assertEqual(self.tracer.cached, [False, True])
+
+    def test_least_recently_used_query_is_evicted(self):
+        """
+        Beyond max_size, the query used least recently is evicted and embedded again.
+        """
+        for question in ("what is a session", "how do I publish a tag", "what is a session", "how do I create an event", "what is a session", "how do I publish a tag"):
+            self.cache.embed_query(question)
+        self.assertEqual(self.embeddings.embedded, ["what is a session", "how do I publish a tag", "how do I create an event", "how do I publish a tag"])
+        self.assertEqual(self.cache.stats()["vectors"], 2)
+
+    def test_async_queries_share_the_cache(self):
+        """
+        aembed_query uses the same LRU as embed_query.
+        """
+        self.cache.embed_query("what is a session")
+        self.assertEqual(asyncio.run(self.cache.aembed_query("what is a session")), VECTORS["what is a session"])
+        self.assertEqual(asyncio.run(self.cache.aembed_query("how do I publish a tag")), VECTORS["how do I publish a tag"])
+        self.assertEqual(self.embeddings.embedded, ["what is a session", "how do I publish a tag"])
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 2))
+
+    def test_documents_are_passed_through(self):
+        """
+        Document embeddings are not cached.
+        """
+        self.cache.embed_documents(["what is a session", "what is a session"])
+        self.assertEqual(self.embeddings.embedded, ["what is a session", "what is a session"])
+        self.assertEqual(self.cache.stats()["vectors"], 0)
+
+    def test_without_the_redis_package(self):
+        """
+        A Redis URL without the redis package leaves the in-memory cache working.
+        """
+        with mock.patch.object(query_embedding_cache, "redis", None):
+            cache = CachedQueryEmbeddings(self.embeddings, "model", redis_url="redis://localhost:6379/0")
+        cache.embed_query("what is a session")
+        cache.embed_query("what is a session")
+        self.assertEqual((cache.hits, cache.shared_hits, cache.misses), (1, 0, 1))
+
+    @unittest.skipIf(query_embedding_cache.redis is None, "redis is not installed")
+    def test_unreachable_redis(self):
+        """
+        An unreachable Redis store only logs a warning, and the queries are served by the client and the LRU.
+        """
+        cache = CachedQueryEmbeddings(self.embeddings, "model", redis_url=closed_port_redis_url())
+        with self.assertLogs(level="WARNING"):
+            self.assertEqual(cache.embed_query("what is a session"), VECTORS["what is a session"])
+        self.assertEqual(cache.embed_query("what is a session"), VECTORS["what is a session"])
+        self.assertEqual((cache.hits, cache.shared_hits, cache.misses), (1, 0, 1))
+
+if __name__ == "__main__":
+    unittest.main()
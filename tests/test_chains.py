@@ -0,0 +1,274 @@
+import unittest
+import os
+import sys
+import threading
+import uuid
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "streamlit_app", "src"))
+
+from langchain_core.documents import Document
+from langchain_core.outputs import LLMResult
+import chain_tracer
+from chain_registry import ChainRegistry
+from chain_tracer import ChainTracer, Histogram
+
+
+class RecordingFactory:
+    """
+    A chain factory stand-in that returns a new object per call and records the configurations it builds.
+    """
+
+    def __init__(self):
+        self.built = []
+        self.lock = threading.Lock()
+
+    def __call__(self, search_type, search_kwargs):
+        with self.lock:
+            self.built.append((search_type, search_kwargs))
+        return object()
+
+
+class FakeClock:
+    """
+    A perf_counter stand-in whose time is moved by the test.
+    """
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestChainRegistry(unittest.TestCase):
+    """
+    A class that contains unit tests for the registry of RAG chains.
+    """
+
+    def setUp(self):
+        self.factory = RecordingFactory()
+        self.registry = ChainRegistry(self.factory, max_size=2)
+
+    def test_same_configuration_reuses_the_chain(self):
+        """
+        Equal configurations, whatever the order of their nested kwargs, share a chain; other ones get their own.
+        """
+        first = self.registry.get("similarity", {"k": 4, "filter": {"tool": ["GA4"], "type": ["guide"]}})
+        second = self.registry.get("similarity", {"filter": {"type": ["guide"], "tool": ["GA4"]}, "k": 4})
+        self.assertIs(first, second)
+        self.assertIsNot(self.registry.get("similarity", {"k": 8}), first)
+        self.assertIsNot(self.registry.get("mmr", {"k": 4, "filter": {"tool": ["GA4"], "type": ["guide"]}}), first)
+        self.assertEqual(len(self.factory.built), 3)
+        self.assertEqual({key: self.registry.stats()[key] for key in ("hits", "misses", "hit_rate")}, {"hits": 1, "misses": 3, "hit_rate": 0.25})
+
+    def test_factory_gets_a_copy_of_the_kwargs(self):
+        """
+        The factory cannot change the kwargs of the caller.
+        """
+        search_kwargs = {"k": 4}
+        self.registry.get("similarity", search_kwargs)
+        self.assertEqual(self.factory.built, [("similarity", {"k": 4})])
+        self.assertIsNot(self.factory.built[0][1], search_kwargs)
+
+    def test_least_recently_used_chain_is_evicted(self):
+        """
+        Beyond max_size the least recently used chain is evicted and built again on its next lookup.
+        """
+        first = self.registry.get("similarity", {"k": 1})
+        self.registry.get("similarity", {"k": 2})
+        self.assertIs(self.registry.get("similarity", {"k": 1}), first)
+        self.registry.get("similarity", {"k": 3})
+        self.assertIs(self.registry.get("similarity", {"k": 1}), first)
+        self.registry.get("similarity", {"k": 2})
+        self.assertEqual([kwargs["k"] for _, kwargs in self.factory.built], [1, 2, 3, 2])
+        self.assertEqual(self.registry.stats()["evictions"], 2)
+
+    def test_warm_builds_without_counting_a_lookup(self):
+        """
+        A warmed configuration is built once and its first lookup is a hit.
+        """
+        self.registry.warm("similarity", {"k": 4})
+        self.registry.warm("similarity", {"k": 4})
+        self.assertEqual(self.registry.stats()["misses"], 0)
+        self.registry.get("similarity", {"k": 4})
+        self.assertEqual(len(self.factory.built), 1)
+        self.assertEqual(self.registry.stats()["hits"], 1)
+
+    def test_failed_build_is_retried(self):
+        """
+        A factory error reaches the caller, and the next lookup builds the chain again.
+        """
+        calls = []
+
+        def factory(search_type, search_kwargs):
+            calls.append(search_type)
+            if len(calls) == 1:
+                raise RuntimeError("build failed")
+            return "chain"
+
+        registry = ChainRegistry(factory)
+        with self.assertRaises(RuntimeError):
+            registry.get("similarity", {})
+        self.assertEqual(registry.get("similarity", {}), "chain")
+        self.assertEqual(len(calls), 2)
+
+    def test_builds_do_not_block_other_configurations(self):
+        """
+        While a chain is being built, the lookups of the same configuration wait for it and the other configurations are served.
+        """
+        release = threading.Event()
+        started = threading.Event()
+        built = []
+
+        def factory(search_type, search_kwargs):
+            built.append(search_type)
+            if search_type == "slow":
+                started.set()
+                self.assertTrue(release.wait(5))
+            return f"{search_type} chain"
+
+        registry = ChainRegistry(factory)
+        registry.warm("fast", {})
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(registry.get("slow", {}))) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        self.assertTrue(started.wait(5))
+        self.assertEqual(registry.get("fast", {}), "fast chain")
+        self.assertEqual(registry.get("other", {}), "other chain")
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(results, ["slow chain"] * 3)
+        self.assertEqual(built.count("slow"), 1)
+        self.assertEqual({key: registry.stats()[key] for key in ("hits", "misses")}, {"hits": 3, "misses": 2})
+
+
+class TestChainTracer(unittest.TestCase):
+    """
+    A class that contains unit tests for the histograms of the chain tracer and their Prometheus text format, with a fake clock.
+    """
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(chain_tracer, "time", SimpleNamespace(perf_counter=self.clock))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.tracer = ChainTracer()
+
+    def test_histogram_layout(self):
+        """
+        A histogram renders its cumulative buckets, ending with +Inf, then its sum and count.
+        """
+        self.tracer.observe_embedding(0.002, cached=True)
+        self.tracer.observe_embedding(0.04, cached=False)
+        self.tracer.observe_embedding(0.04, cached=True)
+        bounds = ("0.001", "0.0025", "0.005", "0.01", "0.025", "0.05", "0.1", "0.25", "0.5", "1.0", "2.5", "5.0", "10.0", "30.0", "+Inf")
+        counts = (0, 1, 1, 1, 1, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3)
+        self.assertEqual(self.tracer.render(), "\n".join(
+            ["# TYPE rag_stage_seconds histogram"]
+            + [f'rag_stage_seconds_bucket{{stage="embed_query",le="{bound}"}} {count}' for bound, count in zip(bounds, counts)]
+            + ['rag_stage_seconds_sum{stage="embed_query"} 0.082', 'rag_stage_seconds_count{stage="embed_query"} 3',
+               "# TYPE rag_query_embeddings_total counter",
+               'rag_query_embeddings_total{cache="hit"} 2', 'rag_query_embeddings_total{cache="miss"} 1']
+        ) + "\n")
+
+    def test_each_metric_is_typed_once(self):
+        """
+        The series of a metric share one TYPE line, metrics without labels have no braces, and the prefix names every metric.
+        """
+        tracer = ChainTracer(prefix="docs")
+        tracer._observe("retrieved_documents", (), 2, chain_tracer.COUNT_BUCKETS)
+        for stage in ("answer", "rag_turn"):
+            tracer._observe("stage_seconds", (("stage", stage),), 0.5)
+        lines = tracer.render().splitlines()
+        self.assertEqual([line for line in lines if line.startswith("#")],
+                         ["# TYPE docs_retrieved_documents histogram", "# TYPE docs_stage_seconds histogram"])
+        self.assertIn('docs_retrieved_documents_bucket{le="0"} 0', lines)
+        self.assertIn('docs_retrieved_documents_bucket{le="2"} 1', lines)
+        self.assertIn("docs_retrieved_documents_sum 2.0", lines)
+        self.assertIn("docs_retrieved_documents_count 1", lines)
+        self.assertEqual(len([line for line in lines if line.startswith("docs_stage_seconds_count")]), 2)
+        self.assertTrue(all(line.startswith(("# TYPE docs_", "docs_")) for line in lines))
+
+    def test_retrieval_without_embedding_time(self):
+        """
+        The search time of a retrieval excludes its query embedding, and the documents and their scores are counted.
+        """
+        run_id = uuid.uuid4()
+        self.tracer.on_retriever_start({}, "q", run_id=run_id)
+        self.tracer.on_retriever_start({}, "q", run_id=uuid.uuid4(), parent_run_id=run_id)
+        self.tracer.observe_embedding(0.25, cached=False)
+        self.clock.now += 0.75
+        documents = [Document(page_content="a", metadata={"_score": 0.85}), Document(page_content="b", metadata={})]
+        self.tracer.on_retriever_end(documents, run_id=run_id)
+        lines = self.tracer.render().splitlines()
+        self.assertIn('rag_stage_seconds_sum{stage="retrieval"} 0.75', lines)
+        self.assertIn('rag_stage_seconds_sum{stage="search"} 0.5', lines)
+        self.assertIn('rag_retrieved_documents_bucket{le="2"} 1', lines)
+        self.assertIn('rag_retrieval_score_bucket{le="0.8"} 0', lines)
+        self.assertIn('rag_retrieval_score_bucket{le="0.9"} 1', lines)
+        self.assertIn("rag_retrieval_score_count 1", lines)
+        self.assertEqual(self.tracer._runs, {})
+
+    def test_llm_calls_and_tokens(self):
+        """
+        The LLM calls are labelled with their stage, and count the tokens reported by the API or, without them, the streamed chunks.
+        """
+        streamed, invoked = uuid.uuid4(), uuid.uuid4()
+        self.tracer.on_chat_model_start({}, [], run_id=streamed, metadata={"stage": "answer"})
+        self.clock.now += 0.25
+        for token in ("Use ", "gtag", "."):
+            self.tracer.on_llm_new_token(token, run_id=streamed)
+        self.clock.now += 0.25
+        self.tracer.on_llm_end(LLMResult(generations=[[]]), run_id=streamed)
+        self.tracer.on_llm_start({}, ["q"], run_id=invoked, metadata={"stage": "contextualize_question"})
+        self.clock.now += 1.0
+        self.tracer.on_llm_end(LLMResult(generations=[[]], llm_output={"token_usage": {"prompt_tokens": 40, "completion_tokens": 8}}), run_id=invoked)
+        lines = self.tracer.render().splitlines()
+        self.assertIn('rag_llm_first_token_seconds_sum{stage="answer"} 0.25', lines)
+        self.assertIn('rag_llm_seconds_sum{stage="answer"} 0.5', lines)
+        self.assertIn('rag_llm_seconds_sum{stage="contextualize_question"} 1.0', lines)
+        self.assertIn("# TYPE rag_llm_tokens_total counter", lines)
+        self.assertIn('rag_llm_tokens_total{stage="answer",kind="completion"} 3', lines)
+        self.assertIn('rag_llm_tokens_total{stage="contextualize_question",kind="prompt"} 40', lines)
+        self.assertIn('rag_llm_tokens_total{stage="contextualize_question",kind="completion"} 8', lines)
+        self.assertFalse([line for line in lines if line.startswith('rag_llm_tokens_total{stage="answer",kind="prompt"}')])
+
+    def test_stages_and_errors(self):
+        """
+        Only the runs named as stages are timed, and a failed stage is counted as an error instead.
+        """
+        answer, failed, other = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+        self.tracer.on_chain_start({}, {}, run_id=answer, name="answer")
+        self.tracer.on_chain_start({}, {}, run_id=failed, name="context_packing")
+        self.tracer.on_chain_start({}, {}, run_id=other, name="RunnableSequence")
+        self.clock.now += 2.0
+        self.tracer.on_chain_end({}, run_id=answer)
+        self.tracer.on_chain_error(RuntimeError("failed"), run_id=failed)
+        self.tracer.on_chain_end({}, run_id=other)
+        lines = self.tracer.render().splitlines()
+        self.assertIn('rag_stage_seconds_bucket{stage="answer",le="1.0"} 0', lines)
+        self.assertIn('rag_stage_seconds_bucket{stage="answer",le="2.5"} 1', lines)
+        self.assertIn('rag_stage_errors_total{stage="context_packing"} 1', lines)
+        self.assertFalse([line for line in lines if "RunnableSequence" in line or 'stage_seconds_count{stage="context_packing"}' in line])
+
+    def test_summary_quantiles(self):
+        """
+        The summary estimates the quantiles by interpolating inside the buckets, in milliseconds.
+        """
+        histogram = Histogram((1.0, 2.0, 4.0))
+        for value in (0.5, 1.5, 1.5, 3.0):
+            histogram.observe(value)
+        self.assertEqual(histogram.quantile(0.5), 1.5)
+        self.assertEqual(histogram.quantile(1.0), 4.0)
+        self.assertIsNone(Histogram((1.0,)).quantile(0.5))
+        for seconds in (0.2, 0.4):
+            self.tracer._observe("stage_seconds", (("stage", "answer"),), seconds)
+        self.assertEqual(self.tracer.summary(), {"answer": {"count": 2, "mean_ms": 300.0, "p50_ms": 250.0, "p95_ms": 475.0}})
+
+
+if __name__ == "__main__":
+    unittest.main()
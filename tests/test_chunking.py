@@ -0,0 +1,139 @@
+import unittest
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts", "doc_extractor"))
+
+from langchain_core.documents import Document
+from chunking import FastTextSplitter
+
+
+def sample_text(seed, size=5000):
+    """
+    Builds a deterministic text with paragraphs, lines, long words and multi-byte characters.
+    """
+    generator = random.Random(seed)
+    words = ["análise", "evento", "session_start", "página", "métrica", "a", "de", "dados", "x" * 120, "日本語テキスト", "🙂"]
+    parts = []
+    while sum(map(len, parts)) < size:
+        parts.append(generator.choice(words))
+        parts.append(generator.choice([" ", " ", " ", "  ", "\n", "\n\n", "\t "]))
+    return "".join(parts)
+
+
+def byte_level_encoding():
+    """
+    Returns a tokenizer with one token per byte, so token cuts can fall inside multi-byte characters.
+    """
+    import tiktoken
+
+    return tiktoken.Encoding(
+        "byte_level",
+        pat_str=r"\S+|\s+",
+        mergeable_ranks={bytes([byte]): byte for byte in range(256)},
+        special_tokens={},
+    )
+
+
+class TestFastTextSplitter(unittest.TestCase):
+    """
+    A class that contains unit tests for the FastTextSplitter.
+    """
+
+    def assert_slices(self, splitter, text):
+        chunks = splitter.create_documents([text])
+        self.assertTrue(chunks)
+        for chunk in chunks:
+            start = chunk.metadata["start_index"]
+            self.assertEqual(text[start:start + len(chunk.page_content)], chunk.page_content)
+
+    def test_chunks_are_slices_of_the_text(self):
+        """
+        Every chunk is text[start:start + len(chunk)] and fits in chunk_size, in characters.
+        """
+        for seed in range(20):
+            text = sample_text(seed)
+            splitter = FastTextSplitter(chunk_size=200, chunk_overlap=40, add_start_index=True)
+            self.assert_slices(splitter, text)
+            self.assertTrue(all(len(chunk) <= 200 for chunk in splitter.split_text(text)))
+
+    def test_token_chunks_are_slices_of_the_text(self):
+        """
+        Every chunk is a slice of the text when measured in tokens, even if a cut falls inside a multi-byte character.
+        """
+        for seed in range(10):
+            splitter = FastTextSplitter(chunk_size=50, chunk_overlap=10, add_start_index=True)
+            splitter._encoding = byte_level_encoding()
+            self.assert_slices(splitter, sample_text(seed, size=2000))
+
+    def test_short_and_blank_texts(self):
+        """
+        A text that fits is a single chunk and a blank text gives no chunk.
+        """
+        splitter = FastTextSplitter(chunk_size=100, chunk_overlap=10)
+        self.assertEqual(splitter.split_text("  short text \n"), ["short text"])
+        self.assertEqual(splitter.split_text(" \n\n \t"), [])
+
+    def test_overlap(self):
+        """
+        Consecutive chunks share at most chunk_overlap characters of words.
+        """
+        text = " ".join(f"w{index:03d}" for index in range(200))
+        chunks = FastTextSplitter(chunk_size=100, chunk_overlap=30).split_text(text)
+        for previous, current in zip(chunks, chunks[1:]):
+            shared = set(previous.split()) & set(current.split())
+            self.assertTrue(shared)
+            self.assertLessEqual(len(" ".join(sorted(shared))), 30)
+
+    def test_split_documents_keeps_metadata(self):
+        """
+        The chunks of a document get a copy of its metadata.
+        """
+        document = Document(page_content=sample_text(1), metadata={"source": "https://example.com", "tags": ["a"]})
+        chunks = FastTextSplitter(chunk_size=300, chunk_overlap=50).split_documents([document])
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks:
+            self.assertEqual(chunk.metadata, document.metadata)
+        chunks[0].metadata["tags"].append("b")
+        self.assertEqual(document.metadata["tags"], ["a"])
+
+    def test_stream_chunks_are_slices_of_the_whole_text(self):
+        """
+        The chunks of a stream of segments have their start_index in the whole text, whatever the segment size.
+        """
+        for seed in range(5):
+            text = sample_text(seed, size=20000)
+            splitter = FastTextSplitter(chunk_size=300, chunk_overlap=60, add_start_index=True)
+            for size in (1, 97, 4096, len(text)):
+                chunks = list(splitter.split_stream((text[start:start + size] for start in range(0, len(text), size)), {"source": "a"}))
+                self.assertGreater(len(chunks), 1)
+                for chunk in chunks:
+                    start = chunk.metadata["start_index"]
+                    self.assertEqual(text[start:start + len(chunk.page_content)], chunk.page_content)
+                    self.assertEqual(chunk.metadata["source"], "a")
+                starts = [chunk.metadata["start_index"] for chunk in chunks]
+                self.assertEqual(starts, sorted(starts))
+
+    def test_stream_skips_blank_segments(self):
+        """
+        Blank stretches of a stream give no chunk and do not shift the positions of the next chunks.
+        """
+        segments = [" " * 1000, "\n" * 1000, "first words", " " * 1000, "last words"]
+        chunks = list(FastTextSplitter(chunk_size=100, chunk_overlap=10, add_start_index=True).split_stream(segments))
+        text = "".join(segments)
+        self.assertEqual([chunk.page_content for chunk in chunks], ["first words", "last words"])
+        self.assertEqual([chunk.metadata["start_index"] for chunk in chunks], [text.index("first"), text.index("last")])
+
+    def test_invalid_arguments(self):
+        """
+        The overlap must be smaller than the chunk size and the length unit must be known.
+        """
+        with self.assertRaises(ValueError):
+            FastTextSplitter(chunk_size=10, chunk_overlap=10)
+        with self.assertRaises(ValueError):
+            FastTextSplitter(chunk_size=10, chunk_overlap=1, length_unit="words")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,215 @@
+import unittest
+import json
+import os
+import sys
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "cloud_function"))
+
+try:
+    import functions_framework
+    from google.cloud import firestore
+except ImportError:
+    main = None
+else:
+    # The Firestore client of the module is replaced, so no credentials or emulator are needed
+    with mock.patch.object(firestore, "Client"):
+        import main
+
+
+class FakeBatch:
+    """
+    A batched write stand-in that records its documents and commits them to the fake client.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.documents = []
+
+    def set(self, reference, document):
+        self.documents.append((reference, document))
+
+    def commit(self):
+        if self.client.fail:
+            raise RuntimeError("commit failed")
+        self.client.commits.append([reference for reference, _ in self.documents])
+        self.client.stored.update(self.documents)
+
+
+class FakeBulkWriter(FakeBatch):
+    """
+    A BulkWriter stand-in, committed when it is closed.
+    """
+
+    def close(self):
+        self.commit()
+
+
+class FakeFirestore:
+    """
+    A Firestore client stand-in whose document references are their paths.
+    """
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.commits = []
+        self.bulk_writers = 0
+        self.stored = {}
+
+    def document(self, path):
+        return path
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def bulk_writer(self):
+        self.bulk_writers += 1
+        return FakeBulkWriter(self)
+
+
+class FakeRequest:
+    """
+    A flask.Request stand-in with a method and a JSON body.
+    """
+
+    def __init__(self, method, body=None):
+        self.method = method
+        self.body = body
+
+    def get_json(self, silent=False):
+        return self.body
+
+
+def interaction(email, index, timestamp=None):
+    prompt_data = {"question": f"question {index}", "answer": f"answer {index}"}
+    if timestamp is not None:
+        prompt_data["timestamp"] = timestamp
+    return {"prompt_data": prompt_data, "user_info": {"email": email, "displayName": "Test", "uid": "test"}}
+
+
+@unittest.skipIf(main is None, "functions-framework or google-cloud-firestore is not installed")
+class TestCloudFunction(unittest.TestCase):
+    """
+    A class that contains unit tests for the interaction logging cloud function, with a fake Firestore client.
+    """
+
+    def setUp(self):
+        self.client = FakeFirestore()
+        patcher = mock.patch.dict(main.write_stats, {"batch": main.WriteStats(), "bulk": main.WriteStats()})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_single_interaction(self):
+        """
+        A single {prompt_data, user_info} object is one document, under the user and its UTC timestamp.
+        """
+        documents = main.parse_interactions(interaction("a@test.com", 0, "2024-01-01T00:00:00Z"))
+        self.assertEqual(len(documents), 1)
+        doc_path, document = documents[0]
+        self.assertEqual(doc_path, "users/a@test.com/interactions/2024-01-01T00:00:00+00:00")
+        self.assertEqual(document["prompt_data"]["timestamp"], "2024-01-01T00:00:00+00:00")
+        self.assertIn("received_at", document["prompt_data"])
+        self.assertEqual(document["user_info"]["email"], "a@test.com")
+
+    def test_missing_timestamps_use_the_reception_time(self):
+        """
+        Interactions without a timestamp, or with an invalid one, are stored under the time the request was received.
+        """
+        documents = main.parse_interactions({"interactions": [interaction("a@test.com", 0), interaction("a@test.com", 1, "yesterday")]})
+        received_at = documents[0][1]["prompt_data"]["received_at"]
+        self.assertEqual([document["prompt_data"]["timestamp"] for _, document in documents], [received_at, received_at])
+
+    def test_same_user_and_timestamp_get_numbered_paths(self):
+        """
+        Interactions of the same user and timestamp are kept apart with a numbered path, and other users are not numbered.
+        """
+        interactions = [
+            interaction("a@test.com", 0, "2024-01-01T00:00:00Z"),
+            interaction("a@test.com", 1, "2024-01-01T00:00:00+00:00"),
+            interaction("b@test.com", 2, "2024-01-01T00:00:00Z"),
+            interaction("a@test.com", 3, "2024-01-01T00:00:00Z"),
+        ]
+        paths = [doc_path for doc_path, _ in main.parse_interactions({"interactions": interactions})]
+        self.assertEqual(paths, [
+            "users/a@test.com/interactions/2024-01-01T00:00:00+00:00",
+            "users/a@test.com/interactions/2024-01-01T00:00:00+00:00-1",
+            "users/b@test.com/interactions/2024-01-01T00:00:00+00:00",
+            "users/a@test.com/interactions/2024-01-01T00:00:00+00:00-2",
+        ])
+
+    def test_invalid_requests(self):
+        """
+        Empty batches, batches over MAX_INTERACTIONS_PER_REQUEST and interactions without a user email are rejected.
+        """
+        with mock.patch.object(main, "MAX_INTERACTIONS_PER_REQUEST", 3):
+            main.parse_interactions({"interactions": [interaction("a@test.com", index) for index in range(3)]})
+            bodies = [
+                {"interactions": []},
+                {"interactions": "a@test.com"},
+                {"interactions": [interaction("a@test.com", index) for index in range(4)]},
+                {"interactions": [interaction("a@test.com", 0), {"prompt_data": {"question": "q"}, "user_info": {}}]},
+                {"interactions": [interaction("a@test.com", 0), "question"]},
+                {"prompt_data": "question", "user_info": {"email": "a@test.com"}},
+            ]
+            for body in bodies:
+                with self.assertRaises(ValueError):
+                    main.parse_interactions(body)
+
+    def test_batches_are_split_at_batch_size(self):
+        """
+        write_batched commits up to BATCH_SIZE documents at a time and records each commit.
+        """
+        documents = main.parse_interactions({"interactions": [interaction("a@test.com", index, f"2024-01-01T00:00:{index:02d}Z") for index in range(5)]})
+        with mock.patch.object(main, "BATCH_SIZE", 2):
+            self.assertEqual(main.write_batched(self.client, documents), 5)
+        self.assertEqual([len(commit) for commit in self.client.commits], [2, 2, 1])
+        self.assertEqual(self.client.stored, dict(documents))
+        stats = main.write_stats["batch"].stats()
+        self.assertEqual((stats["writes"], stats["commits"]), (5, 3))
+        self.assertEqual(main.write_stats["bulk"].stats(), {"writes": 0, "commits": 0})
+
+    def test_bulk_writer(self):
+        """
+        write_bulk sends every document through one BulkWriter and records a single commit.
+        """
+        documents = main.parse_interactions({"interactions": [interaction("a@test.com", index, f"2024-01-01T00:00:{index:02d}Z") for index in range(3)]})
+        self.assertEqual(main.write_bulk(self.client, documents), 3)
+        self.assertEqual(self.client.bulk_writers, 1)
+        self.assertEqual(self.client.stored, dict(documents))
+        self.assertEqual(main.write_stats["bulk"].stats()["commits"], 1)
+
+    def test_write_stats(self):
+        """
+        The stats report the writes per second of commit time and the p95 latency over the recent commits only.
+        """
+        write_stats = main.WriteStats(window=20)
+        self.assertEqual(write_stats.stats(), {"writes": 0, "commits": 0})
+        write_stats.record(500, 10.0)
+        for _ in range(20):
+            write_stats.record(10, 0.01)
+        self.assertEqual(write_stats.stats(), {"writes": 700, "commits": 21, "writes_per_second": 1000.0, "p95_ms": 10.0})
+        write_stats.record(30, 0.5)
+        self.assertEqual(write_stats.stats()["p95_ms"], 500.0)
+        instant = main.WriteStats()
+        instant.record(1, 0.0)
+        self.assertEqual(instant.stats()["writes_per_second"], 0.0)
+
+    def test_handler(self):
+        """
+        A POST writes its interactions with the configured writer, a GET returns the write stats and errors get their status.
+        """
+        with mock.patch.object(main, "db", self.client):
+            response = main.insert_to_firestore(FakeRequest("POST", {"interactions": [interaction("a@test.com", 0), interaction("b@test.com", 1)]}))
+            self.assertEqual(response[1], 200)
+            body = json.loads(response[0])
+            self.assertEqual((body["written"], body["writer"], body["stats"]["writes"]), (2, main.FIRESTORE_WRITER, 2))
+            self.assertEqual(json.loads(main.insert_to_firestore(FakeRequest("GET"))[0])[main.FIRESTORE_WRITER]["writes"], 2)
+            self.assertEqual(main.insert_to_firestore(FakeRequest("OPTIONS"))[1], 204)
+            self.assertEqual(main.insert_to_firestore(FakeRequest("POST", {"interactions": []}))[1], 400)
+            self.assertEqual(main.insert_to_firestore(FakeRequest("POST", ["a@test.com"]))[1], 405)
+        with mock.patch.object(main, "db", FakeFirestore(fail=True)):
+            self.assertEqual(main.insert_to_firestore(FakeRequest("POST", interaction("a@test.com", 0)))[1], 500)
+
+
+if __name__ == "__main__":
+    unittest.main()
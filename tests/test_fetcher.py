@@ -0,0 +1,170 @@
+import unittest
+import asyncio
+import os
+import socket
+import sys
+import tempfile
+from collections import Counter
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TESTS, "..", "scripts", "doc_extractor"))
+sys.path.insert(0, os.path.join(TESTS, "benchmark"))
+
+from aiohttp import web
+from fake_openai import BackgroundServer
+from fetcher import AsyncPageFetcher
+
+
+class PageServer:
+    """
+    A local HTTP server with cacheable, flaky, slow and missing pages, which records the requests it gets.
+    """
+
+    def __init__(self):
+        self.requests = Counter()
+        self.conditional = Counter()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def page(self, request):
+        name = request.match_info["name"]
+        self.requests[name] += 1
+        if request.headers.get("If-None-Match") == f'"{name}"':
+            self.conditional[name] += 1
+            return web.Response(status=304)
+        return web.Response(text=f"<html>{name}</html>", headers={"ETag": f'"{name}"'})
+
+    async def flaky(self, request):
+        # Fails with the status of the path the first two times
+        name = request.path
+        self.requests[name] += 1
+        if self.requests[name] <= 2:
+            return web.Response(status=int(request.match_info["status"]))
+        return web.Response(text="recovered")
+
+    async def slow(self, request):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.05)
+        finally:
+            self.in_flight -= 1
+        return web.Response(text=request.match_info["name"])
+
+    async def missing(self, request):
+        self.requests["missing"] += 1
+        return web.Response(status=404)
+
+    def app(self):
+        app = web.Application()
+        app.add_routes([
+            web.get("/page/{name}", self.page),
+            web.get("/flaky/{status}", self.flaky),
+            web.get("/slow/{name}", self.slow),
+            web.get("/missing", self.missing),
+        ])
+        return app
+
+
+def closed_port_url():
+    # A URL on a port nobody listens to, for connection errors
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return f"http://127.0.0.1:{port}/"
+
+
+class TestAsyncPageFetcher(unittest.TestCase):
+    """
+    A class that contains unit tests for the AsyncPageFetcher, against a local aiohttp server.
+    """
+
+    def setUp(self):
+        self.pages = PageServer()
+        self.server = BackgroundServer(self.pages.app()).start()
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.server.stop()
+        self.directory.cleanup()
+
+    def fetcher(self, **kwargs):
+        return AsyncPageFetcher(backoff=0.01, **kwargs)
+
+    def test_not_modified_pages_come_from_the_cache(self):
+        """
+        A second run sends the ETag of the cached page and serves the body of a 304 from the disk cache.
+        """
+        urls = [f"{self.server.url}/page/a", f"{self.server.url}/page/b"]
+        first = self.fetcher(cache_dir=self.directory.name).fetch_all(urls)
+        self.assertEqual([(page.status, page.from_cache) for page in first], [(200, False), (200, False)])
+        fetcher = self.fetcher(cache_dir=self.directory.name)
+        second = fetcher.fetch_all(urls)
+        self.assertEqual([(page.text, page.status, page.from_cache) for page in second], [
+            ("<html>a</html>", 304, True),
+            ("<html>b</html>", 304, True),
+        ])
+        self.assertEqual(self.pages.conditional, {"a": 1, "b": 1})
+        self.assertEqual(fetcher.stats, {"downloaded": 0, "not_modified": 2, "failed": 0})
+
+    def test_without_cache_pages_are_downloaded(self):
+        """
+        Without a cache directory no conditional request is sent.
+        """
+        fetcher = self.fetcher()
+        fetcher.fetch_all([f"{self.server.url}/page/a"])
+        fetcher.fetch_all([f"{self.server.url}/page/a"])
+        self.assertEqual(self.pages.requests["a"], 2)
+        self.assertEqual(self.pages.conditional, {})
+
+    def test_retries_on_429_and_5xx(self):
+        """
+        429 and 5xx responses are retried until the page is served.
+        """
+        urls = [f"{self.server.url}/flaky/{status}" for status in (429, 500, 503)]
+        pages = self.fetcher(retries=2).fetch_all(urls)
+        self.assertEqual([page.text for page in pages], ["recovered"] * 3)
+        self.assertEqual(self.pages.requests, {"/flaky/429": 3, "/flaky/500": 3, "/flaky/503": 3})
+
+    def test_retries_are_bounded(self):
+        """
+        A page still failing after the retries is reported as failed.
+        """
+        fetcher = self.fetcher(retries=1)
+        self.assertEqual(fetcher.fetch_all([f"{self.server.url}/flaky/502"]), [None])
+        self.assertEqual(self.pages.requests["/flaky/502"], 2)
+        self.assertEqual(fetcher.stats["failed"], 1)
+
+    def test_client_errors_are_not_retried(self):
+        """
+        A 404 is final.
+        """
+        self.assertEqual(self.fetcher(retries=2).fetch_all([f"{self.server.url}/missing"]), [None])
+        self.assertEqual(self.pages.requests["missing"], 1)
+
+    def test_per_host_limit(self):
+        """
+        No more than per_host requests are in flight to the same host.
+        """
+        urls = [f"{self.server.url}/slow/{index}" for index in range(12)]
+        pages = self.fetcher(concurrency=8, per_host=3).fetch_all(urls)
+        self.assertEqual([page.text for page in pages], [str(index) for index in range(12)])
+        self.assertEqual(self.pages.max_in_flight, 3)
+
+    def test_errors_do_not_stop_the_stream(self):
+        """
+        Failed URLs are yielded as None, in any position, and the other URLs are still fetched.
+        """
+        urls = [closed_port_url(), f"{self.server.url}/page/a", f"{self.server.url}/missing", f"{self.server.url}/page/b"]
+        fetcher = self.fetcher(retries=1)
+        results = dict(fetcher.iter_fetch(iter(urls), buffer_size=1))
+        self.assertEqual(sorted(results), [0, 1, 2, 3])
+        self.assertIsNone(results[0])
+        self.assertIsNone(results[2])
+        self.assertEqual((results[1].text, results[3].text), ("<html>a</html>", "<html>b</html>"))
+        self.assertEqual(fetcher.stats, {"downloaded": 2, "not_modified": 0, "failed": 2})
+
+
+if __name__ == "__main__":
+    unittest.main()
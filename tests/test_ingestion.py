@@ -0,0 +1,336 @@
+import unittest
+import os
+import sys
+import tempfile
+import threading
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts", "doc_extractor"))
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import Distance, PointStruct, VectorParams
+from incremental import IngestionState, content_hash, normalize_text, point_id, stored_ids
+from pipeline import Pipeline
+from embedding_cache import CachedEmbeddings
+from dedup import NearDuplicateIndex
+from bulk_upsert import BulkLoader
+
+WORDS = " ".join(f"word{index}" for index in range(60))
+
+
+class CountingEmbeddings(Embeddings):
+    """
+    Deterministic embeddings that count the texts they embed.
+    """
+
+    def __init__(self):
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return [[float(len(text)), 1.0] for text in texts]
+
+    def embed_query(self, text):
+        return [float(len(text)), 0.0]
+
+
+class TestHashing(unittest.TestCase):
+    """
+    A class that contains unit tests for the content hashes and point ids of the incremental ingestion.
+    """
+
+    def test_whitespace_does_not_change_the_hash(self):
+        """
+        Texts that differ only in whitespace have the same hash; other changes change it.
+        """
+        self.assertEqual(normalize_text("  a \n\n b\tc "), "a b c")
+        self.assertEqual(content_hash("a  b\n"), content_hash("a b"))
+        self.assertNotEqual(content_hash("a b"), content_hash("a c"))
+
+    def test_point_ids_are_stable(self):
+        """
+        The point id is a UUID derived from the source and the chunk hash only.
+        """
+        chunk_hash = content_hash("text")
+        self.assertEqual(point_id("https://a", chunk_hash), point_id("https://a", chunk_hash))
+        self.assertNotEqual(point_id("https://a", chunk_hash), point_id("https://b", chunk_hash))
+        self.assertEqual(len(point_id("https://a", chunk_hash)), 36)
+
+
+class TestIngestionState(unittest.TestCase):
+    """
+    A class that contains unit tests for the IngestionState, on an in-memory Qdrant collection.
+    """
+
+    def setUp(self):
+        self.client = QdrantClient(":memory:")
+        self.client.create_collection("test", vectors_config=VectorParams(size=2, distance=Distance.COSINE))
+
+    def deduplicate(self, chunks, state):
+        return chunks
+
+    def run_ingestion(self, pages):
+        # Each page is split on "|" into chunks; returns the texts stored for each source
+        state = IngestionState(self.client, "test").load()
+        todo = pages
+        while True:
+            documents = state.changed_documents([Document(page_content=text, metadata={"source": source}) for source, text in todo.items()])
+            chunks = [Document(page_content=part, metadata=dict(doc.metadata)) for doc in documents for part in doc.page_content.split("|")]
+            new_chunks, ids = state.new_chunks(self.deduplicate(chunks, state))
+            if new_chunks:
+                self.client.upsert("test", [
+                    PointStruct(id=chunk_id, vector=[1.0, 0.0], payload={"page_content": chunk.page_content, "metadata": chunk.metadata})
+                    for chunk_id, chunk in zip(ids, new_chunks)
+                ])
+            state.commit()
+            if not state.reprocess:
+                break
+            todo = {source: pages[source] for source in state.reprocess}
+        stored = {}
+        points, _ = self.client.scroll("test", limit=100, with_payload=True)
+        for point in points:
+            stored.setdefault(point.payload["metadata"]["source"], set()).add(point.payload["page_content"])
+        return stored
+
+    def test_unchanged_pages_are_skipped(self):
+        """
+        A second run over the same pages finds nothing to do, and a changed page replaces its chunks.
+        """
+        pages = {"a": "first|second", "b": "third"}
+        self.assertEqual(self.run_ingestion(pages), {"a": {"first", "second"}, "b": {"third"}})
+        state = IngestionState(self.client, "test").load()
+        documents = [Document(page_content=text, metadata={"source": source}) for source, text in pages.items()]
+        self.assertEqual(state.changed_documents(documents), [])
+        pages["a"] = "first|changed"
+        self.assertEqual(self.run_ingestion(pages), {"a": {"first", "changed"}, "b": {"third"}})
+
+    def test_unchanged_chunks_keep_their_points(self):
+        """
+        The chunks of a changed page that did not change are not upserted again.
+        """
+        self.run_ingestion({"a": "first|second"})
+        state = IngestionState(self.client, "test").load()
+        documents = state.changed_documents([Document(page_content="first|changed", metadata={"source": "a"})])
+        chunks = [Document(page_content=part, metadata=dict(documents[0].metadata)) for part in documents[0].page_content.split("|")]
+        new_chunks, ids = state.new_chunks(chunks)
+        self.assertEqual([chunk.page_content for chunk in new_chunks], ["changed"])
+        self.assertEqual(ids, [point_id("a", content_hash("changed"))])
+
+    def test_stored_ids_of_a_source(self):
+        """
+        stored_ids returns the point ids of one source only.
+        """
+        self.run_ingestion({"a": "first|second", "b": "third"})
+        self.assertEqual(stored_ids(self.client, "test", "a", batch_size=1), {point_id("a", content_hash(text)) for text in ("first", "second")})
+        self.assertEqual(stored_ids(self.client, "test", "missing"), set())
+
+
+class TestMergedIngestionState(TestIngestionState):
+    """
+    A class that runs the IngestionState tests with near-duplicate removal, and the tests of the merged pages.
+    """
+
+    def deduplicate(self, chunks, state):
+        return NearDuplicateIndex().deduplicate(chunks, on_merge=state.merge)
+
+    def test_merged_pages_survive_a_change_of_their_representative(self):
+        """
+        A page whose chunk was merged into another page's chunk gets it back when that page changes.
+        """
+        pages = {"a": "alpha text|" + WORDS, "b": WORDS + "|beta text"}
+        self.assertEqual(self.run_ingestion(pages), {"a": {"alpha text", WORDS}, "b": {"beta text"}})
+        pages["a"] = "alpha text changed"
+        self.assertEqual(self.run_ingestion(pages), {"a": {"alpha text changed"}, "b": {"beta text", WORDS}})
+
+    def test_fully_merged_page_counts_as_stored(self):
+        """
+        A page whose chunks were all merged is not processed again while it does not change.
+        """
+        pages = {"a": "alpha|" + WORDS, "c": WORDS}
+        self.assertEqual(self.run_ingestion(pages), {"a": {"alpha", WORDS}})
+        state = IngestionState(self.client, "test").load()
+        documents = [Document(page_content=text, metadata={"source": source}) for source, text in pages.items()]
+        self.assertEqual(state.changed_documents(documents), [])
+        pages["a"] = "alpha"
+        self.assertEqual(self.run_ingestion(pages), {"a": {"alpha"}, "c": {WORDS}})
+
+
+class TestNearDuplicateIndex(unittest.TestCase):
+    """
+    A class that contains unit tests for the near-duplicate chunk index.
+    """
+
+    def test_near_duplicates_are_merged(self):
+        """
+        A chunk that differs from an earlier one by a word is merged into it and reported to on_merge.
+        """
+        merges = []
+        index = NearDuplicateIndex(threshold=0.8)
+        first = Document(page_content=WORDS, metadata={"source": "a"})
+        second = Document(page_content=WORDS.replace("word30", "other"), metadata={"source": "b"})
+        third = Document(page_content="something else entirely, with different words", metadata={"source": "c"})
+        unique = index.deduplicate([first, second, third], on_merge=lambda chunk, representative: merges.append((chunk, representative)))
+        self.assertEqual(unique, [first, third])
+        self.assertEqual(merges, [(second, first)])
+        self.assertEqual(first.metadata["sources"], ["a", "b"])
+        self.assertEqual(index.stats(), {"seen": 3, "removed": 1})
+
+    def test_signature_is_deterministic(self):
+        """
+        Two indexes give the same signature to the same text.
+        """
+        self.assertTrue((NearDuplicateIndex().signature(WORDS) == NearDuplicateIndex().signature(WORDS)).all())
+
+    def test_bands_must_divide_permutations(self):
+        """
+        num_perm must be divisible by the number of bands.
+        """
+        with self.assertRaises(ValueError):
+            NearDuplicateIndex(num_perm=64, bands=10)
+
+
+class TestPipeline(unittest.TestCase):
+    """
+    A class that contains unit tests for the threaded pipeline.
+    """
+
+    def test_items_flow_through_the_stages_in_batches(self):
+        """
+        Every item goes through every stage, batched, and the stats count them.
+        """
+        batches, results = [], []
+        pipeline = Pipeline(iter(range(10)), buffer_size=2)
+        pipeline.stage("double", lambda items: (batches.append(len(items)), [item * 2 for item in items])[1], batch_size=4)
+        pipeline.stage("collect", results.extend, batch_size=3)
+        stats = pipeline.run()
+        self.assertEqual(sorted(results), [item * 2 for item in range(10)])
+        self.assertEqual(batches, [4, 4, 2])
+        self.assertEqual(stats["source"]["out"], 10)
+        self.assertEqual(stats["double"]["out"], 10)
+
+    def test_errors_stop_the_pipeline(self):
+        """
+        The first error of a stage stops the pipeline and is raised by run().
+        """
+        def fail(items):
+            raise RuntimeError("stage failed")
+
+        pipeline = Pipeline(iter(range(1000)), buffer_size=2)
+        pipeline.stage("fail", fail, batch_size=1)
+        pipeline.stage("collect", lambda items: items)
+        with self.assertRaises(RuntimeError):
+            pipeline.run()
+
+
+class TestCachedEmbeddings(unittest.TestCase):
+    """
+    A class that contains unit tests for the SQLite document embedding cache.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "embeddings.sqlite3")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_texts_are_embedded_once(self):
+        """
+        Repeated texts, in the same call or in a later one, are only sent once.
+        """
+        embeddings = CountingEmbeddings()
+        cache = CachedEmbeddings(embeddings, "model", self.path)
+        first = cache.embed_documents(["a", "bb", "a"])
+        second = cache.embed_documents(["bb", "ccc"])
+        self.assertEqual(embeddings.embedded, ["a", "bb", "ccc"])
+        self.assertEqual(first, [[1.0, 1.0], [2.0, 1.0], [1.0, 1.0]])
+        self.assertEqual(second, [[2.0, 1.0], [3.0, 1.0]])
+        self.assertEqual((cache.hits, cache.misses), (2, 3))
+
+    def test_cache_is_shared_by_model_and_file(self):
+        """
+        A new client on the same file reuses the vectors of the same model only.
+        """
+        CachedEmbeddings(CountingEmbeddings(), "model", self.path).embed_documents(["a"])
+        same_model = CountingEmbeddings()
+        CachedEmbeddings(same_model, "model", self.path).embed_documents(["a"])
+        other_model = CountingEmbeddings()
+        CachedEmbeddings(other_model, "other", self.path).embed_documents(["a"])
+        self.assertEqual(same_model.embedded, [])
+        self.assertEqual(other_model.embedded, ["a"])
+
+    def test_concurrent_calls(self):
+        """
+        Calls from several threads return the right vectors.
+        """
+        cache = CachedEmbeddings(CountingEmbeddings(), "model", self.path)
+        results = {}
+
+        def embed(index):
+            results[index] = cache.embed_documents(["x" * index])
+
+        threads = [threading.Thread(target=embed, args=(index,)) for index in range(1, 9)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, {index: [[float(index), 1.0]] for index in range(1, 9)})
+
+
+
+class TestBulkLoader(unittest.TestCase):
+    """
+    A class that contains unit tests for the BulkLoader, on an in-memory Qdrant collection.
+    """
+
+    def setUp(self):
+        self.client = QdrantClient(":memory:")
+        self.client.create_collection("test", vectors_config=VectorParams(size=2, distance=Distance.COSINE))
+
+    def documents(self, count):
+        return [Document(page_content="x" * (index + 1), metadata={"source": "a"}) for index in range(count)]
+
+    def test_documents_are_embedded_and_uploaded(self):
+        """
+        The documents are uploaded with upload_points, in batches of batch_size, and counted.
+        """
+        loader = BulkLoader(self.client, "test", embeddings=CountingEmbeddings(), batch_size=2, parallel=2, max_retries=1)
+        documents = self.documents(5)
+        ids = [point_id("a", content_hash(doc.page_content)) for doc in documents]
+        with mock.patch.object(self.client, "upload_points", wraps=self.client.upload_points) as upload_points:
+            with loader:
+                loader.add_documents(documents, ids)
+                loader.add_documents([], [])
+        upload_points.assert_called_once()
+        self.assertEqual({key: upload_points.call_args.kwargs[key] for key in ("batch_size", "parallel", "max_retries", "wait")},
+                         {"batch_size": 2, "parallel": 2, "max_retries": 1, "wait": True})
+        self.assertEqual(self.client.count("test").count, 5)
+        self.assertEqual(loader.stats()["points"], 5)
+        point = self.client.retrieve("test", [ids[2]], with_payload=True)[0]
+        self.assertEqual(point.payload, {"page_content": "xxx", "metadata": {"source": "a"}})
+
+    def test_indexing_is_paused_during_the_load(self):
+        """
+        With pause_indexing, the indexing threshold is 0 inside the context and restored on exit, even after an error.
+        """
+        with mock.patch.object(self.client, "update_collection", wraps=self.client.update_collection) as update_collection:
+            with self.assertRaises(RuntimeError):
+                with BulkLoader(self.client, "test", pause_indexing=True):
+                    self.assertEqual(update_collection.call_args.kwargs["optimizers_config"].indexing_threshold, 0)
+                    raise RuntimeError("load failed")
+        self.assertEqual([call.kwargs["optimizers_config"].indexing_threshold for call in update_collection.call_args_list], [0, 20000])
+
+    def test_indexing_is_not_paused_by_default(self):
+        """
+        Without pause_indexing, the collection is not updated.
+        """
+        with mock.patch.object(self.client, "update_collection") as update_collection:
+            with BulkLoader(self.client, "test") as loader:
+                loader.upload([PointStruct(id=1, vector=[1.0, 0.0], payload={})])
+        update_collection.assert_not_called()
+        self.assertEqual(self.client.count("test").count, 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+import unittest
+import os
+import sys
+import tempfile
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "streamlit_app", "src"))
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import Distance, PointStruct, VectorParams
+import local_vector_store
+from local_vector_store import LocalVectorStore, export_collection
+from metadata_filter import normalize_filter
+
+POINTS = [
+    ([1.0, 0.0, 0.0], "Events are sent with gtag", "GA4"),
+    ([0.9, 0.1, 0.0], "Custom events have parameters", "GA4"),
+    ([0.0, 1.0, 0.0], "Sessions start on the first page", "GA4"),
+    ([0.7, 0.0, 0.7], "Tags send events to GA4", "GTM"),
+    ([0.0, 0.0, 1.0], "Containers hold the tags", "GTM"),
+]
+
+QUERIES = {"events": [1.0, 0.0, 0.0], "tags": [0.0, 0.0, 1.0]}
+
+
+class QueryEmbeddings(Embeddings):
+    """
+    An embeddings stand-in with fixed query vectors.
+    """
+
+    def embed_documents(self, texts):
+        return [QUERIES[text] for text in texts]
+
+    def embed_query(self, text):
+        return QUERIES[text]
+
+
+class TestLocalVectorStore(unittest.TestCase):
+    """
+    A class that contains unit tests for the export of a collection and the LocalVectorStore, from an in-memory Qdrant collection.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.client = QdrantClient(":memory:")
+        self.client.create_collection("test", vectors_config=VectorParams(size=3, distance=Distance.COSINE))
+        self.client.upsert("test", [
+            PointStruct(id=index + 1, vector=vector, payload={"page_content": text, "metadata": {"tool": tool}})
+            for index, (vector, text, tool) in enumerate(POINTS)
+        ])
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def store(self, dtype="float32", hnsw=False, **kwargs):
+        directory = os.path.join(self.directory.name, f"{dtype}-{hnsw}")
+        export_collection(self.client, "test", directory, dtype=dtype, hnsw=hnsw, batch_size=2)
+        return LocalVectorStore(directory, QueryEmbeddings(), **kwargs)
+
+    def texts(self, results):
+        return [doc.page_content for doc, _ in results]
+
+    def test_export_manifest(self):
+        """
+        The manifest describes the export, and its fingerprint follows the point ids.
+        """
+        store = self.store()
+        self.assertEqual({key: store.manifest[key] for key in ("collection_name", "points", "dimension", "dtype")},
+                         {"collection_name": "test", "points": 5, "dimension": 3, "dtype": "float32"})
+        self.assertEqual(len(store.documents()), 5)
+        fingerprint = store.fingerprint.current()
+        self.client.upsert("test", [PointStruct(id=6, vector=[0.0, 1.0, 1.0], payload={"page_content": "new", "metadata": {}})])
+        self.assertNotEqual(self.store(dtype="float16").fingerprint.current(), fingerprint)
+
+    def test_search(self):
+        """
+        The search returns the most similar documents first, with their cosine similarity and ids.
+        """
+        results = self.store().similarity_search_with_score("events", k=3)
+        self.assertEqual(self.texts(results), ["Events are sent with gtag", "Custom events have parameters", "Tags send events to GA4"])
+        self.assertAlmostEqual(results[0][1], 1.0, places=5)
+        self.assertEqual(results[0][0].metadata, {"tool": "GA4", "_id": "1", "_collection_name": "test", "_score": results[0][1]})
+
+    def test_score_threshold_and_filter(self):
+        """
+        The score threshold drops the weak matches and the metadata filter restricts the rows searched.
+        """
+        store = self.store()
+        self.assertEqual(len(store.similarity_search_with_score("events", k=5, score_threshold=0.9)), 2)
+        results = store.similarity_search_with_score("events", k=5, filter=normalize_filter({"tool": "GTM"}))
+        self.assertEqual(self.texts(results), ["Tags send events to GA4", "Containers hold the tags"])
+        self.assertEqual(store.similarity_search("events", k=2, filter=normalize_filter({"tool": "Ads"})), [])
+
+    def test_float16_export_is_searched_in_blocks(self):
+        """
+        A float16 export stays memory-mapped as float16 and, scored block by block, ranks like the float32 export.
+        """
+        store = self.store(dtype="float16")
+        self.assertIsInstance(store._matrix, np.memmap)
+        self.assertEqual(store._matrix.dtype, np.float16)
+        with mock.patch.object(local_vector_store, "SEARCH_BLOCK_ROWS", 2):
+            for query in QUERIES:
+                for metadata_filter in (None, normalize_filter({"tool": "GA4"})):
+                    expected = self.store().similarity_search_with_score(query, k=4, filter=metadata_filter)
+                    results = store.similarity_search_with_score(query, k=4, filter=metadata_filter)
+                    self.assertEqual(self.texts(results), self.texts(expected))
+                    np.testing.assert_allclose([score for _, score in results], [score for _, score in expected], atol=1e-3)
+
+    @unittest.skipIf(local_vector_store.hnswlib is None, "hnswlib is not installed")
+    def test_hnsw_search(self):
+        """
+        The HNSW index finds the same documents as the exact search.
+        """
+        results = self.store(hnsw=True).similarity_search("tags", k=2)
+        self.assertEqual([doc.page_content for doc in results], ["Containers hold the tags", "Tags send events to GA4"])
+
+    def test_max_marginal_relevance(self):
+        """
+        With a low lambda_mult, the near-duplicate of the best match is passed over for a more diverse document.
+        """
+        results = self.store(dtype="float16").max_marginal_relevance_search("events", k=2, fetch_k=3, lambda_mult=0.25)
+        self.assertEqual([doc.page_content for doc in results], ["Events are sent with gtag", "Tags send events to GA4"])
+
+    def test_store_is_read_only(self):
+        """
+        add_texts and from_texts are not supported: the store is built with export_collection().
+        """
+        with self.assertRaises(NotImplementedError):
+            self.store().add_texts(["text"])
+        with self.assertRaises(NotImplementedError):
+            LocalVectorStore.from_texts(["text"], QueryEmbeddings())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,466 @@
+import unittest
+import asyncio
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "streamlit_app", "src"))
+
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables import RunnableLambda
+from hybrid_retriever import BM25Index, HybridRetriever, LexicalIndex, tokenize
+from context_packer import ContextPacker
+from metadata_filter import filter_key, filter_options, matches, normalize_filter, qdrant_filter
+from rewrite_policy import REWRITE_DECISION_KEY, RewritePolicy
+from speculative_retrieval import SpeculativeRetrieval
+
+
+def chunk(text, source="https://a", **metadata):
+    return Document(page_content=text, metadata={"source": source, **metadata})
+
+
+CHUNKS = [
+    chunk("The session_start event is logged when a user opens the site", _id="1", tool="GA4", date="2024-05-01"),
+    chunk("Engagement time is measured with the user_engagement event", _id="2", tool="GA4", date="2024-06-01"),
+    chunk("Tags are published from the workspace of the container", _id="3", tool="GTM", date="2024-07-01"),
+    chunk("Reports show the users and the sessions of a property", _id="4", tool="GA4", date="2024-08-01"),
+]
+
+
+class StaticRetriever(BaseRetriever):
+    """
+    A dense retriever stand-in that always returns the same documents.
+    """
+
+    documents: list
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        return list(self.documents)
+
+
+class StaticIndex:
+    """
+    A LexicalIndex stand-in over a fixed BM25 index.
+    """
+
+    def __init__(self, documents):
+        self.index = BM25Index(documents)
+
+    def current(self):
+        return self.index
+
+
+class RecordingRetriever(BaseRetriever):
+    """
+    A retriever stand-in that returns a document named after the query, and fails for the queries in failing.
+    """
+
+    queries: list = []
+    failing: tuple = ()
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        self.queries.append(query)
+        if query in self.failing:
+            raise RuntimeError(f"search failed: {query}")
+        return [Document(page_content=query)]
+
+
+class VectorEmbeddings(Embeddings):
+    """
+    An embeddings stand-in with fixed query vectors, which fails for the texts missing from vectors.
+    """
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        if text not in self.vectors:
+            raise RuntimeError(f"embedding failed: {text}")
+        return self.vectors[text]
+
+
+class TestBM25Index(unittest.TestCase):
+    """
+    A class that contains unit tests for the tokenizer and the BM25 index.
+    """
+
+    def test_tokenize(self):
+        """
+        Stopwords are dropped and identifiers are kept whole and split into their parts.
+        """
+        self.assertEqual(tokenize("What is the session_start event?"), ["session_start", "session", "start", "event"])
+
+    def test_search_ranks_matching_documents(self):
+        """
+        Only the documents sharing a token with the query are returned, the best match first.
+        """
+        results = BM25Index(CHUNKS).search("session_start event", k=4)
+        self.assertEqual([doc.metadata["_id"] for doc, _ in results], ["1", "2"])
+        self.assertGreater(results[0][1], results[1][1])
+        self.assertEqual(len(BM25Index(CHUNKS).search("session_start event", k=1)), 1)
+        self.assertEqual(BM25Index(CHUNKS).search("unrelated words", k=4), [])
+
+    def test_min_score(self):
+        """
+        Documents that match a small share of the query are dropped under a minimum score.
+        """
+        index = BM25Index(CHUNKS)
+        query = "session_start opens site users"
+        self.assertEqual(len(index.search(query, k=4)), 2)
+        self.assertEqual([doc.metadata["_id"] for doc, _ in index.search(query, k=4, min_score=0.2)], ["1"])
+
+    def test_metadata_filter(self):
+        """
+        A metadata filter keeps the documents that pass it only.
+        """
+        index = BM25Index(CHUNKS)
+        results = index.search("event users workspace", k=4, metadata_filter=normalize_filter({"tool": "GTM"}))
+        self.assertEqual([doc.metadata["_id"] for doc, _ in results], ["3"])
+
+    def test_identifier_share(self):
+        """
+        The share of the content words of a query that are identifiers of the documents.
+        """
+        index = BM25Index(CHUNKS)
+        self.assertEqual(index.identifiers, {"session_start", "user_engagement"})
+        self.assertEqual(index.identifier_share("what is session_start"), 1.0)
+        self.assertEqual(index.identifier_share("session_start and user_engagement events"), 2 / 3)
+        self.assertEqual(index.identifier_share("the"), 0.0)
+
+
+class TestLexicalIndex(unittest.TestCase):
+    """
+    A class that contains unit tests for the lexical index of a collection.
+    """
+
+    class Fingerprint:
+        version = 1
+
+        def current(self):
+            return self.version
+
+    def test_index_is_built_on_demand(self):
+        """
+        documents() does not build the index, and a change of the collection rebuilds it in the background.
+        """
+        loads = []
+        fingerprint = self.Fingerprint()
+        index = LexicalIndex(None, "test", fingerprint, load_documents=lambda: loads.append(1) or list(CHUNKS))
+        self.assertEqual(index.documents(), CHUNKS)
+        self.assertIsNone(index._index)
+        first = index.current()
+        self.assertIs(index.current(), first)
+        self.assertIs(index.documents(), first.documents)
+        fingerprint.version = 2
+        self.assertIs(index.current(), first)
+        index._build(2)
+        self.assertIsNot(index.current(), first)
+        self.assertGreaterEqual(len(loads), 3)
+
+
+class TestHybridRetriever(unittest.TestCase):
+    """
+    A class that contains unit tests for the reciprocal rank fusion of the hybrid retriever.
+    """
+
+    def retriever(self, dense, **kwargs):
+        return HybridRetriever(dense=StaticRetriever(documents=dense), lexical_index=StaticIndex(CHUNKS), k=3, **kwargs)
+
+    def test_documents_in_both_rankings_come_first(self):
+        """
+        The fusion ranks the documents found by both searches above those found by one.
+        """
+        fused = self.retriever([CHUNKS[3], CHUNKS[1]]).invoke("engagement event time")
+        self.assertEqual([doc.metadata["_id"] for doc in fused], ["2", "4", "1"])
+
+    def test_identifier_queries_skip_the_dense_search(self):
+        """
+        A query made of known identifiers is answered by the lexical search alone.
+        """
+        self.assertEqual([doc.metadata["_id"] for doc in self.retriever([CHUNKS[3]]).invoke("session_start")], ["1"])
+
+    def test_lexical_floor_under_a_score_threshold(self):
+        """
+        Weak lexical matches are not fused when the dense search has a score threshold.
+        """
+        query = "users sessions session_start opens site workspace"
+        self.assertIn("3", [doc.metadata["_id"] for doc in self.retriever([]).invoke(query)])
+        retriever = self.retriever([], search_kwargs={"score_threshold": 0.5}, lexical_floor=0.2)
+        self.assertNotIn("3", [doc.metadata["_id"] for doc in retriever.invoke(query)])
+
+
+class TestContextPacker(unittest.TestCase):
+    """
+    A class that contains unit tests for the context packer, with the estimated token counts.
+    """
+
+    def packer(self, **kwargs):
+        packer = ContextPacker(**kwargs)
+        packer._encoding = None
+        return packer
+
+    def test_positioned_chunks_are_merged(self):
+        """
+        Overlapping chunks of the same page are merged on their start_index.
+        """
+        text = "abcdefghij" * 10
+        documents = [chunk(text[40:80], start_index=40), chunk(text[0:50], start_index=0)]
+        packed = self.packer().pack(documents)
+        self.assertEqual(len(packed), 1)
+        self.assertEqual(packed[0].page_content, text[0:80])
+        self.assertEqual(packed[0].metadata["merged_chunks"], 2)
+
+    def test_positions_of_other_versions_are_not_merged(self):
+        """
+        Chunks of different versions of a page, or whose texts disagree on their overlap, are not merged on their positions.
+        """
+        text = "abcdefghij" * 10
+        versions = [chunk(text[0:50], start_index=0, page_hash="v1"), chunk(text[40:80], start_index=40, page_hash="v2")]
+        self.assertEqual(len(self.packer(redundancy=1.1).pack(versions)), 2)
+        stale = [chunk(text[0:50], start_index=0), chunk("x" * 40, start_index=40)]
+        self.assertEqual([doc.page_content for doc in self.packer(redundancy=1.1).pack(stale)], [text[0:50], "x" * 40])
+
+    def test_chunks_are_merged_on_their_text(self):
+        """
+        Without a start_index, chunks of the same page are merged on the overlap of their texts.
+        """
+        text = " ".join(f"word{index}" for index in range(40))
+        documents = [chunk(text[:150]), chunk(text[120:]), chunk(text[120:], source="https://b")]
+        packed = self.packer(min_overlap=20, redundancy=1.1).pack(documents)
+        self.assertEqual([doc.page_content for doc in packed], [text, text[120:]])
+
+    def test_redundant_blocks_are_dropped(self):
+        """
+        A block whose trigrams are already in the context is dropped.
+        """
+        text = " ".join(f"word{index}" for index in range(40))
+        packed = self.packer().pack([chunk(text), chunk(text, source="https://b")])
+        self.assertEqual(len(packed), 1)
+
+    def test_token_budget(self):
+        """
+        Blocks that do not fit are skipped for smaller ones, and a first block that does not fit is truncated.
+        """
+        packer = self.packer(token_budget=30)
+        documents = [chunk("a" * 80, source="1"), chunk("b " * 40, source="2"), chunk("c" * 20, source="3")]
+        self.assertEqual([doc.metadata["source"] for doc in packer.pack(documents)], ["1", "3"])
+        self.assertEqual(packer.pack([chunk("d" * 400)])[0].page_content, "d" * 120)
+        self.assertEqual(packer.stats()["turns"], 2)
+
+
+class TestRewritePolicy(unittest.TestCase):
+    """
+    A class that contains unit tests for the decision to rewrite a question and the rewrite runnable.
+    """
+
+    HISTORY = [HumanMessage(content="How do I create a custom event?"), AIMessage(content="Use gtag with the event name and its parameters.")]
+
+    def setUp(self):
+        self.policy = RewritePolicy(max_overlap=0.5)
+        self.rewrites = []
+
+    def rewrite_chain(self):
+        def rewrite(inputs):
+            self.rewrites.append(inputs["input"])
+            return f"rewritten: {inputs['input']}"
+
+        return RunnableLambda(rewrite)
+
+    def test_without_history_nothing_is_rewritten(self):
+        """
+        The first question of a conversation is never rewritten, whatever the mode.
+        """
+        self.assertEqual(self.policy.decide("and it?", []), (False, "no history"))
+        self.assertEqual(RewritePolicy(mode="always").decide("and it?", None), (False, "no history"))
+
+    def test_follow_ups_are_rewritten(self):
+        """
+        Referring words, elliptical openings, short questions and questions sharing the words of the history are rewritten.
+        """
+        self.assertEqual(self.policy.decide("Where do I see them in reports?", self.HISTORY), (True, "refers back (them)"))
+        self.assertEqual(self.policy.decide("E no aplicativo de iOS, funciona?", self.HISTORY), (True, "elliptical opening"))
+        self.assertEqual(self.policy.decide("Web streams?", self.HISTORY), (True, "too short"))
+        self.assertEqual(self.policy.decide("Can custom event parameters be registered?", self.HISTORY), (True, "overlap 0.75"))
+
+    def test_self_contained_questions_are_not_rewritten(self):
+        """
+        A long question with new content words is sent as is.
+        """
+        self.assertEqual(self.policy.decide("How is the bounce rate calculated for web streams?", self.HISTORY), (False, "self-contained (overlap 0.00)"))
+        self.assertEqual(self.policy.decide("Como publicar uma tag no container?", [{"role": "user", "content": "O que é uma sessão?"}])[0], False)
+
+    def test_modes(self):
+        """
+        The always and never modes ignore the question, and unknown modes are rejected.
+        """
+        question = "How is the bounce rate calculated for web streams?"
+        self.assertEqual(RewritePolicy(mode="always").decide(question, self.HISTORY), (True, "mode=always"))
+        self.assertEqual(RewritePolicy(mode="never").decide("and it?", self.HISTORY), (False, "mode=never"))
+        with self.assertRaises(ValueError):
+            RewritePolicy(mode="sometimes")
+
+    def test_runnable_skips_or_rewrites(self):
+        """
+        The runnable calls the rewrite chain only for the questions that need it, and counts both paths.
+        """
+        runnable = self.policy.runnable(self.rewrite_chain())
+        self.assertEqual(runnable.invoke({"input": "and for apps?", "chat_history": self.HISTORY}), "rewritten: and for apps?")
+        question = "How is the bounce rate calculated for web streams?"
+        self.assertEqual(runnable.invoke({"input": question, "chat_history": self.HISTORY}), question)
+        self.assertEqual(runnable.invoke({"input": question, "chat_history": []}), question)
+        self.assertEqual(self.rewrites, ["and for apps?"])
+        self.assertEqual({key: self.policy.stats()[key] for key in ("rewrites", "skips")}, {"rewrites": 1, "skips": 1})
+
+    def test_decision_taken_for_the_turn_is_used(self):
+        """
+        A decision passed in the inputs is followed instead of deciding again, in the sync and async paths.
+        """
+        runnable = self.policy.runnable(self.rewrite_chain())
+        inputs = {"input": "and for apps?", "chat_history": self.HISTORY, REWRITE_DECISION_KEY: (False, "decided")}
+        self.assertEqual(runnable.invoke(inputs), "and for apps?")
+        question = "How is the bounce rate calculated for web streams?"
+        inputs = {"input": question, "chat_history": self.HISTORY, REWRITE_DECISION_KEY: (True, "decided")}
+        self.assertEqual(asyncio.run(runnable.ainvoke(inputs)), f"rewritten: {question}")
+        self.assertEqual(self.rewrites, [question])
+
+
+class TestSpeculativeRetrieval(unittest.TestCase):
+    """
+    A class that contains unit tests for the speculative retrieval, with stand-in retriever, rewrite and embeddings.
+    """
+
+    INPUTS = {"input": "and for apps?", "chat_history": [{"role": "user", "content": "What is a session?"}]}
+    REWRITTEN = "What is a session in apps?"
+
+    def speculative(self, vectors, failing=(), executor=None, mode="always"):
+        self.retriever = RecordingRetriever(queries=[], failing=failing)
+        self.policy = RewritePolicy(mode=mode)
+        rewrite = self.policy.runnable(RunnableLambda(lambda inputs: self.REWRITTEN))
+        return SpeculativeRetrieval(self.retriever, rewrite, self.policy, VectorEmbeddings(vectors), threshold=0.9, executor=executor)
+
+    def test_close_questions_reuse_the_prefetch(self):
+        """
+        When the rewritten question is close to the input, the documents of the input are used.
+        """
+        speculative = self.speculative({self.INPUTS["input"]: [1.0, 0.0], self.REWRITTEN: [0.99, 0.1]})
+        result = speculative.retrieve(self.INPUTS)
+        self.assertEqual(result["standalone_question"], self.REWRITTEN)
+        self.assertEqual(result["context"][0].page_content, self.INPUTS["input"])
+        self.assertEqual(self.retriever.queries, [self.INPUTS["input"]])
+        self.assertEqual((speculative.metrics.speculated, speculative.metrics.reused), (1, 1))
+        self.assertEqual(self.policy.rewrites, 1)
+
+    def test_distant_questions_search_again(self):
+        """
+        When the rewritten question is far from the input, the rewritten question is searched.
+        """
+        speculative = self.speculative({self.INPUTS["input"]: [1.0, 0.0], self.REWRITTEN: [0.0, 1.0]})
+        result = speculative.retrieve(self.INPUTS)
+        self.assertEqual(result["context"][0].page_content, self.REWRITTEN)
+        self.assertEqual(speculative.metrics.reused, 0)
+
+    def test_failed_prefetch_embedding_falls_back(self):
+        """
+        A prefetch whose embedding fails does not fail the turn.
+        """
+        speculative = self.speculative({self.REWRITTEN: [1.0, 0.0]})
+        result = speculative.retrieve(self.INPUTS)
+        self.assertEqual(result["context"][0].page_content, self.REWRITTEN)
+        self.assertEqual(self.retriever.queries, [self.REWRITTEN])
+
+    def test_failed_prefetch_search_falls_back(self):
+        """
+        A prefetch whose search fails does not fail the turn, even when its documents would be reused.
+        """
+        speculative = self.speculative({self.INPUTS["input"]: [1.0, 0.0], self.REWRITTEN: [1.0, 0.0]}, failing=(self.INPUTS["input"],))
+        result = speculative.retrieve(self.INPUTS)
+        self.assertEqual(result["context"][0].page_content, self.REWRITTEN)
+        self.assertEqual(speculative.metrics.reused, 0)
+
+    def test_busy_executor_searches_the_rewritten_question(self):
+        """
+        A prefetch still waiting for a thread when the rewrite ends is cancelled.
+        """
+        release = threading.Event()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            executor.submit(release.wait)
+            speculative = self.speculative({self.INPUTS["input"]: [1.0, 0.0], self.REWRITTEN: [1.0, 0.0]}, executor=executor)
+            result = speculative.retrieve(self.INPUTS)
+            release.set()
+        self.assertEqual(result["context"][0].page_content, self.REWRITTEN)
+        self.assertEqual(self.retriever.queries, [self.REWRITTEN])
+
+    def test_turns_without_rewrite_are_retrieved_directly(self):
+        """
+        A turn that needs no rewrite searches the input once, without speculation.
+        """
+        speculative = self.speculative({}, mode="never")
+        result = speculative.retrieve(self.INPUTS)
+        self.assertEqual(result["standalone_question"], self.INPUTS["input"])
+        self.assertEqual(self.retriever.queries, [self.INPUTS["input"]])
+        self.assertEqual(speculative.metrics.speculated, 0)
+
+
+class TestMetadataFilter(unittest.TestCase):
+    """
+    A class that contains unit tests for the metadata filters.
+    """
+
+    def test_normalize_filter(self):
+        """
+        Filters are put in a canonical form, and empty or unknown ones are handled.
+        """
+        self.assertEqual(
+            normalize_filter({"tool": ["GTM", "GA4", "GA4"], "type": "guide", "subject": [], "date_to": "2024-06-30T12:00:00"}),
+            {"tool": ("GA4", "GTM"), "type": ("guide",), "date_to": "2024-06-30"},
+        )
+        self.assertIsNone(normalize_filter({"tool": []}))
+        self.assertIsNone(normalize_filter(None))
+        with self.assertRaises(ValueError):
+            normalize_filter({"author": "x"})
+        with self.assertRaises(ValueError):
+            normalize_filter({"date_from": "yesterday"})
+
+    def test_filter_key(self):
+        """
+        Equal filters have the same key.
+        """
+        self.assertEqual(filter_key(normalize_filter({"tool": ["GTM", "GA4"]})), filter_key(normalize_filter({"tool": ["GA4", "GTM"]})))
+        self.assertEqual(filter_key(None), ())
+
+    def test_matches(self):
+        """
+        A chunk passes a filter if it has one of the values of each field and its date is in the range.
+        """
+        metadata_filter = normalize_filter({"tool": "GA4", "date_from": "2024-06-01", "date_to": "2024-07-31"})
+        self.assertEqual([matches(doc.metadata, metadata_filter) for doc in CHUNKS], [False, True, False, False])
+        self.assertFalse(matches({"tool": "GA4"}, metadata_filter))
+        self.assertTrue(matches({}, None))
+
+    def test_qdrant_filter(self):
+        """
+        The Qdrant filter has a condition per field and one for the date range.
+        """
+        conditions = qdrant_filter(normalize_filter({"tool": "GA4", "date_from": "2024-06-01"})).must
+        self.assertEqual([condition.key for condition in conditions], ["metadata.tool", "metadata.date"])
+        self.assertEqual(conditions[0].match.any, ["GA4"])
+        self.assertIsNone(conditions[1].range.lte)
+
+    def test_filter_options(self):
+        """
+        The options are the sorted values found in the chunks.
+        """
+        options = filter_options(CHUNKS)
+        self.assertEqual(options["tool"], ["GA4", "GTM"])
+        self.assertEqual(options["category"], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,151 @@
+import unittest
+import os
+import sys
+import tempfile
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts", "doc_extractor"))
+
+CACHE_DIRECTORY = tempfile.TemporaryDirectory()
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("EMBEDDING_MODEL", "text-embedding-3-small")
+os.environ.setdefault("EMBEDDING_CACHE_PATH", os.path.join(CACHE_DIRECTORY.name, "embeddings.sqlite3"))
+
+from flask import Flask
+from langchain_core.embeddings import Embeddings
+from qdrant_client import QdrantClient
+from bulk_upsert import BulkLoader
+from incremental import stored_ids
+
+with mock.patch("google.cloud.storage.Client"):
+    import vectorizer
+
+PARAGRAPHS = ["first paragraph of text", "second paragraph of text", "third paragraph of text"]
+
+
+class CountingEmbeddings(Embeddings):
+    """
+    Deterministic embeddings that count the texts they embed.
+    """
+
+    def __init__(self):
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return [[float(len(text)), 1.0] for text in texts]
+
+    def embed_query(self, text):
+        return [float(len(text)), 1.0]
+
+
+class Request:
+    """
+    A request with a JSON body.
+    """
+
+    def __init__(self, body):
+        self.body = body
+
+    def get_json(self):
+        return self.body
+
+
+class TestVectorizer(unittest.TestCase):
+    """
+    A class that contains unit tests for the vectorizer, with an in-memory Qdrant and the blobs read from a dict.
+    """
+
+    def setUp(self):
+        self.blobs = {}
+        self.embeddings = CountingEmbeddings()
+        self.client = QdrantClient(":memory:")
+        for name, value in (
+            ("qdrant_client", self.client),
+            ("embbeding_client", self.embeddings),
+            ("iter_blob_text", self.iter_blob_text),
+            ("COLLECTION_NAME", "test"),
+            ("EMBEDDING_MODEL", "test-embedding"),
+            ("CHUNK_SIZE", "30"),
+            ("CHUNK_OVERLAP", "0"),
+        ):
+            patcher = mock.patch.object(vectorizer, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def iter_blob_text(self, bucket_name, file_name):
+        # Splits the blob in small segments, so the chunks cross the segment boundaries
+        text = self.blobs[file_name]
+        return (text[start:start + 7] for start in range(0, len(text), 7))
+
+    def vectorize(self, *names):
+        with Flask(__name__).app_context():
+            response, status = vectorizer.main(Request({"objects": [{"bucket": "bucket", "name": name} for name in names]}))
+        self.assertEqual(status, 200)
+        return response.get_json()
+
+    def stored_texts(self, name):
+        points, _ = self.client.scroll("test", limit=100, with_payload=True)
+        return sorted(point.payload["page_content"] for point in points if point.payload["metadata"]["source"] == f"gs://bucket/{name}")
+
+    def test_stream_chunks_cover_the_text(self):
+        """
+        The chunks of a segmented stream hold the whole text, each with its start_index in it.
+        """
+        text = "\n\n".join(PARAGRAPHS)
+        chunks = list(vectorizer.stream_chunks((text[start:start + 5] for start in range(0, len(text), 5)), {"source": "a"}))
+        self.assertEqual([chunk.page_content for chunk in chunks], PARAGRAPHS)
+        for chunk in chunks:
+            self.assertEqual(text[chunk.metadata["start_index"]:].find(chunk.page_content), 0)
+            self.assertEqual(chunk.metadata["source"], "a")
+
+    def test_objects_payload(self):
+        """
+        Every object of an "objects" payload is vectorized, and a single object payload still works.
+        """
+        self.blobs = {"a.md": "\n\n".join(PARAGRAPHS), "b.md": "another document"}
+        result = self.vectorize("a.md", "b.md")
+        self.assertEqual(result["chunks"], {"gs://bucket/a.md": 3, "gs://bucket/b.md": 1})
+        self.assertEqual(result["upload"]["points"], 4)
+        self.assertEqual(self.stored_texts("a.md"), sorted(PARAGRAPHS))
+        self.blobs["c.md"] = "third document"
+        with Flask(__name__).app_context():
+            response, _ = vectorizer.main(Request({"bucket": "bucket", "name": "c.md"}))
+        self.assertEqual(response.get_json()["chunks"], {"gs://bucket/c.md": 1})
+        self.assertEqual(self.client.count("test").count, 5)
+
+    def test_stored_chunks_are_not_embedded_again(self):
+        """
+        A new version of a blob only embeds its changed chunks, and the points of the removed chunks are deleted.
+        """
+        self.blobs = {"a.md": "\n\n".join(PARAGRAPHS)}
+        self.vectorize("a.md")
+        self.embeddings.embedded.clear()
+        self.blobs["a.md"] = "\n\n".join(PARAGRAPHS[:2] + ["changed paragraph"])
+        result = self.vectorize("a.md")
+        self.assertEqual(self.embeddings.embedded, ["changed paragraph"])
+        self.assertEqual(result["upload"]["points"], 1)
+        self.assertEqual(self.stored_texts("a.md"), sorted(PARAGRAPHS[:2] + ["changed paragraph"]))
+
+    def test_repeated_chunks_are_embedded_once(self):
+        """
+        A chunk repeated in a blob is embedded and stored once.
+        """
+        self.blobs = {"a.md": "\n\n".join(PARAGRAPHS[:1] * 3)}
+        result = self.vectorize("a.md")
+        self.assertEqual(result["chunks"], {"gs://bucket/a.md": 3})
+        self.assertEqual(self.embeddings.embedded, PARAGRAPHS[:1])
+        self.assertEqual(len(stored_ids(self.client, "test", "gs://bucket/a.md")), 1)
+
+    def test_bulk_loader_is_used_once_per_payload(self):
+        """
+        All the objects of a payload share the BulkLoader, so the indexing is paused once.
+        """
+        self.blobs = {"a.md": "one", "b.md": "two"}
+        with mock.patch.object(vectorizer, "BulkLoader", wraps=BulkLoader) as loader:
+            self.vectorize("a.md", "b.md")
+        loader.assert_called_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+import unittest
+import datetime
+import json
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts", "doc_extractor"))
+
+from watermark import ExtractionRun, next_watermark, read_watermark, write_watermark
+
+
+class FakeBlob:
+    """
+    A Cloud Storage blob kept in a dict.
+    """
+
+    def __init__(self, blobs, name):
+        self.blobs = blobs
+        self.name = name
+
+    def exists(self):
+        return self.name in self.blobs
+
+    def download_as_text(self):
+        return self.blobs[self.name]
+
+    def upload_from_string(self, content):
+        self.blobs[self.name] = content
+
+
+class FakeStorageClient:
+    """
+    A Cloud Storage client whose blobs are kept in a dict, by gs:// URI.
+    """
+
+    def __init__(self):
+        self.blobs = {}
+
+    def bucket(self, bucket_name):
+        client = self
+
+        class Bucket:
+            def blob(self, blob_name):
+                return FakeBlob(client.blobs, f"gs://{bucket_name}/{blob_name}")
+
+        return Bucket()
+
+
+class TestWatermark(unittest.TestCase):
+    """
+    A class that contains unit tests for the storage and the computation of the watermark.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_local_watermark(self):
+        """
+        A local watermark is None until it is written, and dates are stored in ISO format.
+        """
+        path = os.path.join(self.directory.name, "state", "watermark.json")
+        self.assertIsNone(read_watermark(path))
+        write_watermark(path, datetime.datetime(2024, 5, 1, 12, 30))
+        self.assertEqual(read_watermark(path), "2024-05-01T12:30:00")
+        write_watermark(path, 42)
+        self.assertEqual(read_watermark(path), 42)
+
+    def test_gcs_watermark(self):
+        """
+        A gs:// watermark is stored in the blob of the URI.
+        """
+        client = FakeStorageClient()
+        self.assertIsNone(read_watermark("gs://bucket/state/watermark.json", client))
+        write_watermark("gs://bucket/state/watermark.json", datetime.date(2024, 5, 1), client)
+        self.assertEqual(json.loads(client.blobs["gs://bucket/state/watermark.json"]), {"watermark": "2024-05-01"})
+        self.assertEqual(read_watermark("gs://bucket/state/watermark.json", client), "2024-05-01")
+
+    def test_next_watermark(self):
+        """
+        The watermark advances to the highest value read, but stays below the first failed row, and NULLs are ignored.
+        """
+        watermarks = [("a", 1), ("b", 3), ("c", None), ("d", 2)]
+        self.assertEqual(next_watermark(watermarks, set()), 3)
+        self.assertEqual(next_watermark(watermarks, {"d"}), 1)
+        self.assertEqual(next_watermark(watermarks, {"c"}), 3)
+        self.assertIsNone(next_watermark(watermarks, {"a"}))
+        self.assertIsNone(next_watermark([], set()))
+
+
+class TestExtractionRun(unittest.TestCase):
+    """
+    A class that contains unit tests for the tracking of the rows of a URL extraction run.
+    """
+
+    def test_rows_are_tracked(self):
+        """
+        The rows are yielded without their watermark, which is recorded with their URL.
+        """
+        run = ExtractionRun()
+        rows = [{"url": "a", "tool": "x", "watermark": 1}, {"url": "b", "tool": "y", "watermark": 2}]
+        self.assertEqual(list(run.track(iter(rows))), [{"url": "a", "tool": "x"}, {"url": "b", "tool": "y"}])
+        self.assertEqual(run.watermarks, [("a", 1), ("b", 2)])
+        self.assertEqual(run.consumed, {"a": {"url": "a", "tool": "x"}, "b": {"url": "b", "tool": "y"}})
+
+    def test_reprocess_items(self):
+        """
+        The rows read in the run are reused and only the other URLs are looked up, without moving the watermark.
+        """
+        run = ExtractionRun()
+        list(run.track([{"url": "a", "watermark": 5}]))
+        lookups = []
+
+        def lookup(urls):
+            lookups.append(urls)
+            return [{"url": url, "watermark": 1} for url in urls]
+
+        self.assertEqual(run.reprocess_items(["a", "old"], lookup), [{"url": "a"}, {"url": "old"}])
+        self.assertEqual(lookups, [["old"]])
+        self.assertEqual(run.reprocess_items(["old"], lookup), [{"url": "old"}])
+        self.assertEqual(lookups, [["old"]])
+        self.assertEqual(run.next_watermark(), 5)
+
+    def test_failed_reprocess_blocks_the_watermark(self):
+        """
+        A row of the run that fails when it is reprocessed keeps the watermark below it.
+        """
+        run = ExtractionRun()
+        list(run.track([{"url": "a", "watermark": 1}, {"url": "b", "watermark": 2}, {"url": "c", "watermark": 3}]))
+        run.reprocess_items(["b"], lambda urls: [])
+        run.failed.update(["b"])
+        self.assertEqual(run.next_watermark(), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
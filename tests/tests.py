@@ -1,9 +1,15 @@
 import unittest
+import os
+import uuid
 import requests
 
 gcp = "URL"
 local = "http://localhost:8080"
 url_global = local
+# Cloud function rodando localmente contra o emulador do Firestore:
+#   firebase emulators:start --only firestore
+#   FIRESTORE_EMULATOR_HOST=localhost:8085 GOOGLE_CLOUD_PROJECT=martechito functions-framework --source src/cloud_function/main.py --target insert_to_firestore --port 8081
+cloud_function_url = "http://localhost:8081"
 
 class TestBlueprint(unittest.TestCase):
     """
@@ -28,6 +34,26 @@ class TestBlueprint(unittest.TestCase):
         self.assertEqual(status_code, 200, f"Erro: {status_code}")
         print("Vectorizer passou!")
         
+    def test_vectorizer_multiple_objects(self):
+        """
+        Test the vectorizer endpoint with several objects in a single request.
+
+        This method sends a POST request with a list of objects to the vectorizer endpoint and checks if the response status code is 200.
+        """
+        url = url_global
+        path = "vectorizer"
+        full_url = f"{url}/{path}"
+        data = {
+            "objects": [
+                {"bucket":"markdown-file", "name":"attribution.txt"},
+                {"bucket":"markdown-file", "name":"attribution.md"}
+            ]
+        }
+        response = requests.post(full_url, json=data)
+        status_code = response.status_code
+        self.assertEqual(status_code, 200, f"Erro: {status_code}")
+        print("Vectorizer com múltiplos objetos passou!")
+        
     def test_url_extractor(self):
         """
         Test the URL extractor endpoint.
@@ -41,6 +67,72 @@ class TestBlueprint(unittest.TestCase):
         status_code = response.status_code
         self.assertEqual(status_code, 200, f"Erro: {status_code}")
         print("URL Extractor passou!")
+
+
+class TestCloudFunction(unittest.TestCase):
+    """
+    A class that contains tests for the interaction logging cloud function, run against the Firestore emulator.
+    """
+
+    def _interaction(self, email, index):
+        return {
+            "prompt_data": {"question": f"question {index}", "answer": f"answer {index}", "timestamp": f"2024-01-01T00:00:{index:02d}Z"},
+            "user_info": {"email": email, "displayName": "Test", "uid": "test"}
+        }
+
+    def _stored(self, email):
+        # Lê os documentos gravados direto do emulador, quando ele está configurado
+        if not os.getenv("FIRESTORE_EMULATOR_HOST"):
+            return None
+        from google.cloud import firestore
+        return list(firestore.Client().collection(f"users/{email}/interactions").stream())
+
+    def test_single_interaction(self):
+        """
+        Test the cloud function with a single interaction, the format sent before the client buffer.
+
+        This method sends a POST request with one interaction and checks if the response status code is 200 and one document was written.
+        """
+        email = f"{uuid.uuid4().hex}@test.com"
+        response = requests.post(cloud_function_url, json=self._interaction(email, 0))
+        self.assertEqual(response.status_code, 200, f"Erro: {response.status_code}")
+        self.assertEqual(response.json()["written"], 1)
+        stored = self._stored(email)
+        if stored is not None:
+            self.assertEqual(len(stored), 1)
+        print("Interação única passou!")
+
+    def test_batched_interactions(self):
+        """
+        Test the cloud function with a batch of interactions, as flushed by the client buffer.
+
+        This method sends a POST request with several interactions and checks if all of them were written and the write stats are reported.
+        """
+        email = f"{uuid.uuid4().hex}@test.com"
+        interactions = [self._interaction(email, index) for index in range(20)]
+        response = requests.post(cloud_function_url, json={"interactions": interactions})
+        self.assertEqual(response.status_code, 200, f"Erro: {response.status_code}")
+        body = response.json()
+        self.assertEqual(body["written"], 20)
+        self.assertIn("p95_ms", body["stats"])
+        self.assertIn("writes_per_second", body["stats"])
+        stored = self._stored(email)
+        if stored is not None:
+            self.assertEqual(len(stored), 20)
+        stats = requests.get(cloud_function_url).json()
+        self.assertGreaterEqual(stats[body["writer"]]["writes"], 20)
+        print("Interações em lote passaram!")
+
+    def test_invalid_interaction(self):
+        """
+        Test the cloud function with an interaction without the user email.
+
+        This method sends a POST request with an invalid interaction in a batch and checks if the response status code is 400.
+        """
+        interactions = [self._interaction("valid@test.com", 0), {"prompt_data": {"question": "q"}, "user_info": {}}]
+        response = requests.post(cloud_function_url, json={"interactions": interactions})
+        self.assertEqual(response.status_code, 400, f"Erro: {response.status_code}")
+        print("Interação inválida passou!")
         
     
     